@@ -7,11 +7,16 @@ import logging
 from flask import Flask, g, request, jsonify
 from flask.logging import default_handler
 from flask_cors import CORS
-from app.models.mongodb import mongo, config_oauth
+from app.models.mongodb import (
+    mongo, config_cache, config_oauth, config_password_hashing, config_storage
+)
 from app.routes.health import health_bp
 from app.routes.api import api_bp
 from app.routes.auth import auth_bp
 from app.utils.response import start_timer, error_response
+from app.cli import register_commands
+from app.models.expiry import start_expiry_sweeper
+from app.models.archival import start_conversation_archiver
 
 def create_app(config=None):
     """Create and configure the Flask application."""
@@ -27,6 +32,65 @@ def create_app(config=None):
         LOG_LEVEL=os.environ.get('LOG_LEVEL', 'INFO'),
         ADMIN_USERS=os.environ.get('ADMIN_USERS', '').split(','),
         CORS_ORIGINS=os.environ.get('CORS_ORIGINS', '*'),
+        TOKEN_CACHE_SIZE=int(os.environ.get('TOKEN_CACHE_SIZE', 10000)),
+        TOKEN_CACHE_TTL=int(os.environ.get('TOKEN_CACHE_TTL', 300)),
+        TOKEN_CACHE_NEGATIVE_TTL=int(os.environ.get('TOKEN_CACHE_NEGATIVE_TTL', 5)),
+        TOKEN_CACHE_LOCAL_TTL=int(os.environ.get('TOKEN_CACHE_LOCAL_TTL', 5)),
+        CLIENT_CACHE_SIZE=int(os.environ.get('CLIENT_CACHE_SIZE', 1000)),
+        CLIENT_CACHE_TTL=int(os.environ.get('CLIENT_CACHE_TTL', 300)),
+        OAUTH2_TOKEN_FORMAT=os.environ.get('OAUTH2_TOKEN_FORMAT', 'opaque'),
+        OAUTH2_JWT_SECRET_KEY=os.environ.get('JWT_SECRET_KEY'),
+        OAUTH2_JWT_ISSUER=os.environ.get('OAUTH2_JWT_ISSUER'),
+        TOKEN_REVOCATION_REFRESH=int(os.environ.get('TOKEN_REVOCATION_REFRESH', 30)),
+        AUTH_CODE_STORE=os.environ.get('AUTH_CODE_STORE', 'mongo'),
+        AUTH_CODE_REDIS_URL=os.environ.get('AUTH_CODE_REDIS_URL') or os.environ.get('CACHE_REDIS_URL'),
+        AUTH_CODE_LIFETIME=int(os.environ.get('AUTH_CODE_LIFETIME', 600)),
+        PASSWORD_HASH_ALGORITHM=os.environ.get('PASSWORD_HASH_ALGORITHM', 'scrypt'),
+        PASSWORD_HASH_WORK_FACTOR=int(os.environ['PASSWORD_HASH_WORK_FACTOR']) if os.environ.get('PASSWORD_HASH_WORK_FACTOR') else None,
+        PASSWORD_HASH_POOL_SIZE=int(os.environ.get('PASSWORD_HASH_POOL_SIZE', 2)),
+        PASSWORD_HASH_MAX_CONCURRENCY=int(os.environ.get('PASSWORD_HASH_MAX_CONCURRENCY', 4)),
+        PASSWORD_HASH_TIMEOUT=float(os.environ.get('PASSWORD_HASH_TIMEOUT', 5)),
+        CLIENT_CREDENTIALS_REUSE=os.environ.get('CLIENT_CREDENTIALS_REUSE', 'false').lower() == 'true',
+        CLIENT_CREDENTIALS_REUSE_MIN_REMAINING=float(os.environ.get('CLIENT_CREDENTIALS_REUSE_MIN_REMAINING', 0.5)),
+        CLIENT_ISSUANCE_FLUSH_INTERVAL=float(os.environ.get('CLIENT_ISSUANCE_FLUSH_INTERVAL', 10)),
+        API_KEY_CACHE_REFRESH=int(os.environ.get('API_KEY_CACHE_REFRESH', 60)),
+        INTROSPECTION_BATCH_LIMIT=int(os.environ.get('INTROSPECTION_BATCH_LIMIT', 100)),
+        INTROSPECTION_CACHE_MAX_AGE=int(os.environ.get('INTROSPECTION_CACHE_MAX_AGE', 60)),
+        PAGE_SIZE_DEFAULT=int(os.environ.get('PAGE_SIZE_DEFAULT', 100)),
+        PAGE_SIZE_MAX=int(os.environ.get('PAGE_SIZE_MAX', 500)),
+        DOCUMENT_CHUNK_THRESHOLD=int(os.environ.get('DOCUMENT_CHUNK_THRESHOLD', 1024 * 1024)),
+        DOCUMENT_CHUNK_SIZE=int(os.environ.get('DOCUMENT_CHUNK_SIZE', 255 * 1024)),
+        DOCUMENT_BATCH_LIMIT=int(os.environ.get('DOCUMENT_BATCH_LIMIT', 500)),
+        DOCUMENT_BATCH_MAX_BYTES=int(os.environ.get('DOCUMENT_BATCH_MAX_BYTES', 16 * 1024 * 1024)),
+        CONVERSATION_WRITE_MODE=os.environ.get('CONVERSATION_WRITE_MODE', 'sync'),
+        CONVERSATION_FLUSH_INTERVAL_MS=int(os.environ.get('CONVERSATION_FLUSH_INTERVAL_MS', 50)),
+        CONVERSATION_FLUSH_BATCH_SIZE=int(os.environ.get('CONVERSATION_FLUSH_BATCH_SIZE', 100)),
+        CONVERSATION_BUFFER_MAX=int(os.environ.get('CONVERSATION_BUFFER_MAX', 10000)),
+        CONVERSATION_STORAGE=os.environ.get('CONVERSATION_STORAGE', 'flat'),
+        CONVERSATION_BUCKET_SIZE=int(os.environ.get('CONVERSATION_BUCKET_SIZE', 200)),
+        CONVERSATION_BUCKET_MAX_BYTES=int(os.environ.get('CONVERSATION_BUCKET_MAX_BYTES', 1024 * 1024)),
+        CONVERSATION_BUCKET_SPAN=int(os.environ.get('CONVERSATION_BUCKET_SPAN', 86400)),
+        CONVERSATION_STREAM_MODE=os.environ.get('CONVERSATION_STREAM_MODE', 'auto'),
+        CONVERSATION_STREAM_POLL_INTERVAL=float(os.environ.get('CONVERSATION_STREAM_POLL_INTERVAL', 1.0)),
+        CONVERSATION_STREAM_QUEUE_SIZE=int(os.environ.get('CONVERSATION_STREAM_QUEUE_SIZE', 1000)),
+        CONVERSATION_STREAM_HEARTBEAT=int(os.environ.get('CONVERSATION_STREAM_HEARTBEAT', 15)),
+        CONVERSATION_STREAM_MAX_DURATION=int(os.environ.get('CONVERSATION_STREAM_MAX_DURATION', 300)),
+        CONVERSATION_STREAM_RETRY_MS=int(os.environ.get('CONVERSATION_STREAM_RETRY_MS', 2000)),
+        CONVERSATION_STREAM_MAX_PER_WORKER=int(os.environ.get('CONVERSATION_STREAM_MAX_PER_WORKER', 4)),
+        CONVERSATION_ARCHIVE_ENABLED=os.environ.get('CONVERSATION_ARCHIVE_ENABLED', 'false').lower() == 'true',
+        CONVERSATION_ARCHIVE_AFTER_DAYS=int(os.environ.get('CONVERSATION_ARCHIVE_AFTER_DAYS', 90)),
+        CONVERSATION_ARCHIVE_INTERVAL=int(os.environ.get('CONVERSATION_ARCHIVE_INTERVAL', 0)),
+        CONVERSATION_ARCHIVE_BATCH_SIZE=int(os.environ.get('CONVERSATION_ARCHIVE_BATCH_SIZE', 1000)),
+        CONVERSATION_ARCHIVE_CODEC=os.environ.get('CONVERSATION_ARCHIVE_CODEC', 'zlib'),
+        CONVERSATION_ARCHIVE_CHUNK_SIZE=int(os.environ.get('CONVERSATION_ARCHIVE_CHUNK_SIZE', 1000)),
+        DOCUMENT_COMPRESSION=os.environ.get('DOCUMENT_COMPRESSION', 'none'),
+        DOCUMENT_COMPRESSION_LEVEL=int(os.environ['DOCUMENT_COMPRESSION_LEVEL']) if os.environ.get('DOCUMENT_COMPRESSION_LEVEL') else None,
+        DOCUMENT_COMPRESSION_THRESHOLD=int(os.environ.get('DOCUMENT_COMPRESSION_THRESHOLD', 4096)),
+        CACHE_REDIS_URL=os.environ.get('CACHE_REDIS_URL'),
+        CACHE_REDIS_NAMESPACE=os.environ.get('CACHE_REDIS_NAMESPACE', 'cache'),
+        EXPIRY_GRACE_PERIOD=int(os.environ.get('EXPIRY_GRACE_PERIOD', 3600)),
+        EXPIRY_SWEEP_INTERVAL=int(os.environ.get('EXPIRY_SWEEP_INTERVAL', 0)),
+        EXPIRY_SWEEP_BATCH_SIZE=int(os.environ.get('EXPIRY_SWEEP_BATCH_SIZE', 1000)),
     )
     
     # Override with any provided configuration
@@ -44,6 +108,13 @@ def create_app(config=None):
     
     # Initialize extensions
     mongo.init_app(app)
+    config_cache(app)
+    config_password_hashing(app)
+    config_storage(app)
+    
+    # Optional periodic purge of expired tokens, codes and API keys
+    start_expiry_sweeper(app)
+    start_conversation_archiver(app)
     
     # Configure OAuth 2.0
     config_oauth(app)
@@ -59,6 +130,9 @@ def create_app(config=None):
     app.register_blueprint(api_bp)
     app.register_blueprint(auth_bp)
     
+    # Register CLI commands
+    register_commands(app)
+    
     # Error handlers
     @app.errorhandler(404)
     def not_found(e):
@@ -0,0 +1,229 @@
+"""
+Flask CLI commands.
+
+Run with ``flask --app "app:create_app()" <command>``.
+"""
+import itertools
+import json
+import random
+from datetime import datetime, timedelta, UTC
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from app.models.indexes import ensure_indexes, explain_queries
+from app.models.expiry import sweep_expired
+from app.models.archival import archive_conversations
+from app.models.compression import CODECS, benchmark
+from app.models.mongodb import Document, Conversation, ConversationBucket, create_bucket_store
+from app.models import buckets as bucket_storage
+
+indexes_cli = AppGroup('indexes', help='Manage MongoDB indexes.')
+expiry_cli = AppGroup('expiry', help='Purge expired documents.')
+documents_cli = AppGroup('documents', help='Inspect document storage.')
+conversations_cli = AppGroup('conversations', help='Manage conversation storage.')
+
+@indexes_cli.command('ensure')
+def ensure_indexes_command():
+    """Create every index declared by the models."""
+    expiry_grace = current_app.config['EXPIRY_GRACE_PERIOD']
+    for collection, names in ensure_indexes(expiry_grace).items():
+        click.echo(f"{collection}: {', '.join(names)}")
+
+@indexes_cli.command('report')
+def index_report_command():
+    """Explain every model query shape and flag collection scans."""
+    problems = 0
+    for entry in explain_queries():
+        if entry['collscan']:
+            status = 'COLLSCAN'
+        elif entry['blocking_sort']:
+            status = 'SORT'
+        else:
+            status = 'OK'
+        if status != 'OK':
+            problems += 1
+        click.echo(f"{status:9} {entry['query']:45} {' <- '.join(entry['stages'])}")
+    
+    if problems:
+        raise click.ClickException(f"{problems} query shape(s) not served by an index")
+
+@expiry_cli.command('sweep')
+def sweep_command():
+    """Delete expired tokens, authorization codes and API keys now."""
+    deleted = sweep_expired(
+        current_app.config['EXPIRY_GRACE_PERIOD'],
+        current_app.config['EXPIRY_SWEEP_BATCH_SIZE']
+    )
+    for collection, count in deleted.items():
+        click.echo(f"{collection}: {count} deleted")
+
+def _sample_payloads(count, size):
+    """Build JSON contents of roughly size bytes from a small vocabulary."""
+    words = ['project', 'document', 'section', 'summary', 'status', 'draft',
+             'review', 'owner', 'deadline', 'budget', 'milestone', 'notes']
+    rng = random.Random(0)
+    payloads = []
+    for _ in range(count):
+        items = []
+        while len(json.dumps(items)) < size:
+            items.append({
+                'title': ' '.join(rng.choices(words, k=4)),
+                'body': ' '.join(rng.choices(words, k=24)),
+                'score': rng.randint(0, 1000)
+            })
+        payloads.append({'items': items})
+    return payloads
+
+@documents_cli.command('benchmark-compression')
+@click.option('--count', default=200, show_default=True, help='Documents to write per codec.')
+@click.option('--size', default=16384, show_default=True, help='Approximate bytes per synthetic document.')
+@click.option('--level', type=int, default=None, help='Compression level (codec default if omitted).')
+@click.option('--sample', is_flag=True, help='Use inline contents sampled from the documents collection.')
+def benchmark_compression_command(count, size, level, sample):
+    """Compare write/read latency and stored size for each codec."""
+    if sample:
+        payloads = [
+            document['content'] for document in Document._get_collection().aggregate([
+                {'$match': {'content': {'$ne': None}, 'content_codec': {'$exists': False}}},
+                {'$sample': {'size': count}},
+                {'$project': {'_id': 0, 'content': 1}}
+            ])
+        ]
+        if not payloads:
+            raise click.ClickException('No uncompressed inline documents to sample')
+    else:
+        payloads = _sample_payloads(count, size)
+    
+    collection = Document._get_collection().database['documents_compression_benchmark']
+    codecs = [None] + [name for name in CODECS]
+    try:
+        click.echo(f"{'codec':6} {'level':>5} {'write ms':>9} {'read ms':>8} {'stored':>12} {'ratio':>6} {'bson size':>12}")
+        for codec in codecs:
+            try:
+                result = benchmark(collection, payloads, codec, level)
+            except ValueError as e:
+                click.echo(f"{codec:6} skipped: {e}")
+                continue
+            click.echo(
+                f"{result['codec']:6} {str(result['level'] or '-'):>5} "
+                f"{result['write_ms']:>9} {result['read_ms']:>8} "
+                f"{result['stored_bytes']:>12} {result['ratio']:>6} {result['data_size']:>12}"
+            )
+    finally:
+        collection.drop()
+
+@conversations_cli.command('migrate-to-buckets')
+@click.option('--project', 'project_ids', multiple=True, help='Only migrate these projects (repeatable).')
+@click.option('--keep-flat', is_flag=True, help='Copy instead of move; projects that already have buckets are skipped.')
+def migrate_to_buckets_command(project_ids, keep_flat):
+    """Pack per-message conversation documents into buckets.
+    
+    Messages are moved: each batch of buckets is written before the
+    documents it holds are deleted. Buckets take the ``_id`` of their first
+    message, so a run interrupted between the two re-packs the same buckets
+    and skips them instead of writing them twice.
+    """
+    store = create_bucket_store(current_app.config)
+    flat = Conversation._get_collection()
+    buckets = ConversationBucket._get_collection()
+    
+    for project_id in project_ids or flat.distinct('project_id'):
+        if keep_flat and buckets.find_one({'project_id': project_id}, {'_id': 1}):
+            click.echo(f"{project_id}: skipped, already has buckets")
+            continue
+        
+        messages = flat.find(
+            {'project_id': project_id},
+            sort=[('timestamp', 1), ('_id', 1)],
+            batch_size=Conversation.STREAM_BATCH_SIZE
+        )
+        moved = written = 0
+        batch = []
+        for bucket in itertools.chain(store.pack(messages), [None]):
+            if bucket is not None:
+                batch.append(bucket)
+            if batch and (bucket is None or len(batch) >= 100):
+                store.insert(batch)
+                if not keep_flat:
+                    flat.delete_many({'_id': {'$in': [
+                        message['_id'] for packed in batch for message in packed['messages']
+                    ]}})
+                moved += sum(packed['count'] for packed in batch)
+                written += len(batch)
+                batch = []
+        click.echo(f"{project_id}: {moved} messages in {written} buckets")
+
+@conversations_cli.command('benchmark-buckets')
+@click.option('--projects', default=5, show_default=True, help='Projects to spread messages over.')
+@click.option('--messages', default=2000, show_default=True, help='Messages per project.')
+@click.option('--page-size', default=100, show_default=True, help='Messages in the latest-page read.')
+def benchmark_buckets_command(projects, messages, page_size):
+    """Compare flat and bucketed conversation storage.
+    
+    Reports documents and index entries stored, index size (where the
+    server reports it), write latency per message, and per project the
+    latency and read amplification of a full history and a latest-page read.
+    """
+    db = Conversation._get_collection().database
+    flat = db['conversations_benchmark_flat']
+    buckets = db['conversation_buckets_benchmark']
+    for index in Conversation.INDEXES:
+        flat.create_indexes([index])
+    for index in ConversationBucket.INDEXES:
+        buckets.create_indexes([index])
+    
+    rng = random.Random(0)
+    start = datetime.now(UTC) - timedelta(seconds=messages * projects * 30)
+    items = []
+    for n in range(messages * projects):
+        items.append({
+            'message_id': f'benchmark-{n}',
+            'project_id': f'benchmark-project-{n % projects}',
+            'timestamp': start + timedelta(seconds=n * 30),
+            'user': rng.choice(['alice', 'bob', 'carol']),
+            'message': ' '.join(rng.choices(['ok', 'ship it', 'looks good', 'one more fix', 'merged'], k=6)),
+            'metadata': {}
+        })
+    
+    try:
+        results = bucket_storage.benchmark(
+            flat, buckets, create_bucket_store(current_app.config), items, page_size
+        )
+    finally:
+        flat.drop()
+        buckets.drop()
+    
+    click.echo(f"{'layout':9} {'documents':>10} {'index entries':>14} {'index bytes':>12} {'write ms':>9} "
+               f"{'history ms':>11} {'history amp':>12} {'page ms':>8} {'page amp':>9}")
+    for layout, result in results.items():
+        click.echo(
+            f"{layout:9} {result['documents']:>10} {result['index_entries']:>14} "
+            f"{str(result['index_bytes'] or 'n/a'):>12} {result['write_ms']:>9} "
+            f"{result['history']['ms']:>11} {result['history']['amplification']:>12} "
+            f"{result['latest_page']['ms']:>8} {result['latest_page']['amplification']:>9}"
+        )
+
+@conversations_cli.command('archive')
+@click.option('--older-than', 'max_age_days', type=int, default=None,
+              help='Archive messages older than this many days (CONVERSATION_ARCHIVE_AFTER_DAYS if omitted).')
+def archive_command(max_age_days):
+    """Move old conversation messages into the compressed archive now."""
+    if max_age_days is None:
+        max_age_days = current_app.config['CONVERSATION_ARCHIVE_AFTER_DAYS']
+    try:
+        counts = archive_conversations(
+            max_age_days, current_app.config['CONVERSATION_ARCHIVE_BATCH_SIZE']
+        )
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    click.echo(
+        f"{counts['messages']} messages archived in {counts['chunks']} chunks, "
+        f"{counts['deleted']} hot documents removed"
+    )
+
+def register_commands(app):
+    """Attach the CLI command groups to the app."""
+    app.cli.add_command(indexes_cli)
+    app.cli.add_command(expiry_cli)
+    app.cli.add_command(documents_cli)
+    app.cli.add_command(conversations_cli)
@@ -4,6 +4,7 @@ import logging
 import time
 from flask import Flask
 from .models.mongodb import mongo, ApiKey
+from .models.indexes import ensure_indexes
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -23,14 +24,17 @@ def create_app():
     return app
 
 def init_db():
-    """Initialize the database with required collections and default data."""
+    """Initialize the database with required collections and default data.
+    
+    Model indexes are synced on every start; default data is only created
+    once per container.
+    """
     # Check if we've already initialized in this container
-    if os.path.exists(INIT_FLAG_FILE):
-        logger.info("Database already initialized in this container. Skipping initialization.")
-        return
+    already_initialized = os.path.exists(INIT_FLAG_FILE)
     
-    # Add a small delay to ensure MongoDB is fully ready
-    time.sleep(2)
+    if not already_initialized:
+        # Add a small delay to ensure MongoDB is fully ready
+        time.sleep(2)
     
     app = create_app()
     max_retries = 5
@@ -42,6 +46,15 @@ def init_db():
                 # Try to ping the database to make sure it's ready
                 mongo.cx.admin.command('ping')
                 
+                # Create any indexes declared by the models (idempotent)
+                expiry_grace = int(os.getenv('EXPIRY_GRACE_PERIOD', 3600))
+                for collection, names in ensure_indexes(expiry_grace).items():
+                    logger.info(f"Indexes on {collection}: {', '.join(names)}")
+                
+                if already_initialized:
+                    logger.info("Database already initialized in this container. Skipping initialization.")
+                    return
+                
                 # Check if the default API key exists
                 default_api_key = os.getenv('API_KEY')
                 if not default_api_key:
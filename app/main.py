@@ -129,7 +129,9 @@ def get_documents(response, project_id):
             return response.error("Project not found", code=404)
         
         document_type = request.args.get('type')
-        documents = Document.get_by_project(project_id, document_type)
+        documents = Document.get_by_project(
+            project_id, document_type, Document.projection(request.args.get('fields'))
+        )
         
         return response.success(
             data=documents
@@ -187,7 +189,9 @@ def get_conversation_history(response, project_id):
             return response.error("Project not found", code=404)
         
         limit = request.args.get('limit', 100, type=int)
-        conversation_history = Conversation.get_by_project(project_id, limit)
+        conversation_history = Conversation.get_by_project(
+            project_id, limit, Conversation.projection(request.args.get('fields'))
+        )
         
         return response.success(
             data=conversation_history
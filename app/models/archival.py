@@ -0,0 +1,132 @@
+"""
+Tiered archival of old conversation history.
+
+Recent messages stay in the hot tier (``conversations``, or its buckets when
+``CONVERSATION_STORAGE`` is bucketed). With ``CONVERSATION_ARCHIVE_ENABLED``
+set, messages older than ``CONVERSATION_ARCHIVE_AFTER_DAYS`` are moved, in batches, into compressed
+chunks in ``conversation_archive`` (see ``ArchiveStore``), which keeps the
+hot collection and its indexes small enough to stay in memory. Reads through
+``Conversation`` continue into the archive transparently, so clients paging
+back far enough never notice the move.
+
+Each batch is written to the archive before it is removed from the hot tier.
+An interrupted run leaves the batch in both tiers until the next run finds
+its chunks already written and finishes deleting it.
+"""
+import logging
+import threading
+from datetime import datetime, timedelta, UTC
+from app.models.mongodb import Conversation, ConversationBucket
+
+logger = logging.getLogger(__name__)
+
+def _flat_batches(project_id, cutoff, batch_size):
+    collection = Conversation._get_collection()
+    while True:
+        documents = list(collection.find(
+            {'project_id': project_id, 'timestamp': {'$lt': cutoff}},
+            sort=[('timestamp', 1), ('_id', 1)],
+            limit=batch_size
+        ))
+        if not documents:
+            return
+        yield documents, documents
+        if len(documents) < batch_size:
+            return
+
+def _bucket_batches(project_id, cutoff, batch_size):
+    store = Conversation.buckets
+    collection = ConversationBucket._get_collection()
+    # Whole windows only: buckets of later windows hold no older messages,
+    # so everything left in the hot tier stays newer than the archive
+    cutoff = store.window(cutoff)
+    limit = max(1, batch_size // store.max_items)
+    while True:
+        buckets = list(collection.find(
+            {'project_id': project_id, 'end': {'$lt': cutoff}},
+            sort=[('end', 1), ('start', 1), ('_id', 1)],
+            limit=limit
+        ))
+        if not buckets:
+            return
+        items = sorted(
+            (item for bucket in buckets for item in bucket[store.items_field]),
+            key=lambda item: (item['timestamp'], item['_id'])
+        )
+        yield buckets, items
+        if len(buckets) < limit:
+            return
+
+def archive_conversations(max_age_days=90, batch_size=1000):
+    """Move messages older than max_age_days into the archive tier.
+    
+    Args:
+        max_age_days (int): Age in days after which messages are archived.
+        batch_size (int): Maximum messages moved per round trip.
+    
+    Returns:
+        dict: Messages and archive chunks written, and hot documents
+        deleted.
+    
+    Raises:
+        RuntimeError: If ``CONVERSATION_ARCHIVE_ENABLED`` is not set, as
+            reads would then not find the archived messages.
+    """
+    if Conversation.archive is None:
+        raise RuntimeError('Conversation archival is disabled (CONVERSATION_ARCHIVE_ENABLED)')
+    cutoff = datetime.now(UTC) - timedelta(days=max_age_days)
+    if Conversation.buckets is not None:
+        collection, batches = ConversationBucket._get_collection(), _bucket_batches
+    else:
+        collection, batches = Conversation._get_collection(), _flat_batches
+    
+    counts = {'messages': 0, 'chunks': 0, 'deleted': 0}
+    for project_id in collection.distinct('project_id'):
+        for documents, items in batches(project_id, cutoff, batch_size):
+            counts['chunks'] += Conversation.archive.archive(items)
+            counts['messages'] += len(items)
+            counts['deleted'] += collection.delete_many(
+                {'_id': {'$in': [document['_id'] for document in documents]}}
+            ).deleted_count
+    return counts
+
+class ConversationArchiver(threading.Thread):
+    """Daemon thread running ``archive_conversations`` every ``interval`` seconds."""
+    
+    def __init__(self, app, interval, max_age_days=90, batch_size=1000):
+        super().__init__(name='conversation-archiver', daemon=True)
+        self.app = app
+        self.interval = interval
+        self.max_age_days = max_age_days
+        self.batch_size = batch_size
+        self.stopped = threading.Event()
+    
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                with self.app.app_context():
+                    counts = archive_conversations(self.max_age_days, self.batch_size)
+                logger.debug(f"Conversation archival moved {counts}")
+            except Exception as e:
+                logger.warning(f"Conversation archival failed: {e}")
+    
+    def stop(self):
+        self.stopped.set()
+
+def start_conversation_archiver(app):
+    """Start the archiver if archival is enabled with an interval set.
+    
+    Returns:
+        The running ConversationArchiver, or None when disabled.
+    """
+    interval = app.config.get('CONVERSATION_ARCHIVE_INTERVAL') or 0
+    if not app.config.get('CONVERSATION_ARCHIVE_ENABLED') or interval <= 0:
+        return None
+    archiver = ConversationArchiver(
+        app,
+        interval,
+        max_age_days=app.config.get('CONVERSATION_ARCHIVE_AFTER_DAYS', 90),
+        batch_size=app.config.get('CONVERSATION_ARCHIVE_BATCH_SIZE', 1000)
+    )
+    archiver.start()
+    return archiver
@@ -0,0 +1,402 @@
+"""
+Bucketed storage of small, append-only documents.
+
+Instead of one document per item, items sharing a key are packed into
+bucket documents covering a time window and holding at most ``max_items``
+items or ``max_bytes`` of BSON. Appends are single atomic ``$push``
+upserts, and reading a history touches one document (and one index entry)
+per bucket rather than per item.
+
+A bucket looks like::
+
+    {key_field: ..., 'window': <window start>, 'start': <first item>,
+     'end': <last item>, 'count': n, 'bytes': b, items_field: [...]}
+
+Items keep their own ``_id`` so they can be paged with the same
+``(sort field, _id)`` cursors as unbucketed documents.
+"""
+import time
+from datetime import datetime, UTC
+import bson
+from bson.objectid import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure
+from app.models.compression import CODECS, content_compressor
+from app.models.pagination import iter_page
+
+class BucketStore:
+    """Appends items to, and reads them back from, a bucket collection.
+
+    Args:
+        get_collection: Callable returning the bucket collection.
+        key_field (str): Field grouping items into buckets, such as
+            ``project_id``.
+        sort_field (str): Insertion-ordered item field, such as ``timestamp``.
+        items_field (str): Name of the array holding a bucket's items.
+        max_items (int): Items per bucket.
+        max_bytes (int): BSON bytes of items per bucket.
+        span (int): Seconds of time covered by one bucket.
+    """
+
+    def __init__(self, get_collection, key_field, sort_field, items_field,
+                 max_items=200, max_bytes=1024 * 1024, span=86400):
+        self.get_collection = get_collection
+        self.key_field = key_field
+        self.sort_field = sort_field
+        self.items_field = items_field
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.span = span
+
+    def configure(self, max_items=None, max_bytes=None, span=None):
+        """Update bucket limits; existing buckets are left as they are."""
+        if max_items is not None:
+            self.max_items = max_items
+        if max_bytes is not None:
+            self.max_bytes = max_bytes
+        if span is not None:
+            self.span = span
+
+    def window(self, moment):
+        """Start of the bucket window containing moment."""
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=UTC)
+        return datetime.fromtimestamp(int(moment.timestamp()) // self.span * self.span, UTC)
+
+    def _append(self, key, window, items):
+        size = sum(len(bson.encode(item)) for item in items)
+        moments = [item[self.sort_field] for item in items]
+        # A bucket is only reused while the new items fit; otherwise the
+        # upsert starts a new one. Batches larger than a bucket get their own.
+        return UpdateOne(
+            {
+                self.key_field: key,
+                'window': window,
+                'count': {'$lte': self.max_items - len(items)},
+                'bytes': {'$lte': self.max_bytes - size}
+            },
+            {
+                '$push': {self.items_field: {'$each': items}},
+                '$inc': {'count': len(items), 'bytes': size},
+                '$min': {'start': min(moments)},
+                '$max': {'end': max(moments)}
+            },
+            upsert=True
+        )
+
+    def append(self, item):
+        """Append one item to the open bucket for its key."""
+        self.append_many([item])
+
+    def append_many(self, items):
+        """Append items with one ``$push`` per key and window.
+
+        Items without an ``_id`` are given one.
+
+        Returns:
+            dict: Error message by index into items for those not stored.
+        """
+        groups = {}
+        for index, item in enumerate(items):
+            item.setdefault('_id', ObjectId())
+            group_key = (item[self.key_field], self.window(item[self.sort_field]))
+            groups.setdefault(group_key, []).append(index)
+        if not groups:
+            return {}
+
+        groups = list(groups.items())
+        operations = [
+            self._append(key, window, [items[index] for index in indexes])
+            for (key, window), indexes in groups
+        ]
+        try:
+            self.get_collection().bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            return {
+                index: error['errmsg']
+                for error in e.details['writeErrors']
+                for index in groups[error['index']][1]
+            }
+        return {}
+
+    def pack(self, items):
+        """Group items of one key, in order, into new bucket documents.
+
+        Used to migrate unbucketed documents; the buckets are not written.
+        Each bucket's ``_id`` is the ``_id`` of its first item, so packing the
+        same items again yields the same buckets (see ``insert``).
+        """
+        bucket = None
+        for item in items:
+            size = len(bson.encode(item))
+            window = self.window(item[self.sort_field])
+            if (bucket is None or bucket['window'] != window
+                    or bucket['count'] >= self.max_items
+                    or bucket['bytes'] + size > self.max_bytes):
+                if bucket is not None:
+                    yield bucket
+                bucket = {
+                    '_id': item['_id'],
+                    self.key_field: item[self.key_field],
+                    'window': window,
+                    'start': item[self.sort_field],
+                    'end': item[self.sort_field],
+                    'count': 0,
+                    'bytes': 0,
+                    self.items_field: []
+                }
+            bucket[self.items_field].append(item)
+            bucket['count'] += 1
+            bucket['bytes'] += size
+            bucket['end'] = max(bucket['end'], item[self.sort_field])
+        if bucket is not None:
+            yield bucket
+
+    def insert(self, buckets):
+        """Write packed buckets, skipping any already written.
+
+        Re-running an interrupted migration therefore does not duplicate
+        the buckets it wrote before stopping.
+
+        Returns:
+            int: Number of buckets written.
+        """
+        if not buckets:
+            return 0
+        try:
+            self.get_collection().insert_many(buckets, ordered=False)
+        except BulkWriteError as e:
+            errors = e.details['writeErrors']
+            if any(error['code'] != 11000 for error in errors):
+                raise
+            return len(buckets) - len(errors)
+        return len(buckets)
+
+    def _items(self, bucket):
+        return bucket[self.items_field]
+
+    def _position(self, item):
+        return item[self.sort_field], item['_id']
+
+    def iter_items(self, key, after=None, before=None, descending=False,
+                   batch_size=None):
+        """Iterate over the items of key in ``(sort field, _id)`` order.
+
+        Args:
+            key: Value of the key field.
+            after (tuple): ``(sort value, _id)``; ascending from just after it.
+            before (tuple): ``(sort value, _id)``; descending from just
+                before it.
+            descending (bool): Read from the end backwards.
+            batch_size (int): Buckets fetched per round trip.
+        """
+        descending = descending or before is not None
+        query = {self.key_field: key}
+        # Buckets come in order of the bound their items are released
+        # against, so every later bucket lies on the far side of it. The
+        # other field is in the index too, so the cursor filter is checked
+        # on index keys without fetching the buckets it skips.
+        if descending:
+            if before is not None:
+                query['start'] = {'$lte': before[0]}
+            sort = [('end', -1), ('start', -1), ('_id', -1)]
+            bound_field = 'end'
+        else:
+            if after is not None:
+                query['end'] = {'$gte': after[0]}
+            sort = [('start', 1), ('end', 1), ('_id', 1)]
+            bound_field = 'start'
+
+        kwargs = {'batch_size': batch_size} if batch_size else {}
+        buckets = self.get_collection().find(query, sort=sort, **kwargs)
+
+        # Buckets rarely overlap, but concurrent appends can open two at
+        # once. Hold items back until no later bucket can precede them.
+        pending = []
+        for bucket in buckets:
+            pending.sort(key=self._position, reverse=descending)
+            bound = bucket[bound_field]
+            ready = 0
+            for item in pending:
+                moment = item[self.sort_field]
+                if (moment > bound) if descending else (moment < bound):
+                    ready += 1
+                else:
+                    break
+            yield from pending[:ready]
+            pending = pending[ready:]
+            for item in self._items(bucket):
+                position = self._position(item)
+                if after is not None and not position > after:
+                    continue
+                if before is not None and not position < before:
+                    continue
+                pending.append(item)
+        pending.sort(key=self._position, reverse=descending)
+        yield from pending
+
+    def page(self, key, limit, after=None, before=None, latest=False):
+        """Read one page of items, like ``app.models.pagination.keyset_page``.
+
+        Returns:
+            tuple: ``(items, cursors)``; items keep their ``_id``.
+
+        Raises:
+            ValueError: If both cursors are given or a cursor is malformed.
+        """
+        return iter_page(
+            lambda **position: self.iter_items(key, **position),
+            self.sort_field, limit, after=after, before=before, latest=latest
+        )
+
+class ArchiveStore(BucketStore):
+    """Cold-tier buckets whose items are stored as compressed BSON.
+
+    Chunks are written once by ``archive`` and only read afterwards. Like
+    packed buckets, each chunk's ``_id`` is the ``_id`` of its first item, so
+    re-archiving the same items after an interrupted run finds the chunk
+    already written instead of duplicating it.
+
+    Args:
+        codec (str): Compression codec name from ``app.models.compression``.
+        level (int): Compression level; None for the codec default.
+    """
+
+    # Chunks never span more than this many seconds
+    SPAN = 30 * 86400
+
+    def __init__(self, get_collection, key_field, sort_field, codec='zlib',
+                 level=None, max_items=1000, max_bytes=4 * 1024 * 1024):
+        super().__init__(
+            get_collection, key_field, sort_field, 'items',
+            max_items=max_items, max_bytes=max_bytes, span=self.SPAN
+        )
+        if codec not in CODECS:
+            raise ValueError(f'Unknown compression codec: {codec}')
+        self.codec = CODECS[codec](level)
+
+    def _items(self, chunk):
+        data = content_compressor.decompress(chunk['data'], chunk['codec'])
+        return bson.decode(data)['items']
+
+    def archive(self, items):
+        """Write items of one key, in order, as compressed chunks.
+
+        Returns:
+            int: Number of chunks written, excluding ones already present.
+        """
+        chunks = []
+        for bucket in self.pack(items):
+            data = self.codec.compress(bson.encode({'items': bucket.pop(self.items_field)}))
+            chunks.append({
+                **bucket,
+                'codec': self.codec.name,
+                'stored_bytes': len(data),
+                'data': data
+            })
+        return self.insert(chunks)
+
+class _CountingCollection:
+    """Collection proxy counting the documents its finds return."""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.read = 0
+
+    def find(self, *args, **kwargs):
+        for document in self.collection.find(*args, **kwargs):
+            self.read += 1
+            yield document
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+def _index_size(collection):
+    """Total index bytes from collStats, or None where it is unavailable."""
+    try:
+        return collection.database.command({'collStats': collection.name})['totalIndexSize']
+    except (OperationFailure, NotImplementedError, KeyError):
+        return None
+
+def benchmark(flat_collection, bucket_collection, store, items, page_size=100):
+    """Compare one document per item with buckets for the same items.
+
+    Items are written one at a time into each layout. Then, for every key,
+    the whole history and the latest page are read back. Both collections
+    must be empty scratch collections with their indexes created; they are
+    emptied again afterwards.
+
+    Args:
+        flat_collection: Collection storing one document per item.
+        bucket_collection: Collection storing buckets.
+        store (BucketStore): Store whose limits are benchmarked; it is
+            pointed at bucket_collection for the run.
+        items (list): Items to store, in order.
+        page_size (int): Items in the latest-page read.
+
+    Returns:
+        dict: Per layout, the document and index entry counts, index size,
+        write latency per item, read latency per history, and documents
+        read per item returned (read amplification).
+    """
+    flat = _CountingCollection(flat_collection)
+    buckets = _CountingCollection(bucket_collection)
+    bucket_store = BucketStore(
+        lambda: buckets, store.key_field, store.sort_field, store.items_field,
+        store.max_items, store.max_bytes, store.span
+    )
+    keys = list(dict.fromkeys(item[store.key_field] for item in items))
+    sort = [(store.sort_field, 1), ('_id', 1)]
+
+    def reader(layout):
+        if layout == 'flat':
+            return (
+                lambda key: flat.find({store.key_field: key}, sort=sort),
+                lambda key: reversed(list(flat.find(
+                    {store.key_field: key}, sort=[(field, -1) for field, _ in sort], limit=page_size
+                )))
+            )
+        return (
+            lambda key: bucket_store.iter_items(key),
+            lambda key: bucket_store.page(key, page_size, latest=True)[0]
+        )
+
+    results = {}
+    try:
+        for layout, collection in (('flat', flat), ('bucketed', buckets)):
+            started = time.perf_counter()
+            for item in items:
+                item = {field: value for field, value in item.items() if field != '_id'}
+                if layout == 'flat':
+                    collection.insert_one(item)
+                else:
+                    bucket_store.append(item)
+            write_elapsed = time.perf_counter() - started
+
+            history, latest = reader(layout)
+            reads = {}
+            for name, read in (('history', history), ('latest_page', latest)):
+                collection.read = 0
+                returned = 0
+                started = time.perf_counter()
+                for key in keys:
+                    returned += sum(1 for _ in read(key))
+                elapsed = time.perf_counter() - started
+                reads[name] = {
+                    'ms': round(elapsed / len(keys) * 1000, 3),
+                    'documents_read': collection.read,
+                    'amplification': round(collection.read / returned, 4) if returned else 0.0
+                }
+
+            documents = collection.count_documents({})
+            results[layout] = {
+                'documents': documents,
+                'index_entries': documents * len(collection.index_information()),
+                'index_bytes': _index_size(collection.collection),
+                'write_ms': round(write_elapsed / len(items) * 1000, 3),
+                **reads
+            }
+    finally:
+        flat_collection.delete_many({})
+        bucket_collection.delete_many({})
+    return results
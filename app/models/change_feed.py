@@ -0,0 +1,263 @@
+"""
+Live fan-out of newly inserted documents to in-process subscribers.
+
+Each worker runs one watcher thread, however many clients are listening. It
+follows a change stream on the collection and resumes it from the last
+resume token after a dropped connection. On deployments without change
+streams (a standalone ``mongod``), it falls back to polling with the
+``(sort field, _id)`` keyset used for pagination.
+
+Events carry a pagination cursor as their id, so a reconnecting client can
+catch up from the database with an ``after`` read before rejoining the live
+feed.
+
+The feed can also watch a bucket collection (see ``app.models.buckets``),
+in which case items appended to the bucket's array are delivered one by
+one.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timedelta, UTC
+from pymongo.errors import OperationFailure, PyMongoError
+from app.models.pagination import encode_cursor
+
+logger = logging.getLogger(__name__)
+
+# Server error codes meaning change streams are unavailable on this deployment
+CHANGE_STREAMS_UNSUPPORTED = (
+    40573,  # The $changeStream stage is only supported on replica sets
+    40324,  # Unrecognized pipeline stage name
+)
+# The resume token has fallen off the oplog
+CHANGE_STREAM_HISTORY_LOST = (280, 286)
+
+class FeedFull(Exception):
+    """Raised when a worker already has ``max_subscribers`` listeners."""
+
+class Subscription:
+    """One listener's queue of ``(event id, document)`` pairs.
+
+    ``closed`` is set when the listener fell so far behind that its queue
+    overflowed; it should end its stream and reconnect from its last id.
+    """
+
+    def __init__(self, key, maxsize):
+        self.key = key
+        self.started = datetime.now(UTC)
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.closed = False
+
+    def put(self, item):
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            self.closed = True
+
+    def get(self, timeout):
+        """Next item, or None if nothing arrived within timeout seconds."""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+class ChangeFeed:
+    """Shared per-worker watcher of inserts into one collection.
+
+    Args:
+        get_collection: Callable returning the watched PyMongo collection.
+        key_field (str): Field subscribers filter on, such as ``project_id``.
+        sort_field (str): Insertion-ordered field used for event ids and
+            polling.
+        fields (tuple): Fields delivered to subscribers.
+        unwind (str): Array field holding the items when the collection
+            stores buckets, or None when every document is an item.
+    """
+
+    # Polling re-reads this far back so documents committed slightly out of
+    # order are not skipped
+    POLL_LOOKBACK = timedelta(seconds=5)
+
+    def __init__(self, get_collection, key_field, sort_field, fields, unwind=None):
+        self.get_collection = get_collection
+        self.unwind = unwind
+        self.key_field = key_field
+        self.sort_field = sort_field
+        self.fields = fields
+        self.mode = 'auto'
+        self.poll_interval = 1.0
+        self.queue_size = 1000
+        self.max_subscribers = 0
+        self.polling = False
+        self._count = 0
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._resume_token = None
+
+    def configure(self, mode='auto', poll_interval=1.0, queue_size=1000,
+                  max_subscribers=0, source=None):
+        """Choose how inserts are detected.
+
+        Args:
+            mode (str): ``changestream``, ``poll``, or ``auto`` to use change
+                streams and fall back to polling where they are unsupported.
+            poll_interval (float): Seconds between polls.
+            queue_size (int): Events buffered per subscriber before it is
+                disconnected as too slow.
+            max_subscribers (int): Listeners allowed at once in this
+                worker, or 0 for no limit.
+            source (tuple): ``(get_collection, unwind)`` to watch a
+                different collection.
+        """
+        if mode not in ('auto', 'changestream', 'poll'):
+            raise ValueError(f'Unknown change feed mode: {mode}')
+        self.mode = mode
+        self.polling = mode == 'poll'
+        self.poll_interval = poll_interval
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        if source is not None:
+            self.get_collection, self.unwind = source
+
+    def event_id(self, document):
+        """Id of the event for document: a cursor on ``(sort field, _id)``."""
+        return encode_cursor(document, self.sort_field)
+
+    def subscribe(self, key):
+        """Start receiving documents whose key field equals key.
+
+        Raises:
+            FeedFull: If this worker already has ``max_subscribers``
+                listeners.
+        """
+        self._ensure_watcher()
+        subscription = Subscription(key, self.queue_size)
+        with self._lock:
+            if self.max_subscribers and self._count >= self.max_subscribers:
+                raise FeedFull(f'{self._count} listeners already subscribed')
+            self._subscribers.setdefault(key, set()).add(subscription)
+            self._count += 1
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """Stop delivering to subscription; unsubscribing twice is harmless."""
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.key)
+            if subscribers is not None and subscription in subscribers:
+                subscribers.discard(subscription)
+                self._count -= 1
+                if not subscribers:
+                    del self._subscribers[subscription.key]
+
+    def _ensure_watcher(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._subscribers = {}
+                    self._count = 0
+                    self._resume_token = None
+                    self._thread = threading.Thread(
+                        target=self._run, name='change-feed', daemon=True
+                    )
+                    self._thread.start()
+                    self._pid = os.getpid()
+
+    def dispatch(self, document):
+        """Deliver an inserted document to every subscriber of its key."""
+        with self._lock:
+            subscribers = list(self._subscribers.get(document.get(self.key_field), ()))
+        if not subscribers:
+            return
+        item = (
+            self.event_id(document),
+            {field: document[field] for field in self.fields if field in document}
+        )
+        if self.polling:
+            # Polls look back past a new subscription's start; skip what it predates
+            moment = document[self.sort_field]
+            if moment.tzinfo is None:
+                moment = moment.replace(tzinfo=UTC)
+            subscribers = [subscription for subscription in subscribers if moment >= subscription.started]
+        for subscription in subscribers:
+            subscription.put(item)
+
+    def _run(self):
+        while True:
+            try:
+                if self.polling:
+                    self._poll()
+                else:
+                    self._watch()
+            except OperationFailure as e:
+                if e.code in CHANGE_STREAMS_UNSUPPORTED and self.mode == 'auto':
+                    logger.info("Change streams unavailable, polling for new documents instead")
+                    self.polling = True
+                    continue
+                if e.code in CHANGE_STREAM_HISTORY_LOST:
+                    logger.warning("Change stream resume token expired; events may have been missed")
+                    self._resume_token = None
+                    continue
+                logger.warning(f"Change feed failed: {e}")
+                time.sleep(self.poll_interval)
+            except PyMongoError as e:
+                logger.warning(f"Change feed interrupted, resuming: {e}")
+                time.sleep(self.poll_interval)
+            except Exception:
+                logger.exception("Change feed error")
+                time.sleep(self.poll_interval)
+
+    def _added(self, change):
+        """Items added by a change event."""
+        if change['operationType'] == 'insert':
+            document = change['fullDocument']
+            return document[self.unwind] if self.unwind else [document]
+        # $push reports each appended element as '<array>.<index>'
+        prefix = f'{self.unwind}.'
+        appended = sorted(
+            (int(field[len(prefix):]), value)
+            for field, value in change['updateDescription']['updatedFields'].items()
+            if field.startswith(prefix) and field[len(prefix):].isdigit()
+        )
+        return [value for _, value in appended]
+
+    def _watch(self):
+        operations = ['insert', 'update'] if self.unwind else ['insert']
+        pipeline = [{'$match': {'operationType': {'$in': operations}}}]
+        with self.get_collection().watch(
+            pipeline, resume_after=self._resume_token, max_await_time_ms=1000
+        ) as stream:
+            while True:
+                change = stream.try_next()
+                self._resume_token = stream.resume_token
+                if change is not None:
+                    for item in self._added(change):
+                        self.dispatch(item)
+
+    def _poll(self):
+        seen = {}
+        since = datetime.now(UTC) - self.POLL_LOOKBACK
+        while True:
+            with self._lock:
+                keys = list(self._subscribers)
+            if keys:
+                # Buckets are found by their last item, then filtered item by item
+                field = 'end' if self.unwind else self.sort_field
+                documents = self.get_collection().find(
+                    {self.key_field: {'$in': keys}, field: {'$gt': since}},
+                    sort=[(field, 1), ('_id', 1)]
+                )
+                for document in documents:
+                    items = document[self.unwind] if self.unwind else [document]
+                    for item in items:
+                        if item['_id'] not in seen and item[self.sort_field] > since.replace(tzinfo=None):
+                            seen[item['_id']] = since
+                            self.dispatch(item)
+            # Documents are re-read for POLL_LOOKBACK, so remember them a little longer
+            forget_before = since - self.POLL_LOOKBACK
+            since = datetime.now(UTC) - self.POLL_LOOKBACK
+            seen = {_id: polled for _id, polled in seen.items() if polled > forget_before}
+            time.sleep(self.poll_interval)
@@ -0,0 +1,111 @@
+"""
+Chunked storage for large document bodies.
+
+Bodies larger than the configured threshold are written to a GridFS bucket
+instead of inline in ``documents``. They are then not bound by the 16 MB
+BSON limit, and can be streamed and range-read without being loaded whole.
+"""
+import io
+import json
+from gridfs import GridFSBucket
+from gridfs.errors import NoFile
+
+BUCKET = 'document_content'
+
+def encode_content(content):
+    """Serialize document content to bytes.
+
+    Returns:
+        tuple: ``(data, content_type)``.
+    """
+    if isinstance(content, bytes):
+        return content, 'application/octet-stream'
+    if isinstance(content, str):
+        return content.encode(), 'text/plain; charset=utf-8'
+    return json.dumps(content).encode(), 'application/json'
+
+def decode_content(data, content_type):
+    """Inverse of ``encode_content``; unknown types are returned as bytes."""
+    if content_type.startswith('text/'):
+        return data.decode()
+    if content_type == 'application/json':
+        return json.loads(data)
+    return data
+
+class ChunkedContentStore:
+    """Writes and reads document bodies in a GridFS bucket.
+
+    Each file records the owning ``document_id`` in its metadata so files
+    superseded by a later write can be found and removed.
+
+    Args:
+        get_db: Callable returning the database holding the bucket.
+        threshold (int): Bodies larger than this many bytes are chunked;
+            0 keeps every body inline.
+        chunk_size (int): Bytes per GridFS chunk.
+    """
+
+    def __init__(self, get_db, threshold=1024 * 1024, chunk_size=255 * 1024):
+        self.get_db = get_db
+        self.threshold = threshold
+        self.chunk_size = chunk_size
+
+    def configure(self, threshold=None, chunk_size=None):
+        """Update the chunking threshold and chunk size."""
+        if threshold is not None:
+            self.threshold = threshold
+        if chunk_size is not None:
+            self.chunk_size = chunk_size
+
+    def _bucket(self):
+        return GridFSBucket(
+            self.get_db(), bucket_name=BUCKET, chunk_size_bytes=self.chunk_size
+        )
+
+    def should_chunk(self, size):
+        """Whether a body of size bytes belongs in chunked storage."""
+        return bool(self.threshold) and size > self.threshold
+
+    def put(self, document_id, data, content_type):
+        """Store data for a document and return the new file id."""
+        file_id, _ = self.put_stream(document_id, io.BytesIO(data), content_type)
+        return file_id
+
+    def put_stream(self, document_id, stream, content_type):
+        """Copy a readable stream into a new file, one chunk at a time.
+
+        Returns:
+            tuple: ``(file_id, length)``.
+        """
+        length = 0
+        with self._bucket().open_upload_stream(
+            document_id,
+            metadata={'document_id': document_id, 'content_type': content_type}
+        ) as grid_in:
+            while True:
+                block = stream.read(self.chunk_size)
+                if not block:
+                    break
+                grid_in.write(block)
+                length += len(block)
+        return grid_in._id, length
+
+    def open(self, file_id):
+        """Return a seekable, file-like reader for a stored body."""
+        return self._bucket().open_download_stream(file_id)
+
+    def delete(self, file_id):
+        """Remove a stored body, ignoring files that are already gone."""
+        try:
+            self._bucket().delete(file_id)
+        except NoFile:
+            pass
+
+    def delete_stale(self, document_id, keep=None):
+        """Remove every file of a document except keep."""
+        files = self.get_db()[f'{BUCKET}.files'].find(
+            {'metadata.document_id': document_id, '_id': {'$ne': keep}},
+            {'_id': 1}
+        )
+        for file in files:
+            self.delete(file['_id'])
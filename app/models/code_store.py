@@ -0,0 +1,92 @@
+"""
+Storage backends for single-use OAuth 2.0 authorization codes.
+
+Every backend consumes a code atomically: ``consume`` finds and removes the
+code in one step, scoped to the client it was issued to, so a code can be
+redeemed at most once even under concurrent token requests.
+"""
+import pickle
+import threading
+import time
+from datetime import datetime, UTC
+import redis
+
+class MemoryCodeStore:
+    """Process-local store. Only suitable for a single worker (tests, dev)."""
+    
+    def __init__(self):
+        self._codes = {}
+        self._lock = threading.Lock()
+    
+    def save(self, record, ttl):
+        with self._lock:
+            now = time.monotonic()
+            # Drop expired codes so the dict stays bounded by the issue rate
+            for key in [k for k, (_, expires) in self._codes.items() if expires <= now]:
+                del self._codes[key]
+            self._codes[(record['client_id'], record['code'])] = (record, now + ttl)
+    
+    def consume(self, code, client_id):
+        with self._lock:
+            entry = self._codes.pop((client_id, code), None)
+        if entry is None or entry[1] <= time.monotonic():
+            return None
+        return entry[0]
+
+class RedisCodeStore:
+    """Redis store using native key expiry and GETDEL for consumption."""
+    
+    def __init__(self, client, namespace='auth_code'):
+        self.client = client
+        self.namespace = namespace
+    
+    def _key(self, client_id, code):
+        return f'{self.namespace}:{client_id}:{code}'
+    
+    def save(self, record, ttl):
+        self.client.set(
+            self._key(record['client_id'], record['code']),
+            pickle.dumps(record),
+            ex=ttl
+        )
+    
+    def consume(self, code, client_id):
+        raw = self.client.getdel(self._key(client_id, code))
+        return pickle.loads(raw) if raw is not None else None
+
+class MongoCodeStore:
+    """MongoDB store backed by the model's unique ``code`` and TTL indexes."""
+    
+    def __init__(self, model):
+        self.model = model
+    
+    def save(self, record, ttl):
+        self.model.insert_one(dict(record))
+    
+    def consume(self, code, client_id):
+        return self.model._get_collection().find_one_and_delete({
+            'code': code,
+            'client_id': client_id,
+            'expires_at': {'$gt': datetime.now(UTC)}
+        })
+
+def create_code_store(backend, model=None, redis_client=None, redis_url=None):
+    """Build the code store selected by ``AUTH_CODE_STORE``.
+    
+    Args:
+        backend (str): 'mongo', 'redis' or 'memory'.
+        model: BaseDocument subclass for the Mongo backend.
+        redis_client: Existing Redis client for the Redis backend.
+        redis_url (str): Redis URL used when no client is given.
+    """
+    if backend == 'memory':
+        return MemoryCodeStore()
+    if backend == 'redis':
+        if redis_client is None:
+            if not redis_url:
+                raise ValueError('AUTH_CODE_STORE=redis requires a Redis URL')
+            redis_client = redis.Redis.from_url(redis_url)
+        return RedisCodeStore(redis_client)
+    if backend == 'mongo':
+        return MongoCodeStore(model)
+    raise ValueError(f'Unknown authorization code store: {backend}')
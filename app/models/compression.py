@@ -0,0 +1,170 @@
+"""
+Compression of inline document content at rest.
+
+Compressed documents store their serialized content as binary in
+``content`` and name the codec in ``content_codec``. Documents without a
+codec marker are read as they are, so existing data needs no migration.
+"""
+import time
+import zlib
+import bson
+from app.models.chunks import encode_content, decode_content
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+class ZlibCodec:
+    """zlib/DEFLATE from the standard library."""
+
+    name = 'zlib'
+    default_level = 6
+
+    def __init__(self, level=None):
+        self.level = self.default_level if level is None else level
+
+    def compress(self, data):
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data):
+        return zlib.decompress(data)
+
+class ZstdCodec:
+    """Zstandard via the optional ``zstandard`` package."""
+
+    name = 'zstd'
+    default_level = 3
+
+    def __init__(self, level=None):
+        if zstandard is None:
+            raise ValueError('zstd compression requires the zstandard package')
+        self.level = self.default_level if level is None else level
+
+    def compress(self, data):
+        return zstandard.ZstdCompressor(level=self.level).compress(data)
+
+    def decompress(self, data):
+        return zstandard.ZstdDecompressor().decompress(data)
+
+CODECS = {
+    'zlib': ZlibCodec,
+    'zstd': ZstdCodec,
+}
+
+class ContentCompressor:
+    """Compresses content above a size threshold with the configured codec.
+
+    Decompression works for any known codec regardless of which one is
+    configured, so switching codecs leaves existing documents readable.
+    """
+
+    def __init__(self):
+        self.codec = None
+        self.threshold = 4096
+        self._decoders = {}
+
+    def configure(self, codec=None, level=None, threshold=None):
+        """Select the codec for new writes.
+
+        Args:
+            codec (str): ``zlib``, ``zstd``, or None/``none`` to store
+                content uncompressed.
+            level (int): Compression level; None for the codec default.
+            threshold (int): Only content larger than this many bytes is
+                compressed.
+        """
+        if codec in (None, '', 'none'):
+            self.codec = None
+        elif codec in CODECS:
+            self.codec = CODECS[codec](level)
+        else:
+            raise ValueError(f'Unknown compression codec: {codec}')
+        if threshold is not None:
+            self.threshold = threshold
+
+    def compress(self, data):
+        """Compress data if it is large enough and shrinks.
+
+        Returns:
+            tuple: ``(compressed, codec name)``, or ``(None, None)`` when
+            data should be stored as is.
+        """
+        if self.codec is None or len(data) <= self.threshold:
+            return None, None
+        compressed = self.codec.compress(data)
+        if len(compressed) >= len(data):
+            return None, None
+        return compressed, self.codec.name
+
+    def decompress(self, data, codec):
+        """Decompress data written with the named codec."""
+        if codec not in self._decoders:
+            if codec not in CODECS:
+                raise ValueError(f'Unknown compression codec: {codec}')
+            self._decoders[codec] = CODECS[codec]()
+        return self._decoders[codec].decompress(data)
+
+content_compressor = ContentCompressor()
+
+def benchmark(collection, payloads, codec=None, level=None):
+    """Time writing and reading payloads compressed with codec.
+
+    Each payload is serialized, compressed and inserted one at a time, then
+    every document is read back and decoded, mirroring what ``Document``
+    does per request. collection is emptied before and after the run.
+
+    Args:
+        collection: Scratch PyMongo collection to write to.
+        payloads (list): Document contents to store.
+        codec (str): ``zlib``, ``zstd`` or None for uncompressed.
+        level (int): Compression level; None for the codec default.
+
+    Returns:
+        dict: Per-document write and read latency in milliseconds, raw and
+        stored content bytes, and the collection's BSON data size.
+    """
+    compressor = ContentCompressor()
+    compressor.configure(codec=codec, level=level, threshold=0)
+    collection.delete_many({})
+    raw_bytes = stored_bytes = 0
+    try:
+        started = time.perf_counter()
+        for index, content in enumerate(payloads):
+            data, content_type = encode_content(content)
+            compressed, name = compressor.compress(data)
+            document = {'_id': index, 'content_type': content_type, 'content': content}
+            if name:
+                document.update(content=compressed, content_codec=name)
+            collection.insert_one(document)
+            raw_bytes += len(data)
+            stored_bytes += len(compressed) if name else len(data)
+        write_elapsed = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for index in range(len(payloads)):
+            document = collection.find_one({'_id': index})
+            if document.get('content_codec'):
+                decode_content(
+                    compressor.decompress(document['content'], document['content_codec']),
+                    document['content_type']
+                )
+        read_elapsed = time.perf_counter() - started
+
+        data_size = sum(
+            len(bson.encode(document)) for document in collection.find({})
+        )
+    finally:
+        collection.delete_many({})
+
+    count = len(payloads) or 1
+    return {
+        'codec': codec or 'none',
+        'level': compressor.codec.level if compressor.codec else None,
+        'write_ms': round(write_elapsed / count * 1000, 3),
+        'read_ms': round(read_elapsed / count * 1000, 3),
+        'content_bytes': raw_bytes,
+        'stored_bytes': stored_bytes,
+        'data_size': data_size,
+        'ratio': round(stored_bytes / raw_bytes, 3) if raw_bytes else 1.0,
+    }
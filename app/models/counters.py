@@ -0,0 +1,126 @@
+"""
+Write-behind counters for hot request paths.
+
+Increments are accumulated in memory per worker and written with one
+``$inc`` per key every ``flush_interval`` seconds, so counting an event adds
+no database round trip to the request that caused it. Counts not yet flushed
+are lost if the worker dies without exiting cleanly; a normal shutdown
+flushes them.
+
+A flush is written once. Updates the server rejected are retried with the
+next flush; when the outcome is unknown, such as after a network error,
+the counts are dropped rather than risk applying them twice.
+"""
+import atexit
+import logging
+import os
+import threading
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+class CounterBuffer:
+    """Per-worker counters flushed periodically by a daemon thread.
+
+    Args:
+        name (str): Label used in log messages.
+        write: Callable taking a dict of update documents by key, each with
+            ``$inc`` and optionally ``$max`` fields, and applying them with
+            one unordered bulk write in the dict's order, so the indexes in
+            a ``BulkWriteError`` identify the keys that failed.
+    """
+
+    def __init__(self, name, write):
+        self.name = name
+        self.write = write
+        self.flush_interval = 10.0
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._pid = None
+        atexit.register(self.close)
+
+    def configure(self, flush_interval=10.0):
+        """Set how many seconds increments wait before being written."""
+        self.flush_interval = flush_interval
+
+    def _ensure_flusher(self):
+        # Counts made by the parent belong to it, not to a forked worker
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._pending = {}
+                    self._stopped = threading.Event()
+                    self._thread = threading.Thread(
+                        target=self._run, name=f'{self.name}-flusher', daemon=True
+                    )
+                    self._thread.start()
+                    self._pid = os.getpid()
+
+    def increment(self, key, field, amount=1, latest=None):
+        """Add amount to field of key.
+
+        Args:
+            latest (dict): Fields of key to raise to at least these values,
+                such as a last-seen timestamp.
+        """
+        self._ensure_flusher()
+        with self._lock:
+            update = self._pending.setdefault(key, {'$inc': {}, '$max': {}})
+            update['$inc'][field] = update['$inc'].get(field, 0) + amount
+            for name, value in (latest or {}).items():
+                current = update['$max'].get(name)
+                if current is None or value > current:
+                    update['$max'][name] = value
+
+    def _merge(self, updates):
+        """Put updates that could not be written back into the pending counts."""
+        with self._lock:
+            for key, update in updates.items():
+                pending = self._pending.setdefault(key, {'$inc': {}, '$max': {}})
+                for field, amount in update['$inc'].items():
+                    pending['$inc'][field] = pending['$inc'].get(field, 0) + amount
+                for name, value in update['$max'].items():
+                    if name not in pending['$max'] or value > pending['$max'][name]:
+                        pending['$max'][name] = value
+
+    def _run(self):
+        while not self._stopped.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """Write every pending increment now.
+
+        Updates the server rejected are retried with the next flush. Any
+        other failure may have been applied in part, so it is logged and
+        its counts are dropped.
+        """
+        with self._flush_lock:
+            with self._lock:
+                updates, self._pending = self._pending, {}
+            if not updates:
+                return
+            try:
+                self.write({
+                    key: {operator: fields for operator, fields in update.items() if fields}
+                    for key, update in updates.items()
+                })
+            except BulkWriteError as e:
+                failed = {error['index'] for error in e.details.get('writeErrors', ())}
+                logger.error(f"{self.name} flush: {len(failed)} of {len(updates)} counters rejected, retrying: {e}")
+                self._merge({
+                    key: update for index, (key, update) in enumerate(updates.items())
+                    if index in failed
+                })
+            except Exception as e:
+                logger.error(f"{self.name} flush of {len(updates)} counters failed, dropping them: {e}")
+
+    def close(self):
+        """Stop the flusher and write anything still pending."""
+        self._stopped.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout=5)
+        self._pid = None
+        self.flush()
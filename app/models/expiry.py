@@ -0,0 +1,87 @@
+"""
+Deterministic cleanup of expired documents.
+
+TTL indexes (see ``ensure_indexes``) purge expired tokens, authorization
+codes and API keys on their own, but MongoDB's TTL monitor only runs about
+once a minute and may fall behind under load. The sweeper deletes the same
+documents in bounded batches for deployments that need cleanup to happen on
+a predictable schedule.
+"""
+import logging
+import threading
+from datetime import datetime, timedelta, UTC
+from app.models.indexes import document_models
+
+logger = logging.getLogger(__name__)
+
+def sweep_expired(expiry_grace=0, batch_size=1000):
+    """Delete documents past expiry plus the grace period.
+    
+    Args:
+        expiry_grace (int): Seconds past ``expires_at`` to keep documents.
+        batch_size (int): Maximum documents removed per delete.
+    
+    Returns:
+        dict: Number of deleted documents per collection.
+    """
+    cutoff = datetime.now(UTC) - timedelta(seconds=expiry_grace)
+    deleted = {}
+    for model in document_models():
+        if not model.EXPIRES_FIELD:
+            continue
+        collection = model._get_collection()
+        expired = {model.EXPIRES_FIELD: {'$lt': cutoff}}
+        total = 0
+        while True:
+            ids = [
+                doc['_id'] for doc in
+                collection.find(expired, {'_id': 1}).limit(batch_size)
+            ]
+            if not ids:
+                break
+            total += collection.delete_many({'_id': {'$in': ids}}).deleted_count
+            if len(ids) < batch_size:
+                break
+        deleted[model.COLLECTION] = total
+    return deleted
+
+class ExpirySweeper(threading.Thread):
+    """Daemon thread running ``sweep_expired`` every ``interval`` seconds."""
+    
+    def __init__(self, app, interval, expiry_grace=0, batch_size=1000):
+        super().__init__(name='expiry-sweeper', daemon=True)
+        self.app = app
+        self.interval = interval
+        self.expiry_grace = expiry_grace
+        self.batch_size = batch_size
+        self.stopped = threading.Event()
+    
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                with self.app.app_context():
+                    deleted = sweep_expired(self.expiry_grace, self.batch_size)
+                logger.debug(f"Expiry sweep removed {deleted}")
+            except Exception as e:
+                logger.warning(f"Expiry sweep failed: {e}")
+    
+    def stop(self):
+        self.stopped.set()
+
+def start_expiry_sweeper(app):
+    """Start the sweeper if ``EXPIRY_SWEEP_INTERVAL`` is set.
+    
+    Returns:
+        The running ExpirySweeper, or None when disabled.
+    """
+    interval = app.config.get('EXPIRY_SWEEP_INTERVAL') or 0
+    if interval <= 0:
+        return None
+    sweeper = ExpirySweeper(
+        app,
+        interval,
+        expiry_grace=app.config.get('EXPIRY_GRACE_PERIOD', 0),
+        batch_size=app.config.get('EXPIRY_SWEEP_BATCH_SIZE', 1000)
+    )
+    sweeper.start()
+    return sweeper
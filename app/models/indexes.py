@@ -0,0 +1,100 @@
+"""
+Index management and query plan checks for the MongoDB models.
+"""
+import logging
+from pymongo import ASCENDING
+from pymongo.errors import OperationFailure
+from app.models.mongodb import BaseDocument
+
+logger = logging.getLogger(__name__)
+
+def document_models():
+    """Return every BaseDocument subclass bound to a collection."""
+    models = []
+    pending = list(BaseDocument.__subclasses__())
+    while pending:
+        model = pending.pop(0)
+        pending.extend(model.__subclasses__())
+        if getattr(model, 'COLLECTION', None):
+            models.append(model)
+    return models
+
+def ensure_ttl_index(model, expiry_grace):
+    """Create or retune the TTL index on a model's ``EXPIRES_FIELD``.
+    
+    An existing TTL index with a different grace period is updated in place
+    with collMod instead of being dropped and rebuilt.
+    
+    Returns:
+        str: The index name.
+    """
+    collection = model._get_collection()
+    key = [(model.EXPIRES_FIELD, ASCENDING)]
+    for name, info in collection.index_information().items():
+        if info['key'] == key and info.get('expireAfterSeconds') not in (None, expiry_grace):
+            collection.database.command(
+                'collMod', model.COLLECTION,
+                index={'name': name, 'expireAfterSeconds': expiry_grace}
+            )
+            return name
+    return collection.create_index(key, expireAfterSeconds=expiry_grace)
+
+def ensure_indexes(expiry_grace=0):
+    """Create the indexes declared by every model.
+    
+    createIndexes is a no-op for indexes that already exist with the same
+    definition, so this is safe to run on every startup. Conflicting
+    definitions are logged and left for an operator to resolve.
+    
+    Args:
+        expiry_grace (int): Seconds past ``expires_at`` before TTL indexes
+            purge a document.
+    
+    Returns:
+        dict: Index names per collection that were ensured.
+    """
+    ensured = {}
+    for model in document_models():
+        if not model.INDEXES and not model.EXPIRES_FIELD:
+            continue
+        try:
+            names = []
+            if model.INDEXES:
+                names = model._get_collection().create_indexes(list(model.INDEXES))
+            if model.EXPIRES_FIELD:
+                names.append(ensure_ttl_index(model, expiry_grace))
+            ensured[model.COLLECTION] = names
+        except OperationFailure as e:
+            logger.error(f"Could not create indexes on {model.COLLECTION}: {e}")
+    return ensured
+
+def plan_stages(plan):
+    """Yield the stage names of a query plan tree, root first."""
+    # Slot-based engine explains nest the classic plan under 'queryPlan'
+    plan = plan.get('queryPlan', plan)
+    yield plan.get('stage')
+    if 'inputStage' in plan:
+        yield from plan_stages(plan['inputStage'])
+    for child in plan.get('inputStages', []):
+        yield from plan_stages(child)
+
+def explain_queries():
+    """Explain every declared model query shape.
+    
+    Returns:
+        list: One entry per query shape with its plan stages and flags for
+        collection scans and blocking (in-memory) sorts.
+    """
+    report = []
+    for model in document_models():
+        for shape in model.QUERY_SHAPES:
+            explain = model.find(shape['filter'], sort=shape.get('sort')).explain()
+            stages = list(plan_stages(explain['queryPlanner']['winningPlan']))
+            report.append({
+                'collection': model.COLLECTION,
+                'query': f"{model.__name__}.{shape['name']}",
+                'stages': stages,
+                'collscan': 'COLLSCAN' in stages,
+                'blocking_sort': 'SORT' in stages
+            })
+    return report
@@ -1,17 +1,24 @@
 """
 MongoDB models for the project template.
 """
+import heapq
+import io
+import itertools
+import operator
 import os
 from datetime import datetime, timedelta, UTC
 import uuid
 import hashlib
 import secrets
+from flask import g, has_request_context
 from flask_pymongo import PyMongo
+from pymongo import ASCENDING, IndexModel, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 from bson.objectid import ObjectId
 from authlib.integrations.flask_oauth2 import (
     AuthorizationServer, ResourceProtector
 )
-from authlib.oauth2.rfc6749 import grants, ClientMixin
+from authlib.oauth2.rfc6749 import grants
 from authlib.oauth2.rfc7636 import CodeChallenge
 from authlib.oauth2.rfc6750 import BearerTokenValidator
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -21,11 +28,34 @@ from authlib.oauth2.rfc6749.grants import (
     ClientCredentialsGrant,
     RefreshTokenGrant,
 )
+from app.utils.cache import (
+    TTLCache, SnapshotCache, MISSING, shared_cache, notify_write
+)
+from app.utils.tokens import AccessTokenSigner
+from app.utils.scopes import scope_registry
+from app.utils.passwords import password_hasher
+from app.models.code_store import MongoCodeStore, create_code_store
+from app.models.pagination import keyset_page, decode_cursor, iter_page, position_filter
+from app.models.chunks import ChunkedContentStore, BUCKET as CONTENT_BUCKET, encode_content, decode_content
+from app.models.compression import content_compressor
+from app.models.write_buffer import WriteBehindBuffer
+from app.models.counters import CounterBuffer
+from app.models.change_feed import ChangeFeed
+from app.models.buckets import BucketStore, ArchiveStore
 
 mongo = PyMongo()
 authorization = AuthorizationServer()
 require_oauth = ResourceProtector()
 
+# Access token lookups keyed by access token string; None marks unknown tokens
+token_cache = TTLCache('oauth_tokens', maxsize=10000, ttl=300)
+
+# OAuth2Client instances keyed by client ID; None marks unknown clients
+client_cache = TTLCache('oauth_clients', maxsize=1000, ttl=300)
+
+# Issues/verifies self-contained access tokens when OAUTH2_TOKEN_FORMAT is 'jwt'
+access_token_signer = AccessTokenSigner()
+
 def get_mongo_client():
     """Get the MongoDB client."""
     return mongo.cx
@@ -34,50 +64,213 @@ def get_mongo_db():
     """Get the MongoDB database."""
     return mongo.db
 
+# Large document bodies, stored in GridFS chunks above DOCUMENT_CHUNK_THRESHOLD
+content_store = ChunkedContentStore(get_mongo_db)
+
 def hash_password(password):
-    """Simple password hashing using SHA-256.
-    
-    In production, use a proper password hashing library like passlib.
-    """
-    return hashlib.sha256(password.encode()).hexdigest()
+    """Hash a password with the configured algorithm (see PASSWORD_HASH_*)."""
+    return password_hasher.hash(password)
 
 def generate_token(length=42):
     """Generate a random token for OAuth."""
     return secrets.token_urlsafe(length)
 
+def as_utc(moment):
+    """Attach UTC to naive datetimes as returned by PyMongo."""
+    if moment.tzinfo is None:
+        return moment.replace(tzinfo=UTC)
+    return moment
+
+def as_stored(moment):
+    """Round a datetime the way MongoDB stores it: naive UTC, to the millisecond."""
+    moment = as_utc(moment).astimezone(UTC)
+    return moment.replace(microsecond=moment.microsecond // 1000 * 1000, tzinfo=None)
+
+def seconds_until(moment):
+    """Seconds from now until moment; naive datetimes are treated as UTC."""
+    return (as_utc(moment) - datetime.now(UTC)).total_seconds()
+
+def apply_projection(document, projection):
+    """Apply a top-level inclusion or exclusion projection to a copy of document."""
+    if not projection:
+        return dict(document)
+    included = [field for field, value in projection.items() if value and field != '_id']
+    if not included:
+        return {field: value for field, value in document.items() if projection.get(field, 1)}
+    if projection.get('_id', 1):
+        included.append('_id')
+    return {field: document[field] for field in included if field in document}
+
+def identity_map(collection):
+    """Documents of collection already loaded during this request, by identity key.
+    
+    Returns None outside a request, so background threads and CLI commands
+    always read from the database.
+    """
+    if not has_request_context():
+        return None
+    return g.setdefault('identity_map', {}).setdefault(collection, {})
+
 class BaseDocument:
-    """Base class for MongoDB documents."""
+    """Base class for MongoDB documents.
+    
+    Subclasses declare the indexes their queries rely on in ``INDEXES``
+    (created by ``app.models.indexes.ensure_indexes``) and representative
+    filters/sorts for those queries in ``QUERY_SHAPES``, which the index
+    report runs through ``explain()`` to catch collection scans. Documents
+    of models that set ``EXPIRES_FIELD`` are purged by a TTL index on that
+    field once they are past expiry plus the configured grace period.
+    
+    Models returned by the API list their public fields in ``FIELDS`` and
+    the subset sent by list endpoints in ``SUMMARY_FIELDS``; ``projection``
+    turns a requested fieldset into a MongoDB projection.
+    
+    Models that set ``IDENTITY_KEY`` keep every document fetched by that key
+    in a per-request identity map, so repeated lookups within one request
+    (an ownership check followed by the handler's own read, say) reach the
+    database once. Writes through the model drop its entries from the map.
+    """
+    
+    __slots__ = ()
+    
+    INDEXES = ()
+    QUERY_SHAPES = ()
+    EXPIRES_FIELD = None
+    IDENTITY_KEY = None
+    FIELDS = ()
+    SUMMARY_FIELDS = ()
+    
+    # Documents fetched per round trip when iterating a cursor for streaming
+    STREAM_BATCH_SIZE = 500
     
     @classmethod
-    def find_one(cls, query):
-        """Find one document."""
+    def projection(cls, fields=None):
+        """Build a projection for a sparse fieldset.
+        
+        Args:
+            fields: Field names as an iterable or comma-separated string,
+                ``'*'`` for all of ``FIELDS``, or None for ``SUMMARY_FIELDS``.
+            
+        Returns:
+            dict: A projection that always excludes ``_id``.
+            
+        Raises:
+            ValueError: If a requested field is not in ``FIELDS``.
+        """
+        if fields == '*':
+            fields = cls.FIELDS
+        elif fields is None:
+            fields = cls.SUMMARY_FIELDS
+        elif isinstance(fields, str):
+            fields = [field.strip() for field in fields.split(',') if field.strip()]
+        
+        unknown = set(fields) - set(cls.FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+        return {'_id': 0, **{field: 1 for field in fields}}
+    
+    @classmethod
+    def find_one(cls, query, projection=None):
+        """Find one document, optionally returning only projected fields."""
         collection = cls._get_collection()
-        return collection.find_one(query)
+        identities = identity_map(cls.COLLECTION) if cls.IDENTITY_KEY else None
+        if identities is None or list(query) != [cls.IDENTITY_KEY]:
+            return collection.find_one(query, projection)
+        
+        key = query[cls.IDENTITY_KEY]
+        if key not in identities:
+            # Load the whole document so later lookups can be served whatever their projection
+            identities[key] = collection.find_one(query)
+        if identities[key] is None:
+            return None
+        return apply_projection(identities[key], projection)
+    
+    @classmethod
+    def forget(cls):
+        """Drop this model's documents from the request's identity map."""
+        if has_request_context() and 'identity_map' in g:
+            g.identity_map.pop(cls.COLLECTION, None)
     
     @classmethod
-    def find(cls, query, **kwargs):
-        """Find documents."""
+    def find(cls, query, projection=None, **kwargs):
+        """Find documents, optionally returning only projected fields."""
         collection = cls._get_collection()
-        return collection.find(query, **kwargs)
+        return collection.find(query, projection, **kwargs)
+    
+    @classmethod
+    def paginate(cls, query, sort_field, limit, after=None, before=None,
+                 latest=False, projection=None):
+        """Read one keyset page of query; see ``app.models.pagination``."""
+        return keyset_page(
+            cls._get_collection(), query, sort_field, limit,
+            after=after, before=before, latest=latest, projection=projection
+        )
     
     @classmethod
     def insert_one(cls, document):
         """Insert one document."""
         collection = cls._get_collection()
         result = collection.insert_one(document)
+        cls.forget()
+        notify_write(cls.COLLECTION)
         return result.inserted_id
     
+    @classmethod
+    def insert_many(cls, documents):
+        """Insert documents with one unordered bulk write.
+        
+        Every document is attempted even if some fail.
+        
+        Returns:
+            dict: Error message by index into documents for those that
+            were not inserted.
+        """
+        if not documents:
+            return {}
+        collection = cls._get_collection()
+        failed = {}
+        try:
+            collection.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            failed = {error['index']: error['errmsg'] for error in e.details['writeErrors']}
+        cls.forget()
+        notify_write(cls.COLLECTION)
+        return failed
+    
     @classmethod
     def update_one(cls, query, update, **kwargs):
         """Update one document."""
         collection = cls._get_collection()
-        return collection.update_one(query, update, **kwargs)
+        result = collection.update_one(query, update, **kwargs)
+        cls.forget()
+        notify_write(cls.COLLECTION)
+        return result
+    
+    @classmethod
+    def find_one_and_update(cls, query, update, projection=None):
+        """Update one document and return it as it is after the update.
+        
+        Returns:
+            The updated document, or None if nothing matched query.
+        """
+        collection = cls._get_collection()
+        document = collection.find_one_and_update(
+            query, update,
+            projection=projection,
+            return_document=ReturnDocument.AFTER
+        )
+        cls.forget()
+        notify_write(cls.COLLECTION)
+        return document
     
     @classmethod
     def delete_one(cls, query):
         """Delete one document."""
         collection = cls._get_collection()
-        return collection.delete_one(query)
+        result = collection.delete_one(query)
+        cls.forget()
+        notify_write(cls.COLLECTION)
+        return result
     
     @classmethod
     def _get_collection(cls):
@@ -88,6 +281,14 @@ class ApiKey(BaseDocument):
     """Legacy API Key model."""
     
     COLLECTION = 'api_keys'
+    EXPIRES_FIELD = 'expires_at'
+    
+    INDEXES = (
+        IndexModel([('key', ASCENDING)], unique=True),
+    )
+    QUERY_SHAPES = (
+        {'name': 'load_active', 'filter': {'active': True, 'expires_at': {'$gt': 0}}},
+    )
     
     @classmethod
     def create(cls, key, description, expires_at=None):
@@ -106,23 +307,49 @@ class ApiKey(BaseDocument):
             'active': True
         }
         
-        return cls.insert_one(document)
+        inserted_id = cls.insert_one(document)
+        api_key_cache.set(cls.digest(key), expires_at)
+        return inserted_id
+    
+    @staticmethod
+    def digest(key):
+        """SHA-256 digest used to index keys in memory."""
+        return hashlib.sha256(key.encode()).hexdigest()
+    
+    @classmethod
+    def load_active(cls):
+        """Map the digest of every active, unexpired key to its expiry."""
+        keys = cls.find(
+            {'active': True, 'expires_at': {'$gt': datetime.now(UTC)}},
+            projection={'key': 1, 'expires_at': 1, '_id': 0}
+        )
+        return {cls.digest(doc['key']): doc['expires_at'] for doc in keys}
     
     @classmethod
     def validate(cls, key):
-        """Validate an API key."""
-        key_document = cls.find_one({
-            'key': key,
-            'active': True,
-            'expires_at': {'$gt': datetime.now(UTC)}
-        })
+        """Validate an API key.
         
-        return key_document is not None
+        Checked against the worker's snapshot of active keys, so both valid
+        and unknown keys are answered without a database query.
+        """
+        expires_at = api_key_cache.get(cls.digest(key))
+        return expires_at is not MISSING and seconds_until(expires_at) > 0
 
 class User(BaseDocument):
     """User model for OAuth authentication."""
     
     COLLECTION = 'users'
+    IDENTITY_KEY = 'user_id'
+    
+    INDEXES = (
+        IndexModel([('user_id', ASCENDING)], unique=True, sparse=True),
+        IndexModel([('username', ASCENDING)], unique=True),
+        IndexModel([('email', ASCENDING)], unique=True),
+    )
+    QUERY_SHAPES = (
+        {'name': 'get_by_id', 'filter': {'user_id': ''}},
+        {'name': 'get_by_username', 'filter': {'username': ''}},
+    )
     
     @classmethod
     def create(cls, username, email, password, is_admin=False):
@@ -155,21 +382,67 @@ class User(BaseDocument):
     
     @classmethod
     def validate_password(cls, username, password):
-        """Validate user password."""
+        """Validate user password.
+        
+        Hashes from a legacy algorithm or with outdated cost parameters are
+        replaced with a fresh hash once the password is known to be correct.
+        """
         user = cls.get_by_username(username)
         if not user:
+            # Hash anyway so unknown usernames cannot be told apart by timing
+            password_hasher.verify_dummy(password)
             return None
         
-        if user['password'] == hash_password(password):
-            return user
+        valid, needs_rehash = password_hasher.verify(password, user['password'])
+        if not valid:
+            return None
         
-        return None
+        if needs_rehash:
+            user['password'] = hash_password(password)
+            cls.update_one(
+                {'user_id': user['user_id']},
+                {'$set': {'password': user['password'], 'updated_at': datetime.now(UTC)}}
+            )
+        return user
 
-class OAuth2Client(BaseDocument, ClientMixin):
-    """OAuth2 Client model."""
+class OAuth2Client(BaseDocument):
+    """OAuth2 Client model.
+    
+    Instances are read-only snapshots of an ``oauth_clients`` document with
+    redirect URIs, grant types, response types and scopes precomputed as
+    frozensets. ``get_by_client_id`` serves them from ``client_cache``; every
+    update bumps the document ``version`` and evicts the cached instance.
+    """
     
     COLLECTION = 'oauth_clients'
     
+    INDEXES = (
+        IndexModel([('client_id', ASCENDING)], unique=True),
+    )
+    QUERY_SHAPES = (
+        {'name': 'get_by_client_id', 'filter': {'client_id': ''}},
+        {'name': 'write_issuance', 'filter': {'client_id': ''}},
+    )
+    
+    __slots__ = (
+        'client_id', 'client_secret', 'client_name', 'client_uri',
+        'redirect_uris', 'redirect_uri_set', 'grant_types', 'response_types',
+        'scope', 'scopes', 'version'
+    )
+    
+    def __init__(self, document):
+        self.client_id = document['client_id']
+        self.client_secret = document.get('client_secret')
+        self.client_name = document.get('client_name', '')
+        self.client_uri = document.get('client_uri', '')
+        self.redirect_uris = tuple(document.get('redirect_uris') or ())
+        self.redirect_uri_set = frozenset(self.redirect_uris)
+        self.grant_types = frozenset(document.get('grant_types') or ())
+        self.response_types = frozenset(document.get('response_types') or ())
+        self.scope = document.get('scope') or ''
+        self.scopes = frozenset(self.scope.split())
+        self.version = document.get('version', 0)
+    
     @classmethod
     def create(cls, client_id, client_secret, client_name, client_uri, 
                redirect_uris, grant_types, response_types, scope):
@@ -185,53 +458,167 @@ class OAuth2Client(BaseDocument, ClientMixin):
             'grant_types': grant_types,
             'response_types': response_types,
             'scope': scope,
+            'version': 0,
             'created_at': now,
             'updated_at': now
         }
         
         cls.insert_one(document)
+        client_cache.delete(client_id)
         return client_id
     
     @classmethod
     def get_by_client_id(cls, client_id):
         """Get a client by client ID."""
-        return cls.find_one({'client_id': client_id})
+        client = client_cache.get(client_id)
+        if client is MISSING:
+            document = cls.find_one({'client_id': client_id})
+            client = cls(document) if document else None
+            client_cache.set(client_id, client)
+        return client
+    
+    @classmethod
+    def update(cls, client_id, **kwargs):
+        """Update a client and evict it from every worker's cache."""
+        kwargs['updated_at'] = datetime.now(UTC)
+        
+        result = cls.update_one(
+            {'client_id': client_id},
+            {'$set': kwargs, '$inc': {'version': 1}}
+        )
+        client_cache.delete(client_id)
+        return result
+    
+    @classmethod
+    def record_issuance(cls, client_id, reused):
+        """Count a token minted for, or reused by, a client.
+        
+        The count is held in ``issuance_counters`` and written with the
+        worker's next periodic flush, not on the token request itself.
+        """
+        counter = 'stats.tokens_reused' if reused else 'stats.tokens_issued'
+        issuance_counters.increment(
+            client_id, counter, latest={'stats.last_issued_at': datetime.now(UTC)}
+        )
+    
+    @classmethod
+    def write_issuance(cls, updates):
+        """Apply flushed issuance counters with one unordered bulk write.
+        
+        Operations follow the order of updates, as ``CounterBuffer`` maps
+        the indexes of failed writes back to client IDs. Only the ``stats``
+        counters change, so cached clients are kept.
+        """
+        cls._get_collection().bulk_write([
+            UpdateOne({'client_id': client_id}, update)
+            for client_id, update in updates.items()
+        ], ordered=False)
+    
+    @classmethod
+    def get_issuance_stats(cls, limit=50):
+        """Clients ordered by how many tokens they have been minted."""
+        return list(cls.find(
+            {'stats': {'$exists': True}},
+            projection={'_id': 0, 'client_id': 1, 'client_name': 1, 'stats': 1},
+            sort=[('stats.tokens_issued', -1)],
+            limit=limit
+        ))
     
     def get_client_id(self):
         """Get client ID for OAuth."""
-        return self.get('client_id')
+        return self.client_id
     
     def get_default_redirect_uri(self):
         """Get default redirect URI for OAuth."""
-        return self.get('redirect_uris')[0]
+        return self.redirect_uris[0] if self.redirect_uris else None
     
     def get_allowed_scope(self, scope):
         """Get allowed scope for OAuth."""
         if not scope:
             return ''
-        allowed = set(self.get('scope').split())
-        return ' '.join(allowed.intersection(set(scope.split())))
+        return ' '.join(s for s in scope.split() if s in self.scopes)
     
     def check_redirect_uri(self, redirect_uri):
         """Check if redirect URI is valid."""
-        return redirect_uri in self.get('redirect_uris')
+        return redirect_uri in self.redirect_uri_set
     
     def check_client_secret(self, client_secret):
         """Check if client secret is valid."""
-        return self.get('client_secret') == client_secret
+        if not self.client_secret or not client_secret:
+            return False
+        return secrets.compare_digest(self.client_secret, client_secret)
+    
+    def check_endpoint_auth_method(self, method, endpoint):
+        """Check if the client may authenticate with the given method."""
+        if method == 'none':
+            return not self.client_secret
+        return bool(self.client_secret)
     
     def check_grant_type(self, grant_type):
         """Check if grant type is allowed."""
-        return grant_type in self.get('grant_types')
+        return grant_type in self.grant_types
     
     def check_response_type(self, response_type):
         """Check if response type is allowed."""
-        return response_type in self.get('response_types')
+        return response_type in self.response_types
+
+# Per-worker token issuance counts for OAuth2Client, flushed periodically
+issuance_counters = CounterBuffer('client-issuance', OAuth2Client.write_issuance)
+
+class BearerToken(dict):
+    """Token document with the methods Authlib's validators call.
+    
+    ``scope_mask`` is compiled once when the token is loaded, so checking it
+    against a route's required scopes is a single integer AND. The mask is
+    process-local and is recomputed rather than pickled.
+    """
+    
+    __slots__ = ('scope_mask',)
+    
+    def __init__(self, document):
+        super().__init__(document)
+        self.scope_mask = scope_registry.mask(document.get('scope'))
+    
+    def __reduce__(self):
+        return (BearerToken, (dict(self),))
+    
+    def has_scopes(self, required_mask):
+        """Check that the token grants every scope in required_mask."""
+        return self.scope_mask & required_mask == required_mask
+    
+    def get_scope(self):
+        """Scope granted to the token."""
+        return self.get('scope') or ''
+    
+    def check_client(self, client):
+        """Check the token was issued to client."""
+        return self['client_id'] == client.get_client_id()
+    
+    def is_expired(self):
+        """Check if the token is past its expiry."""
+        return seconds_until(self['expires_at']) <= 0
+    
+    def is_revoked(self):
+        """Revoked tokens are deleted or listed in ``revoked_tokens``."""
+        return False
 
 class OAuth2Token(BaseDocument):
     """OAuth2 Token model."""
     
     COLLECTION = 'oauth_tokens'
+    EXPIRES_FIELD = 'expires_at'
+    
+    INDEXES = (
+        IndexModel([('access_token', ASCENDING)], unique=True),
+        IndexModel([('refresh_token', ASCENDING)], unique=True, sparse=True),
+        IndexModel([('client_id', ASCENDING), ('user_id', ASCENDING)], unique=True),
+    )
+    QUERY_SHAPES = (
+        {'name': 'get_by_access_token', 'filter': {'access_token': ''}},
+        {'name': 'lookup_many', 'filter': {'access_token': {'$in': ['']}}},
+        {'name': 'get_by_refresh_token', 'filter': {'refresh_token': ''}},
+        {'name': 'rotate', 'filter': {'client_id': '', 'user_id': ''}},
+    )
     
     @classmethod
     def create(cls, client_id, token_type, access_token,
@@ -247,37 +634,153 @@ class OAuth2Token(BaseDocument):
             'client_id': client_id,
             'token_type': token_type,
             'access_token': access_token,
-            'refresh_token': refresh_token,
             'scope': scope,
             'issued_at': issued_at,
             'expires_at': expires_at
         }
         
+        # Omitted rather than null so the sparse unique index skips it
+        if refresh_token:
+            document['refresh_token'] = refresh_token
         if user_id:
             document['user_id'] = user_id
         
         cls.insert_one(document)
         return access_token
     
+    @classmethod
+    def rotate(cls, token_data):
+        """Atomically replace the token held by a client/user pair.
+        
+        One upsert on the unique ``(client_id, user_id)`` index swaps in the
+        new token and returns the row it replaced, which is then invalidated.
+        
+        Args:
+            token_data (dict): The new token document.
+            
+        Returns:
+            The replaced token document, or None if there was none.
+        """
+        collection = cls._get_collection()
+        query = {
+            'client_id': token_data['client_id'],
+            'user_id': token_data.get('user_id')
+        }
+        
+        try:
+            previous = collection.find_one_and_replace(
+                query, token_data,
+                upsert=True,
+                return_document=ReturnDocument.BEFORE
+            )
+        except DuplicateKeyError:
+            # A concurrent request inserted the pair first; replace its row
+            previous = collection.find_one_and_replace(
+                query, token_data,
+                return_document=ReturnDocument.BEFORE
+            )
+        
+        if previous:
+            cls.invalidate(previous)
+        return previous
+    
     @classmethod
     def get_by_access_token(cls, access_token):
         """Get a token by access token."""
         return cls.find_one({'access_token': access_token})
     
+    @classmethod
+    def get_reusable(cls, client_id, scope, min_remaining):
+        """Find a client-only token for scope that still has enough lifetime.
+        
+        Args:
+            client_id (str): The client the token was issued to.
+            scope (str): Space-separated scope the new token would carry.
+            min_remaining (float): Fraction of the token's lifetime that must
+                remain for it to be reused.
+            
+        Returns:
+            The token document, or None.
+        """
+        token = cls.find_one({'client_id': client_id, 'user_id': None})
+        if not token or set((token.get('scope') or '').split()) != set((scope or '').split()):
+            return None
+        
+        lifetime = (as_utc(token['expires_at']) - as_utc(token['issued_at'])).total_seconds()
+        if seconds_until(token['expires_at']) < lifetime * min_remaining:
+            return None
+        return token
+    
+    @classmethod
+    def lookup(cls, access_token):
+        """Get a token by access token through ``token_cache``."""
+        return cls.lookup_many([access_token])[access_token]
+    
+    @classmethod
+    def lookup_many(cls, access_tokens):
+        """Resolve access tokens through ``token_cache``.
+        
+        Cache misses are fetched with a single ``$in`` query. Known tokens
+        are cached no longer than their remaining lifetime; unknown tokens
+        are cached as None for the short negative TTL.
+        
+        Args:
+            access_tokens (list): Access token strings.
+            
+        Returns:
+            dict: Each access token mapped to its document, or None.
+        """
+        found = {}
+        misses = []
+        for access_token in dict.fromkeys(access_tokens):
+            token = token_cache.get(access_token)
+            if token is MISSING:
+                misses.append(access_token)
+            else:
+                found[access_token] = token
+        
+        if misses:
+            documents = {
+                doc['access_token']: doc
+                for doc in cls.find({'access_token': {'$in': misses}})
+            }
+            for access_token in misses:
+                token = documents.get(access_token)
+                if token:
+                    token = BearerToken(token)
+                    ttl = min(token_cache.ttl, seconds_until(token['expires_at']))
+                    token_cache.set(access_token, token, ttl)
+                else:
+                    token_cache.set(access_token, None)
+                found[access_token] = token
+        
+        return found
+    
     @classmethod
     def get_by_refresh_token(cls, refresh_token):
         """Get a token by refresh token."""
-        return cls.find_one({'refresh_token': refresh_token})
+        token = cls.find_one({'refresh_token': refresh_token})
+        return BearerToken(token) if token else None
     
     @classmethod
     def revoke(cls, access_token):
         """Revoke a token."""
         token = cls.get_by_access_token(access_token)
         if token:
+            # Delete first so a concurrent lookup cannot cache it again
             cls.delete_one({'access_token': access_token})
+            cls.invalidate(token)
             return True
+        token_cache.delete(access_token)
         return False
     
+    @classmethod
+    def invalidate(cls, token):
+        """Evict a token from the cache and revoke it if it is self-contained."""
+        token_cache.delete(token['access_token'])
+        if token.get('jti'):
+            RevokedToken.add(token['jti'], token['expires_at'])
+    
     @classmethod
     def is_valid(cls, access_token):
         """Check if token is valid."""
@@ -287,10 +790,125 @@ class OAuth2Token(BaseDocument):
         
         return token['expires_at'] > datetime.now(UTC)
 
+class RevokedToken(BaseDocument):
+    """Revocation list for signed access tokens.
+    
+    Only the ``jti`` is stored, and only until the token would have expired
+    anyway. Each worker keeps the active set in ``revoked_token_cache`` and
+    reloads it periodically to pick up revocations made elsewhere.
+    """
+    
+    COLLECTION = 'revoked_tokens'
+    EXPIRES_FIELD = 'expires_at'
+    
+    INDEXES = (
+        IndexModel([('jti', ASCENDING)], unique=True),
+    )
+    QUERY_SHAPES = (
+        {'name': 'load_active', 'filter': {'expires_at': {'$gt': 0}}},
+    )
+    
+    @classmethod
+    def add(cls, jti, expires_at):
+        """Revoke a signed token by its jti."""
+        revoked_token_cache.set(jti, True)
+        cls.update_one(
+            {'jti': jti},
+            {'$setOnInsert': {'jti': jti, 'expires_at': expires_at}},
+            upsert=True
+        )
+    
+    @classmethod
+    def load_active(cls):
+        """Map every jti revoked before its expiry to True."""
+        revoked = cls.find(
+            {'expires_at': {'$gt': datetime.now(UTC)}},
+            projection={'jti': 1, '_id': 0}
+        )
+        return {doc['jti']: True for doc in revoked}
+    
+    @classmethod
+    def is_revoked(cls, jti):
+        """Check a jti against the revocation list."""
+        return revoked_token_cache.get(jti, False)
+
+class AuthorizationCode(BaseDocument):
+    """Authorization codes issued by the authorization code grant.
+    
+    Instances wrap a stored code record for Authlib, which reads the
+    redirect URI, scope and PKCE challenge from it. Records are kept by the
+    store selected with ``AUTH_CODE_STORE`` (see ``app.models.code_store``);
+    the ``auth_codes`` collection backs the default Mongo store.
+    """
+    
+    COLLECTION = 'auth_codes'
+    EXPIRES_FIELD = 'expires_at'
+    
+    INDEXES = (
+        IndexModel([('code', ASCENDING)], unique=True),
+    )
+    QUERY_SHAPES = (
+        {'name': 'consume', 'filter': {'code': '', 'client_id': '', 'expires_at': {'$gt': 0}}},
+    )
+    
+    __slots__ = (
+        'code', 'client_id', 'redirect_uri', 'scope', 'user_id',
+        'code_challenge', 'code_challenge_method', 'nonce', 'expires_at'
+    )
+    
+    def __init__(self, record):
+        self.code = record['code']
+        self.client_id = record['client_id']
+        self.redirect_uri = record.get('redirect_uri')
+        self.scope = record.get('scope')
+        self.user_id = record.get('user_id')
+        self.code_challenge = record.get('code_challenge')
+        self.code_challenge_method = record.get('code_challenge_method')
+        self.nonce = record.get('nonce')
+        self.expires_at = record['expires_at']
+    
+    def get_redirect_uri(self):
+        """Redirect URI the code was issued for."""
+        return self.redirect_uri
+    
+    def get_scope(self):
+        """Scope granted with the code."""
+        return self.scope
+    
+    def get_nonce(self):
+        """OpenID Connect nonce, if one was sent."""
+        return self.nonce
+
+# Per-worker snapshots of small, hot collections, reloaded after any write
+api_key_cache = SnapshotCache(
+    'api_keys', ApiKey.load_active,
+    collection=ApiKey.COLLECTION, refresh_interval=60
+)
+revoked_token_cache = SnapshotCache(
+    'revoked_tokens', RevokedToken.load_active,
+    collection=RevokedToken.COLLECTION, refresh_interval=30
+)
+
 class Project(BaseDocument):
     """Project model."""
     
     COLLECTION = 'projects'
+    IDENTITY_KEY = 'project_id'
+    
+    INDEXES = (
+        IndexModel([('project_id', ASCENDING)], unique=True),
+        IndexModel([('user_id', ASCENDING), ('created_at', ASCENDING), ('_id', ASCENDING)]),
+    )
+    QUERY_SHAPES = (
+        {'name': 'get_by_id', 'filter': {'project_id': ''}},
+        {'name': 'get_by_user', 'filter': {'user_id': ''}},
+        {'name': 'page_by_user', 'filter': {'user_id': ''}, 'sort': [('created_at', 1), ('_id', 1)]},
+    )
+    FIELDS = (
+        'project_id', 'name', 'description', 'status', 'user_id',
+        'created_at', 'updated_at'
+    )
+    SUMMARY_FIELDS = ('project_id', 'name', 'status', 'updated_at')
     
     @classmethod
     def create(cls, name, description, user_id=None):
@@ -314,40 +932,133 @@ class Project(BaseDocument):
         return project_id
     
     @classmethod
-    def get_by_id(cls, project_id):
+    def get_by_id(cls, project_id, projection=None):
         """Get a project by ID."""
-        return cls.find_one({'project_id': project_id})
+        return cls.find_one({'project_id': project_id}, projection)
     
     @classmethod
-    def get_by_user(cls, user_id):
+    def get_by_user(cls, user_id, projection=None):
         """Get projects by user ID."""
-        return list(cls.find({'user_id': user_id}))
+        return list(cls.find({'user_id': user_id}, projection))
+    
+    @classmethod
+    def iter_by_user(cls, user_id, projection=None):
+        """Iterate over all of a user's projects in creation order."""
+        return cls.find(
+            {'user_id': user_id},
+            projection,
+            sort=[('created_at', 1), ('_id', 1)],
+            batch_size=cls.STREAM_BATCH_SIZE
+        )
     
     @classmethod
-    def update(cls, project_id, **kwargs):
-        """Update a project."""
+    def page_by_user(cls, user_id, limit, after=None, before=None,
+                     latest=False, projection=None):
+        """Get a page of a user's projects in creation order."""
+        return cls.paginate(
+            {'user_id': user_id}, 'created_at', limit,
+            after=after, before=before, latest=latest, projection=projection
+        )
+    
+    @classmethod
+    def update(cls, project_id, accessible_by=None, projection=None, **kwargs):
+        """Update a project and return it as updated, in one round trip.
+        
+        Args:
+            project_id (str): The project to update.
+            accessible_by (str): If given, only update the project when it
+                belongs to this user or to no one.
+            projection (dict): Fields of the updated project to return.
+            **kwargs: Fields to set.
+            
+        Returns:
+            The updated project, or None if it does not exist or is not
+            accessible.
+        """
         kwargs['updated_at'] = datetime.now(UTC)
         
-        return cls.update_one(
-            {'project_id': project_id},
-            {'$set': kwargs}
-        )
+        query = {'project_id': project_id}
+        if accessible_by:
+            query['user_id'] = {'$in': [accessible_by, None]}
+        
+        return cls.find_one_and_update(query, {'$set': kwargs}, projection)
 
 class Document(BaseDocument):
     """Document model for project artifacts."""
     
     COLLECTION = 'documents'
+    IDENTITY_KEY = 'document_id'
+    
+    INDEXES = (
+        IndexModel([('document_id', ASCENDING)], unique=True),
+        IndexModel([('project_id', ASCENDING), ('created_at', ASCENDING), ('_id', ASCENDING)]),
+        IndexModel([
+            ('project_id', ASCENDING), ('document_type', ASCENDING),
+            ('created_at', ASCENDING), ('_id', ASCENDING)
+        ]),
+    )
+    QUERY_SHAPES = (
+        {'name': 'get_by_id', 'filter': {'document_id': ''}},
+        {'name': 'get_by_project', 'filter': {'project_id': ''}},
+        {'name': 'get_by_project_and_type', 'filter': {'project_id': '', 'document_type': ''}},
+        {'name': 'page_by_project', 'filter': {'project_id': ''}, 'sort': [('created_at', 1), ('_id', 1)]},
+        {'name': 'page_by_project_and_type', 'filter': {'project_id': '', 'document_type': ''}, 'sort': [('created_at', 1), ('_id', 1)]},
+    )
+    FIELDS = (
+        'document_id', 'project_id', 'document_type', 'content',
+        'content_length', 'content_type', 'created_at', 'updated_at'
+    )
+    SUMMARY_FIELDS = ('document_id', 'document_type', 'created_at', 'updated_at')
+    
+    # Internal fields needed to manage chunked bodies
+    CHUNK_FIELDS = ('content_file_id', 'has_chunks')
+    
+    # Internal fields that may be written alongside content and must be
+    # cleared when a later write does not set them
+    CONTENT_MARKERS = ('content_file_id', 'content_codec')
     
     @classmethod
-    def create(cls, project_id, document_type, content):
-        """Create a new document."""
+    def _content_fields(cls, document_id, content):
+        """Fields storing content inline, compressed, or in chunks when large.
+        
+        Compressed documents hold the serialized content as binary and name
+        the codec in ``content_codec``. Chunked documents keep ``content``
+        as None and point at their body with ``content_file_id``; chunks are
+        not compressed so byte ranges can be read directly. ``has_chunks`` is
+        never cleared, so superseded chunk files are only looked for on
+        documents that ever had some.
+        """
+        data, content_type = encode_content(content)
+        fields = {'content_length': len(data), 'content_type': content_type}
+        if not content_store.should_chunk(len(data)):
+            compressed, codec = content_compressor.compress(data)
+            if codec:
+                return {**fields, 'content': compressed, 'content_codec': codec}
+            return {**fields, 'content': content}
+        
+        return {
+            **fields,
+            'content': None,
+            'content_file_id': content_store.put(document_id, data, content_type),
+            'has_chunks': True
+        }
+    
+    @classmethod
+    def create(cls, project_id, document_type, content, owner_id=None):
+        """Create a new document.
+        
+        ``owner_id`` copies the project's owner onto the document so updates
+        can be authorized by the document alone.
+        """
         now = datetime.now(UTC)
+        document_id = str(uuid.uuid4())
         
         document = {
-            'document_id': str(uuid.uuid4()),
+            'document_id': document_id,
             'project_id': project_id,
             'document_type': document_type,
-            'content': content,
+            **cls._content_fields(document_id, content),
+            'owner_id': owner_id,
             'created_at': now,
             'updated_at': now
         }
@@ -356,40 +1067,303 @@ class Document(BaseDocument):
         return document['document_id']
     
     @classmethod
-    def get_by_id(cls, document_id):
+    def create_many(cls, project_id, items, owner_id=None):
+        """Create several documents in one project with a single bulk write.
+        
+        Args:
+            project_id (str): Project every document belongs to.
+            items (list): ``{'document_type': ..., 'content': ...}`` dicts.
+            owner_id (str): Project owner copied onto each document.
+        
+        Returns:
+            list: One result per item, in order: ``{'document_id': ...}``
+            when created, ``{'error': ...}`` otherwise.
+        """
+        now = datetime.now(UTC)
+        results = []
+        documents = []
+        positions = []
+        for item in items:
+            if not isinstance(item, dict) or not all(k in item for k in ('document_type', 'content')):
+                results.append({'error': 'Missing required fields'})
+                continue
+            document_id = str(uuid.uuid4())
+            documents.append({
+                'document_id': document_id,
+                'project_id': project_id,
+                'document_type': item['document_type'],
+                **cls._content_fields(document_id, item['content']),
+                'owner_id': owner_id,
+                'created_at': now,
+                'updated_at': now
+            })
+            positions.append(len(results))
+            results.append({'document_id': document_id})
+        
+        failed = cls.insert_many(documents)
+        for index, message in failed.items():
+            document = documents[index]
+            if document.get('content_file_id'):
+                content_store.delete(document['content_file_id'])
+            results[positions[index]] = {'error': message}
+        return results
+    
+    @classmethod
+    def create_from_stream(cls, project_id, document_type, stream, content_type,
+                           owner_id=None):
+        """Create a document whose body is streamed straight into chunks."""
+        now = datetime.now(UTC)
+        document_id = str(uuid.uuid4())
+        file_id, length = content_store.put_stream(document_id, stream, content_type)
+        
+        cls.insert_one({
+            'document_id': document_id,
+            'project_id': project_id,
+            'document_type': document_type,
+            'content': None,
+            'content_length': length,
+            'content_type': content_type,
+            'content_file_id': file_id,
+            'has_chunks': True,
+            'owner_id': owner_id,
+            'created_at': now,
+            'updated_at': now
+        })
+        return document_id
+    
+    @classmethod
+    def get_by_id(cls, document_id, projection=None):
         """Get a document by ID."""
-        return cls.find_one({'document_id': document_id})
+        return cls._decode(
+            cls.find_one({'document_id': document_id}, cls._read_projection(projection)),
+            projection
+        )
     
     @classmethod
-    def get_by_project(cls, project_id, document_type=None):
+    def get_by_project(cls, project_id, document_type=None, projection=None):
         """Get documents for a project, optionally filtered by type."""
         query = {'project_id': project_id}
         if document_type:
             query['document_type'] = document_type
             
-        return list(cls.find(query))
+        return [
+            cls._decode(document, projection)
+            for document in cls.find(query, cls._read_projection(projection))
+        ]
     
     @classmethod
-    def update(cls, document_id, content):
-        """Update a document."""
-        return cls.update_one(
-            {'document_id': document_id},
-            {
-                '$set': {
-                    'content': content,
-                    'updated_at': datetime.now(UTC)
-                }
-            }
+    def iter_by_project(cls, project_id, document_type=None, projection=None):
+        """Iterate over all of a project's documents in creation order."""
+        query = {'project_id': project_id}
+        if document_type:
+            query['document_type'] = document_type
+        
+        cursor = cls.find(
+            query,
+            cls._read_projection(projection),
+            sort=[('created_at', 1), ('_id', 1)],
+            batch_size=cls.STREAM_BATCH_SIZE
+        )
+        return (cls._decode(document, projection) for document in cursor)
+    
+    @classmethod
+    def page_by_project(cls, project_id, limit, document_type=None, after=None,
+                        before=None, latest=False, projection=None):
+        """Get a page of a project's documents in creation order."""
+        query = {'project_id': project_id}
+        if document_type:
+            query['document_type'] = document_type
+        
+        documents, cursors = cls.paginate(
+            query, 'created_at', limit,
+            after=after, before=before, latest=latest,
+            projection=cls._read_projection(projection)
         )
+        return [cls._decode(document, projection) for document in documents], cursors
+    
+    @classmethod
+    def update(cls, document_id, content, accessible_by=None, projection=None,
+               **fields):
+        """Update a document's content and return it as updated, in one round trip.
+        
+        Args:
+            document_id (str): The document to update.
+            content: The new content.
+            accessible_by (str): If given, only update the document when its
+                recorded ``owner_id`` is this user or explicitly None.
+                Documents created before owners were recorded never match.
+            projection (dict): Fields of the updated document to return.
+            **fields: Other fields to set alongside the content.
+            
+        Returns:
+            The updated document, or None if nothing matched.
+        """
+        content_fields = cls._content_fields(document_id, content)
+        update = {'$set': {**fields, **content_fields, 'updated_at': datetime.now(UTC)}}
+        unset = {field: '' for field in cls.CONTENT_MARKERS if field not in content_fields}
+        if unset:
+            update['$unset'] = unset
+        
+        document = cls._update_content(document_id, update, accessible_by, projection)
+        if document is None and 'content_file_id' in content_fields:
+            content_store.delete(content_fields['content_file_id'])
+        return document
+    
+    @classmethod
+    def replace_content_stream(cls, document_id, stream, content_type,
+                               accessible_by=None, projection=None):
+        """Replace a document's body with a stream copied into chunks.
+        
+        Args:
+            accessible_by (str): If given, only update the document when its
+                recorded ``owner_id`` is this user or explicitly None, as
+                in ``update``.
+        
+        Returns:
+            The updated document, or None if nothing matched.
+        """
+        file_id, length = content_store.put_stream(document_id, stream, content_type)
+        update = {'$set': {
+            'content': None,
+            'content_length': length,
+            'content_type': content_type,
+            'content_file_id': file_id,
+            'has_chunks': True,
+            'updated_at': datetime.now(UTC)
+        }, '$unset': {'content_codec': ''}}
+        
+        document = cls._update_content(document_id, update, accessible_by, projection)
+        if document is None:
+            content_store.delete(file_id)
+        return document
+    
+    @classmethod
+    def record_owner(cls, document_id, owner_id):
+        """Record the owner of a document created before owners were recorded.
+        
+        Documents that already have an ``owner_id`` are left unchanged.
+        """
+        cls.update_one(
+            {'document_id': document_id, 'owner_id': {'$exists': False}},
+            {'$set': {'owner_id': owner_id}}
+        )
+    
+    @classmethod
+    def _update_content(cls, document_id, update, accessible_by=None, projection=None):
+        """Apply a content update and drop chunk files it superseded."""
+        query = {'document_id': document_id}
+        if accessible_by:
+            # $exists keeps None from also matching a missing owner_id
+            query['owner_id'] = {'$in': [accessible_by, None], '$exists': True}
+        
+        read_projection = cls._read_projection(projection)
+        if read_projection:
+            read_projection = {**read_projection, **{field: 1 for field in cls.CHUNK_FIELDS}}
+        document = cls.find_one_and_update(query, update, read_projection)
+        if document is None:
+            return None
+        
+        file_id = document.pop('content_file_id', None)
+        if document.pop('has_chunks', False):
+            content_store.delete_stale(document_id, keep=file_id)
+        return cls._decode(document, projection)
+    
+    @staticmethod
+    def _read_projection(projection):
+        """Extend a projection with the fields needed to decode content."""
+        if projection and projection.get('content'):
+            return {**projection, 'content_codec': 1, 'content_type': 1}
+        return projection
+    
+    @staticmethod
+    def _decode(document, projection=None):
+        """Restore compressed content to its original value.
+        
+        Documents without a ``content_codec`` are returned unchanged, apart
+        from fields ``_read_projection`` added that the caller did not ask for.
+        """
+        if document is None:
+            return None
+        codec = document.pop('content_codec', None)
+        if codec:
+            data = content_compressor.decompress(document['content'], codec)
+            document['content'] = decode_content(data, document['content_type'])
+        if projection and not projection.get('content_type'):
+            document.pop('content_type', None)
+        return document
+    
+    @staticmethod
+    def open_content(document):
+        """Open a document's body for streaming.
+        
+        Chunked bodies are read from GridFS on demand; inline content is
+        serialized the same way it would be for chunked storage.
+        
+        Returns:
+            tuple: ``(file-like reader, length, content type)``.
+        """
+        if document.get('content_file_id'):
+            reader = content_store.open(document['content_file_id'])
+            return reader, reader.length, document['content_type']
+        
+        data, content_type = encode_content(document['content'])
+        return io.BytesIO(data), len(data), content_type
+
+class DocumentContentFile(BaseDocument):
+    """GridFS files holding chunked document bodies (see ``app.models.chunks``)."""
+    
+    COLLECTION = f'{CONTENT_BUCKET}.files'
+    
+    INDEXES = (
+        IndexModel([('metadata.document_id', ASCENDING)]),
+    )
+    QUERY_SHAPES = (
+        {'name': 'delete_stale', 'filter': {'metadata.document_id': '', '_id': {'$ne': None}}},
+    )
+
+# Sort key of a conversation message, matching its pagination cursor
+MESSAGE_POSITION = operator.itemgetter('timestamp', '_id')
 
 class Conversation(BaseDocument):
-    """Conversation model for project related messages."""
+    """Conversation model for project related messages.
+    
+    Messages are stored one document each, or packed into
+    ``conversation_buckets`` when ``buckets`` is set by ``config_storage``.
+    Messages older than ``CONVERSATION_ARCHIVE_AFTER_DAYS`` can be moved to
+    the compressed ``conversation_archive`` tier (see
+    ``app.models.archival``). Reads span every tier and return messages in
+    the same shape whichever one holds them.
+    """
     
     COLLECTION = 'conversations'
     
+    INDEXES = (
+        IndexModel([('project_id', ASCENDING), ('timestamp', ASCENDING), ('_id', ASCENDING)]),
+    )
+    QUERY_SHAPES = (
+        {'name': 'get_by_project', 'filter': {'project_id': ''}, 'sort': [('timestamp', 1)]},
+        {'name': 'page_by_project', 'filter': {'project_id': ''}, 'sort': [('timestamp', -1), ('_id', -1)]},
+    )
+    FIELDS = ('message_id', 'project_id', 'timestamp', 'user', 'message', 'metadata')
+    SUMMARY_FIELDS = ('message_id', 'timestamp', 'user', 'message')
+    
+    # BucketStore over ConversationBucket when CONVERSATION_STORAGE is bucketed
+    buckets = None
+    # ArchiveStore over ConversationArchive holding messages moved out of
+    # the hot tier, when CONVERSATION_ARCHIVE_ENABLED is set
+    archive = None
+    
     @classmethod
     def create(cls, project_id, user, message, metadata=None):
-        """Create a new conversation message."""
+        """Create a new conversation message.
+        
+        In buffered write mode the message is queued in ``conversation_buffer``
+        and written with the next batch instead of before returning.
+        
+        Raises:
+            BufferFull: In buffered mode, if the queue is full because
+                flushes are failing.
+        """
         if metadata is None:
             metadata = {}
             
@@ -402,30 +1376,221 @@ class Conversation(BaseDocument):
             'metadata': metadata
         }
         
-        cls.insert_one(document)
+        if conversation_buffer.enabled:
+            # Give queued messages their final position so cursors taken
+            # before the flush still point at them afterwards
+            document['_id'] = ObjectId()
+            conversation_buffer.add(document)
+        elif cls.buckets is not None:
+            cls.buckets.append(document)
+        else:
+            cls.insert_one(document)
         return document['message_id']
     
     @classmethod
-    def get_by_project(cls, project_id, limit=100):
-        """Get conversation history for a project."""
-        return list(cls.find(
-            {'project_id': project_id},
-            sort=[('timestamp', 1)],
-            limit=limit
-        ))
+    def feed_source(cls):
+        """``(collection getter, embedded array)`` for ``conversation_feed`` to watch."""
+        if cls.buckets is not None:
+            return ConversationBucket._get_collection, cls.buckets.items_field
+        return cls._get_collection, None
+    
+    @classmethod
+    def write_many(cls, documents):
+        """Store messages in bulk in whichever layout is configured.
+        
+        Returns:
+            dict: Error message by index for messages that were not stored.
+        """
+        if cls.buckets is not None:
+            return cls.buckets.append_many(documents)
+        return cls.insert_many(documents)
+    
+    @classmethod
+    def _hot_items(cls, project_id, after=None, before=None, descending=False,
+                   batch_size=None, projection=None):
+        """Messages still in ``conversations`` or its buckets, in order."""
+        if cls.buckets is not None:
+            return cls.buckets.iter_items(
+                project_id, after=after, before=before, descending=descending,
+                batch_size=batch_size
+            )
+        
+        query = {'project_id': project_id}
+        if after is not None:
+            query = {'$and': [query, position_filter('timestamp', after, '$gt')]}
+        elif before is not None:
+            query = {'$and': [query, position_filter('timestamp', before, '$lt')]}
+        # Keep the ordering keys so tiers and cursors can be built on them
+        if projection and any(value for field, value in projection.items() if field != '_id'):
+            projection = {**projection, '_id': 1, 'timestamp': 1, 'message_id': 1}
+        direction = -1 if descending or before is not None else 1
+        return cls.find(
+            query,
+            projection,
+            sort=[('timestamp', direction), ('_id', direction)],
+            batch_size=batch_size or 0
+        )
+    
+    @classmethod
+    def _pending_items(cls, project_id, after=None, before=None, descending=False):
+        """Messages of project_id queued in this worker's buffer, in order.
+        
+        Timestamps are rounded as the database will store them, so queued
+        messages sort, and give cursors, exactly as they will once written.
+        """
+        items = []
+        for document in conversation_buffer.pending(lambda document: document['project_id'] == project_id):
+            item = {**document, 'timestamp': as_stored(document['timestamp'])}
+            position = (item['timestamp'], item['_id'])
+            if after is not None and not position > after:
+                continue
+            if before is not None and not position < before:
+                continue
+            items.append(item)
+        items.sort(key=MESSAGE_POSITION, reverse=descending)
+        return items
+    
+    @classmethod
+    def _iter_tiers(cls, project_id, after=None, before=None, descending=False,
+                    batch_size=None, projection=None):
+        """Messages from every tier in ``(timestamp, _id)`` order.
+        
+        Archived messages are all older than the hot ones, so the tiers are
+        read one after the other and, going backwards, the archive is only
+        queried once the hot tier is exhausted. Messages still queued in this
+        worker's ``conversation_buffer`` are merged in, so a client sees its
+        own writes straight away; other workers see them once flushed.
+        """
+        descending = descending or before is not None
+        position = {'after': after, 'before': before, 'descending': descending, 'batch_size': batch_size}
+        tiers = [cls._hot_items(project_id, projection=projection, **position)]
+        if cls.archive is not None:
+            tiers.insert(0, cls.archive.iter_items(project_id, **position))
+        if descending:
+            tiers.reverse()
+        documents = itertools.chain(*tiers)
+        
+        if not conversation_buffer.enabled:
+            return documents
+        pending = cls._pending_items(project_id, after, before, descending)
+        if not pending:
+            return documents
+        merged = heapq.merge(documents, pending, key=MESSAGE_POSITION, reverse=descending)
+        # A batch being flushed can be read from both the database and the buffer
+        return (next(duplicates) for _, duplicates in itertools.groupby(merged, key=MESSAGE_POSITION))
+    
+    @classmethod
+    def get_by_project(cls, project_id, limit=100, projection=None):
+        """Get conversation history for a project.
+        
+        Messages this worker has buffered but not yet written are included.
+        """
+        return [
+            apply_projection(document, projection)
+            for document in itertools.islice(
+                cls._iter_tiers(project_id, batch_size=limit, projection=projection), limit
+            )
+        ]
+    
+    @classmethod
+    def iter_by_project(cls, project_id, projection=None):
+        """Iterate over a project's whole conversation in chronological order."""
+        return (
+            apply_projection(document, projection)
+            for document in cls._iter_tiers(
+                project_id, batch_size=cls.STREAM_BATCH_SIZE, projection=projection
+            )
+        )
+    
+    @classmethod
+    def iter_since(cls, project_id, last_event_id):
+        """Iterate over messages posted after a ``conversation_feed`` event id.
+        
+        Returns:
+            Iterator of ``(event id, message)`` pairs, like feed
+            subscriptions. The query runs on first iteration.
+        
+        Raises:
+            ValueError: If last_event_id is malformed.
+        """
+        documents = cls._iter_tiers(
+            project_id, after=decode_cursor(last_event_id), batch_size=cls.STREAM_BATCH_SIZE
+        )
+        return (
+            (conversation_feed.event_id(document), apply_projection(document, {'_id': 0}))
+            for document in documents
+        )
+    
+    @classmethod
+    def page_by_project(cls, project_id, limit, after=None, before=None,
+                        latest=False, projection=None):
+        """Get a page of a project's conversation in chronological order.
+        
+        With ``latest`` and no cursor, the page holds the newest messages.
+        Paging back past the hot tier continues into the archive.
+        """
+        documents, cursors = iter_page(
+            lambda **position: cls._iter_tiers(
+                project_id, batch_size=limit + 1, projection=projection, **position
+            ),
+            'timestamp', limit, after=after, before=before, latest=latest
+        )
+        return [
+            apply_projection(document, {**(projection or {}), '_id': 0})
+            for document in documents
+        ], cursors
+
+class ConversationBucket(BaseDocument):
+    """Conversation messages packed per project; see ``app.models.buckets``."""
+    
+    COLLECTION = 'conversation_buckets'
+    
+    INDEXES = (
+        IndexModel([('project_id', ASCENDING), ('window', ASCENDING)]),
+        IndexModel([('project_id', ASCENDING), ('start', ASCENDING), ('end', ASCENDING), ('_id', ASCENDING)]),
+        IndexModel([('project_id', ASCENDING), ('end', ASCENDING), ('start', ASCENDING), ('_id', ASCENDING)]),
+    )
+    QUERY_SHAPES = (
+        {'name': 'append', 'filter': {'project_id': '', 'window': datetime(1970, 1, 1), 'count': {'$lte': 0}}},
+        {'name': 'iter_items', 'filter': {'project_id': '', 'end': {'$gte': datetime(1970, 1, 1)}}, 'sort': [('start', 1), ('end', 1), ('_id', 1)]},
+        {'name': 'iter_items_descending', 'filter': {'project_id': '', 'start': {'$lte': datetime(1970, 1, 1)}}, 'sort': [('end', -1), ('start', -1), ('_id', -1)]},
+    )
+
+class ConversationArchive(BaseDocument):
+    """Compressed chunks of archived conversation messages; see ``ArchiveStore``."""
+    
+    COLLECTION = 'conversation_archive'
+    
+    INDEXES = (
+        IndexModel([('project_id', ASCENDING), ('start', ASCENDING), ('end', ASCENDING), ('_id', ASCENDING)]),
+        IndexModel([('project_id', ASCENDING), ('end', ASCENDING), ('start', ASCENDING), ('_id', ASCENDING)]),
+    )
+    QUERY_SHAPES = (
+        {'name': 'iter_items', 'filter': {'project_id': '', 'end': {'$gte': datetime(1970, 1, 1)}}, 'sort': [('start', 1), ('end', 1), ('_id', 1)]},
+        {'name': 'iter_items_descending', 'filter': {'project_id': '', 'start': {'$lte': datetime(1970, 1, 1)}}, 'sort': [('end', -1), ('start', -1), ('_id', -1)]},
+    )
+
+# Per-worker write-behind queue for Conversation.create, enabled by config_storage
+conversation_buffer = WriteBehindBuffer('conversations', Conversation.write_many)
+
+# Per-worker watcher pushing new conversation messages to live subscribers
+conversation_feed = ChangeFeed(
+    Conversation._get_collection, 'project_id', 'timestamp', Conversation.FIELDS
+)
 
 # Global OAuth objects
 require_oauth = ResourceProtector()
 
 def get_client(client_id):
     """Retrieve client by client_id"""
-    client = OAuth2Client.get_by_client_id(client_id)
-    if client:
-        return client
-    return None
+    return OAuth2Client.get_by_client_id(client_id)
 
 def save_token(token, request):
-    """Save token data after request is processed"""
+    """Save token data after request is processed.
+    
+    A client/user pair holds a single token, replaced in one round trip by
+    ``OAuth2Token.rotate``.
+    """
     if request.user:
         user_id = request.user.get('user_id')
     else:
@@ -433,26 +1598,29 @@ def save_token(token, request):
         
     client = request.client
     
-    # Delete previous tokens
-    get_mongo_db().oauth_tokens.delete_many({
-        'client_id': client.get_client_id(),
-        'user_id': user_id
-    })
-    
     # Create new token
-    expires_in = token.pop('expires_in')
+    expires_in = token['expires_in']
+    now = datetime.now(UTC)
     token_data = {
         'client_id': client.get_client_id(),
         'user_id': user_id,
         'token_type': token['token_type'],
         'access_token': token['access_token'],
-        'refresh_token': token.get('refresh_token'),
         'scope': token.get('scope'),
-        'issued_at': datetime.now(UTC),
-        'expires_at': datetime.now(UTC) + timedelta(seconds=expires_in)
+        'issued_at': now,
+        'expires_at': now + timedelta(seconds=expires_in)
     }
     
-    get_mongo_db().oauth_tokens.insert_one(token_data)
+    # Omitted rather than null so the sparse unique index skips it
+    if token.get('refresh_token'):
+        token_data['refresh_token'] = token['refresh_token']
+    
+    if access_token_signer.enabled:
+        claims = access_token_signer.decode(token['access_token'])
+        if claims:
+            token_data['jti'] = claims['jti']
+    
+    OAuth2Token.rotate(token_data)
     return token_data
 
 # Initialize authorization server with the required callbacks
@@ -463,40 +1631,83 @@ authorization = AuthorizationServer(
 
 # OAuth 2.0 Grant Types Implementation
 class AuthCodeGrant(AuthorizationCodeGrant):
-    """Authorization Code Grant for OAuth 2.0."""
+    """Authorization Code Grant for OAuth 2.0.
+    
+    Codes are consumed atomically when queried, so the token request costs
+    one store round trip and a replayed code finds nothing.
+    """
     
     TOKEN_ENDPOINT_AUTH_METHODS = ['client_secret_basic', 'client_secret_post']
     
+    # Replaced in config_oauth according to AUTH_CODE_STORE
+    code_store = MongoCodeStore(AuthorizationCode)
+    code_lifetime = 600
+    
     def save_authorization_code(self, code, request):
         """Save the authorization code."""
         client = request.client
-        auth_code = {
+        now = datetime.now(UTC)
+        record = {
             'code': code,
             'client_id': client.get_client_id(),
             'redirect_uri': request.redirect_uri,
             'scope': request.scope,
             'user_id': request.user.get('user_id'),
-            'created_at': datetime.now(UTC),
-            'expires_at': datetime.now(UTC) + timedelta(minutes=10)
+            'code_challenge': request.data.get('code_challenge'),
+            'code_challenge_method': request.data.get('code_challenge_method'),
+            'nonce': request.data.get('nonce'),
+            'created_at': now,
+            'expires_at': now + timedelta(seconds=self.code_lifetime)
         }
-        get_mongo_db().auth_codes.insert_one(auth_code)
-        return auth_code
+        self.code_store.save(record, self.code_lifetime)
+        return AuthorizationCode(record)
     
     def query_authorization_code(self, code, client):
-        """Query the authorization code."""
-        auth_code = get_mongo_db().auth_codes.find_one({'code': code})
-        if auth_code and auth_code['client_id'] == client.get_client_id():
-            return auth_code
+        """Consume the authorization code issued to this client."""
+        record = self.code_store.consume(code, client.get_client_id())
+        if record:
+            return AuthorizationCode(record)
         return None
     
     def delete_authorization_code(self, authorization_code):
-        """Delete the authorization code."""
-        get_mongo_db().auth_codes.delete_one({'code': authorization_code['code']})
+        """Nothing to do: the code was consumed by query_authorization_code."""
     
     def authenticate_user(self, authorization_code):
         """Authenticate the user."""
-        user_id = authorization_code['user_id']
-        return User.get_by_id(user_id)
+        return User.get_by_id(authorization_code.user_id)
+
+class CredentialsGrant(ClientCredentialsGrant):
+    """Client Credentials Grant for OAuth 2.0.
+    
+    With ``reuse_tokens`` enabled, a client asking for the same scope again
+    gets its current token back while at least ``reuse_min_remaining`` of
+    its lifetime is left, instead of minting and persisting a new one.
+    """
+    
+    reuse_tokens = False
+    reuse_min_remaining = 0.5
+    
+    def create_token_response(self):
+        """Issue a token, or hand back the client's still-fresh one."""
+        client = self.request.client
+        if self.reuse_tokens:
+            scope = client.get_allowed_scope(self.request.scope)
+            existing = OAuth2Token.get_reusable(
+                client.get_client_id(), scope, self.reuse_min_remaining
+            )
+            if existing:
+                OAuth2Client.record_issuance(client.get_client_id(), reused=True)
+                token = {
+                    'token_type': existing['token_type'],
+                    'access_token': existing['access_token'],
+                    'expires_in': int(seconds_until(existing['expires_at']))
+                }
+                if existing.get('scope'):
+                    token['scope'] = existing['scope']
+                return 200, token, self.TOKEN_RESPONSE_HEADER
+        
+        OAuth2Client.record_issuance(client.get_client_id(), reused=False)
+        return super().create_token_response()
 
 class RefreshGrant(RefreshTokenGrant):
     """Refresh Token Grant for OAuth 2.0."""
@@ -504,7 +1715,7 @@ class RefreshGrant(RefreshTokenGrant):
     def authenticate_refresh_token(self, refresh_token):
         """Authenticate the refresh token."""
         token = OAuth2Token.get_by_refresh_token(refresh_token)
-        if token and token['expires_at'] > datetime.now(UTC):
+        if token and not token.is_expired():
             return token
         return None
     
@@ -516,8 +1727,130 @@ class RefreshGrant(RefreshTokenGrant):
         return None
     
     def revoke_old_credential(self, credential):
-        """Revoke the old credential."""
-        OAuth2Token.delete_one({'refresh_token': credential['refresh_token']})
+        """Revoke the old credential.
+        
+        The old token belongs to the same client and user as the new one, so
+        ``save_token`` has already replaced and invalidated it.
+        """
+
+class SignedBearerTokenGenerator:
+    """Token generator that replaces the opaque access token with a signed one.
+    
+    Wraps the generator Authlib builds from app config so refresh tokens and
+    ``expires_in`` are produced exactly as for opaque tokens.
+    """
+    
+    def __init__(self, generator):
+        self.generator = generator
+    
+    def __call__(self, grant_type, client, user=None, scope=None,
+                 expires_in=None, include_refresh_token=True):
+        token = self.generator(
+            grant_type, client, user=user, scope=scope,
+            expires_in=expires_in, include_refresh_token=include_refresh_token
+        )
+        token['access_token'] = access_token_signer.encode(
+            client.get_client_id(),
+            user.get('user_id') if user else None,
+            token.get('scope'),
+            token['expires_in']
+        )
+        return token
+
+def config_cache(app):
+    """Size the per-worker caches and attach the shared Redis tier."""
+    client = app.config.get('CACHE_REDIS_CLIENT')
+    url = app.config.get('CACHE_REDIS_URL')
+    if client is not None or url:
+        shared_cache.configure(
+            url=url,
+            client=client,
+            namespace=app.config.get('CACHE_REDIS_NAMESPACE')
+        )
+        shared_cache.start_listener()
+    
+    # Without the shared tier an eviction only reaches this worker, so keep
+    # tokens briefly enough that revocations take effect everywhere soon
+    token_ttl = app.config.get('TOKEN_CACHE_TTL')
+    if not shared_cache.enabled and token_ttl is not None:
+        token_ttl = min(token_ttl, app.config.get('TOKEN_CACHE_LOCAL_TTL', 5))
+    token_cache.configure(
+        maxsize=app.config.get('TOKEN_CACHE_SIZE'),
+        ttl=token_ttl,
+        negative_ttl=app.config.get('TOKEN_CACHE_NEGATIVE_TTL')
+    )
+    client_cache.configure(
+        maxsize=app.config.get('CLIENT_CACHE_SIZE'),
+        ttl=app.config.get('CLIENT_CACHE_TTL')
+    )
+    api_key_cache.configure(
+        refresh_interval=app.config.get('API_KEY_CACHE_REFRESH')
+    )
+    revoked_token_cache.configure(
+        refresh_interval=app.config.get('TOKEN_REVOCATION_REFRESH')
+    )
+
+def create_bucket_store(config, get_collection=None):
+    """Build the conversation ``BucketStore`` with the configured limits."""
+    return BucketStore(
+        get_collection or ConversationBucket._get_collection,
+        'project_id', 'timestamp', 'messages',
+        max_items=config.get('CONVERSATION_BUCKET_SIZE', 200),
+        max_bytes=config.get('CONVERSATION_BUCKET_MAX_BYTES', 1024 * 1024),
+        span=config.get('CONVERSATION_BUCKET_SPAN', 86400)
+    )
+
+def create_archive_store(config):
+    """Build the conversation ``ArchiveStore`` with the configured codec."""
+    return ArchiveStore(
+        ConversationArchive._get_collection, 'project_id', 'timestamp',
+        codec=config.get('CONVERSATION_ARCHIVE_CODEC', 'zlib'),
+        max_items=config.get('CONVERSATION_ARCHIVE_CHUNK_SIZE', 1000)
+    )
+
+def config_storage(app):
+    """Configure how document bodies and conversation messages are stored."""
+    content_store.configure(
+        threshold=app.config.get('DOCUMENT_CHUNK_THRESHOLD'),
+        chunk_size=app.config.get('DOCUMENT_CHUNK_SIZE')
+    )
+    content_compressor.configure(
+        codec=app.config.get('DOCUMENT_COMPRESSION'),
+        level=app.config.get('DOCUMENT_COMPRESSION_LEVEL'),
+        threshold=app.config.get('DOCUMENT_COMPRESSION_THRESHOLD')
+    )
+    conversation_buffer.configure(
+        mode=app.config.get('CONVERSATION_WRITE_MODE', 'sync'),
+        flush_interval_ms=app.config.get('CONVERSATION_FLUSH_INTERVAL_MS', 50),
+        batch_size=app.config.get('CONVERSATION_FLUSH_BATCH_SIZE', 100),
+        max_pending=app.config.get('CONVERSATION_BUFFER_MAX', 10000)
+    )
+    storage = app.config.get('CONVERSATION_STORAGE', 'flat')
+    if storage not in ('flat', 'bucketed'):
+        raise ValueError(f'Unknown conversation storage: {storage}')
+    Conversation.buckets = create_bucket_store(app.config) if storage == 'bucketed' else None
+    # Without archival no reads pay for querying an empty archive
+    Conversation.archive = (
+        create_archive_store(app.config)
+        if app.config.get('CONVERSATION_ARCHIVE_ENABLED') else None
+    )
+    conversation_feed.configure(
+        mode=app.config.get('CONVERSATION_STREAM_MODE', 'auto'),
+        poll_interval=app.config.get('CONVERSATION_STREAM_POLL_INTERVAL', 1.0),
+        queue_size=app.config.get('CONVERSATION_STREAM_QUEUE_SIZE', 1000),
+        max_subscribers=app.config.get('CONVERSATION_STREAM_MAX_PER_WORKER', 0),
+        source=Conversation.feed_source()
+    )
+
+def config_password_hashing(app):
+    """Select the password hashing algorithm and size its process pool."""
+    password_hasher.configure(
+        algorithm=app.config.get('PASSWORD_HASH_ALGORITHM', 'scrypt'),
+        work_factor=app.config.get('PASSWORD_HASH_WORK_FACTOR'),
+        pool_size=app.config.get('PASSWORD_HASH_POOL_SIZE', 0),
+        max_concurrency=app.config.get('PASSWORD_HASH_MAX_CONCURRENCY', 4),
+        timeout=app.config.get('PASSWORD_HASH_TIMEOUT', 5)
+    )
 
 # Setup OAuth 2.0 server
 def config_oauth(app):
@@ -525,41 +1858,93 @@ def config_oauth(app):
     # Initialize the authorization server with the Flask app
     authorization.init_app(app)
     
+    # Select the authorization code store
+    AuthCodeGrant.code_store = create_code_store(
+        app.config.get('AUTH_CODE_STORE', 'mongo'),
+        model=AuthorizationCode,
+        redis_client=shared_cache.client,
+        redis_url=app.config.get('AUTH_CODE_REDIS_URL')
+    )
+    AuthCodeGrant.code_lifetime = app.config.get(
+        'AUTH_CODE_LIFETIME', AuthCodeGrant.code_lifetime
+    )
+    
     # Register grant types
     authorization.register_grant(AuthCodeGrant, [CodeChallenge(required=True)])
-    authorization.register_grant(ClientCredentialsGrant)
+    CredentialsGrant.reuse_tokens = app.config.get('CLIENT_CREDENTIALS_REUSE', False)
+    CredentialsGrant.reuse_min_remaining = app.config.get(
+        'CLIENT_CREDENTIALS_REUSE_MIN_REMAINING', CredentialsGrant.reuse_min_remaining
+    )
+    authorization.register_grant(CredentialsGrant)
+    issuance_counters.configure(
+        flush_interval=app.config.get('CLIENT_ISSUANCE_FLUSH_INTERVAL', 10.0)
+    )
     authorization.register_grant(RefreshGrant)
     
-    # Define resource token getter function
-    def get_token_resource(access_token):
-        """Retrieve token for resource access"""
-        token = OAuth2Token.get_by_access_token(access_token)
-        if token and token['expires_at'] > datetime.now(UTC):
-            return token
-        return None
-    
+    # Optionally issue self-contained access tokens
+    access_token_signer.configure(
+        enabled=app.config.get('OAUTH2_TOKEN_FORMAT', 'opaque') == 'jwt',
+        key=app.config.get('OAUTH2_JWT_SECRET_KEY') or app.config.get('SECRET_KEY'),
+        issuer=app.config.get('OAUTH2_JWT_ISSUER')
+    )
+    if access_token_signer.enabled:
+        authorization.register_token_generator(
+            'default',
+            SignedBearerTokenGenerator(
+                authorization.create_bearer_token_generator(app.config)
+            )
+        )
     # Configure resource protector with a validator
     require_oauth.register_token_validator(DatabaseBearerTokenValidator())
-    # Set token getter directly as an attribute instead of using register_token_getter
-    DatabaseBearerTokenValidator.authenticate_token = get_token_resource
 
 class DatabaseBearerTokenValidator(BearerTokenValidator):
     def authenticate_token(self, token_string):
         """Authenticate a token string.
         
+        Signed tokens are verified locally against the signing key and the
+        revocation list. Opaque tokens are resolved through the token cache
+        by ``OAuth2Token.lookup``.
+        
         Args:
             token_string (str): The token string to authenticate.
             
         Returns:
             The token object if valid, None otherwise.
         """
-        # This method will be replaced by the function in config_oauth
-        # but we still need to provide an implementation
-        token = OAuth2Token.get_by_access_token(token_string)
-        if token and token['expires_at'] > datetime.now(UTC):
+        if access_token_signer.enabled and access_token_signer.is_signed(token_string):
+            return self.authenticate_signed_token(token_string)
+        
+        token = OAuth2Token.lookup(token_string)
+        if token and not token.is_expired():
             return token
         return None
 
+    def authenticate_signed_token(self, token_string):
+        """Verify a signed access token without touching the database.
+        
+        Args:
+            token_string (str): The encoded JWT.
+            
+        Returns:
+            A token dict shaped like an ``oauth_tokens`` document, or None.
+        """
+        claims = access_token_signer.decode(token_string)
+        if not claims or RevokedToken.is_revoked(claims['jti']):
+            return None
+        
+        token = {
+            'client_id': claims['client_id'],
+            'token_type': 'Bearer',
+            'access_token': token_string,
+            'scope': claims.get('scope'),
+            'jti': claims['jti'],
+            'issued_at': datetime.fromtimestamp(claims['iat'], UTC),
+            'expires_at': datetime.fromtimestamp(claims['exp'], UTC)
+        }
+        if claims.get('sub'):
+            token['user_id'] = claims['sub']
+        return BearerToken(token)
+
     def request_invalid(self, request):
         """Check if the request is invalid.
         
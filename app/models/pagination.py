@@ -0,0 +1,162 @@
+"""
+Keyset (cursor) pagination over ``(sort field, _id)``.
+
+Pages are read by seeking past the last key seen instead of skipping, so a
+page costs the same at any depth as long as an index covers the equality
+filter followed by the sort field and ``_id``.
+"""
+import base64
+import binascii
+import itertools
+from bson import json_util
+from bson.errors import InvalidBSON
+
+def encode_cursor(document, sort_field):
+    """Build an opaque cursor pointing at document."""
+    raw = json_util.dumps([document[sort_field], document['_id']])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """Return the ``(sort value, _id)`` pair encoded in a cursor.
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        value, _id = json_util.loads(base64.urlsafe_b64decode(padded))
+    except (binascii.Error, InvalidBSON, TypeError, ValueError):
+        raise ValueError('Invalid cursor')
+    return value, _id
+
+def seek_filter(sort_field, cursor, operator):
+    """Filter for keys strictly after (``$gt``) or before (``$lt``) cursor."""
+    return position_filter(sort_field, decode_cursor(cursor), operator)
+
+def position_filter(sort_field, position, operator):
+    """Like ``seek_filter`` for an already decoded ``(value, _id)`` position."""
+    value, _id = position
+    return {'$or': [
+        {sort_field: {operator: value}},
+        {sort_field: value, '_id': {operator: _id}},
+    ]}
+
+def page_cursors(documents, sort_field, more, backward, after=None, before=None):
+    """Cursors to the pages either side of documents.
+
+    Args:
+        documents (list): The page, in ascending order, with ``_id`` still set.
+        sort_field (str): Field the results are ordered by.
+        more (bool): Whether the read found documents beyond the page.
+        backward (bool): Whether the page was read from the end backwards.
+        after (str): Cursor the page was read after, if any.
+        before (str): Cursor the page was read before, if any.
+
+    Returns:
+        dict: ``next`` and ``prev`` cursors, None at either end.
+    """
+    cursors = {'next': None, 'prev': None}
+    if documents:
+        first, last = documents[0], documents[-1]
+        if backward:
+            cursors['prev'] = encode_cursor(first, sort_field) if more else None
+            cursors['next'] = encode_cursor(last, sort_field) if before else None
+        else:
+            cursors['next'] = encode_cursor(last, sort_field) if more else None
+            cursors['prev'] = encode_cursor(first, sort_field) if after else None
+    return cursors
+
+def keyset_page(collection, query, sort_field, limit, after=None, before=None,
+                latest=False, projection=None):
+    """Read one page of query ordered by ``(sort_field, _id)`` ascending.
+
+    Args:
+        collection: The PyMongo collection to read.
+        query (dict): Equality filter selecting the result set.
+        sort_field (str): Field the results are ordered by.
+        limit (int): Page size.
+        after (str): Cursor; return the page following it.
+        before (str): Cursor; return the page preceding it.
+        latest (bool): Without a cursor, return the last page instead of
+            the first.
+        projection (dict): Fields to return; ``_id`` is never returned.
+
+    Returns:
+        tuple: ``(documents, cursors)`` where cursors holds ``next`` and
+        ``prev`` (None at either end of the result set).
+
+    Raises:
+        ValueError: If both cursors are given or a cursor is malformed.
+    """
+    if after and before:
+        raise ValueError('Use either after or before, not both')
+
+    backward = bool(before) or (latest and not after)
+    if after:
+        query = {'$and': [query, seek_filter(sort_field, after, '$gt')]}
+    elif before:
+        query = {'$and': [query, seek_filter(sort_field, before, '$lt')]}
+
+    # The cursor keys must be read even when the caller did not ask for them
+    strip = ()
+    if projection:
+        projection = {field: 1 for field in projection if field != '_id'}
+        if projection and sort_field not in projection:
+            projection[sort_field] = 1
+            strip = (sort_field,)
+
+    direction = -1 if backward else 1
+    documents = list(collection.find(
+        query,
+        projection or None,
+        sort=[(sort_field, direction), ('_id', direction)],
+        limit=limit + 1
+    ))
+    more = len(documents) > limit
+    documents = documents[:limit]
+    if backward:
+        documents.reverse()
+
+    cursors = page_cursors(documents, sort_field, more, backward, after, before)
+    for document in documents:
+        document.pop('_id', None)
+        for field in strip:
+            document.pop(field, None)
+    return documents, cursors
+
+def iter_page(iterate, sort_field, limit, after=None, before=None, latest=False):
+    """Read one page from an ordered iterator instead of a single query.
+
+    For sources that span more than one query, such as bucketed or tiered
+    storage. Takes the same cursors as ``keyset_page``.
+
+    Args:
+        iterate: Callable taking ``after``, ``before`` (decoded positions or
+            None) and ``descending``, and returning documents in
+            ``(sort_field, _id)`` order from just past the position.
+        sort_field (str): Field the results are ordered by.
+        limit (int): Page size.
+        after (str): Cursor; return the page following it.
+        before (str): Cursor; return the page preceding it.
+        latest (bool): Without a cursor, return the last page.
+
+    Returns:
+        tuple: ``(documents, cursors)``; documents keep their ``_id``.
+
+    Raises:
+        ValueError: If both cursors are given or a cursor is malformed.
+    """
+    if after and before:
+        raise ValueError('Use either after or before, not both')
+
+    backward = bool(before) or (latest and not after)
+    documents = list(itertools.islice(iterate(
+        after=decode_cursor(after) if after else None,
+        before=decode_cursor(before) if before else None,
+        descending=backward
+    ), limit + 1))
+    more = len(documents) > limit
+    documents = documents[:limit]
+    if backward:
+        documents.reverse()
+    return documents, page_cursors(documents, sort_field, more, backward, after, before)
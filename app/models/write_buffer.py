@@ -0,0 +1,187 @@
+"""
+Write-behind buffering for high-volume inserts.
+
+In buffered mode documents are acknowledged as soon as they are queued in
+this worker, and a background thread writes them with one ``insert_many``
+every ``flush_interval`` milliseconds or ``batch_size`` documents, whichever
+comes first. Queued documents are lost if the worker dies without exiting
+cleanly; a normal shutdown flushes them. Use sync mode where every write must
+be durable before it is acknowledged.
+
+The queue never grows past ``max_pending``: once it is full, for instance
+because the database is unreachable, ``add`` raises ``BufferFull`` rather
+than acknowledging documents it may never write.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class BufferFull(Exception):
+    """Raised when ``max_pending`` documents are queued and none could be written."""
+
+class WriteBehindBuffer:
+    """Per-worker queue of documents flushed in batches by a daemon thread.
+
+    Args:
+        name (str): Label used in log messages.
+        insert_many: Callable writing a list of documents and returning a
+            dict of error messages by index for documents it rejected.
+    """
+
+    def __init__(self, name, insert_many):
+        self.name = name
+        self.insert_many = insert_many
+        self.mode = 'sync'
+        self.flush_interval = 0.05
+        self.batch_size = 100
+        self.max_pending = 10000
+        self._pending = []
+        self._inflight = []
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stopping = False
+        self.flushes = 0
+        self.written = 0
+        self.dropped = 0
+        self.rejected = 0
+        atexit.register(self.close)
+
+    @property
+    def enabled(self):
+        return self.mode == 'buffered'
+
+    def configure(self, mode='sync', flush_interval_ms=50, batch_size=100,
+                  max_pending=10000):
+        """Select sync or buffered writes and tune flushing.
+
+        Args:
+            mode (str): ``sync`` to write on every call, ``buffered`` to
+                queue and write in batches.
+            flush_interval_ms (int): Longest a queued document waits.
+            batch_size (int): Queued documents that trigger a flush.
+            max_pending (int): Most documents queued at once. ``add`` flushes
+                in the calling thread when the queue is full, and raises
+                ``BufferFull`` if that does not make room.
+        """
+        if mode not in ('sync', 'buffered'):
+            raise ValueError(f'Unknown write mode: {mode}')
+        self.flush()
+        self.mode = mode
+        self.flush_interval = flush_interval_ms / 1000
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+
+    def _ensure_flusher(self):
+        # Documents queued by the parent belong to it, not to a forked worker
+        if self._pid != os.getpid():
+            with self._condition:
+                if self._pid != os.getpid():
+                    self._pending = []
+                    self._inflight = []
+                    self._stopping = False
+                    self._thread = threading.Thread(
+                        target=self._run, name=f'{self.name}-flusher', daemon=True
+                    )
+                    self._thread.start()
+                    self._pid = os.getpid()
+
+    def _size(self):
+        with self._condition:
+            return len(self._pending) + len(self._inflight)
+
+    def add(self, document):
+        """Queue a document for the next flush.
+
+        Raises:
+            BufferFull: If the queue is still full after flushing in the
+                calling thread. The document was not queued, and the write
+                can be retried once the database accepts writes again.
+        """
+        self._ensure_flusher()
+        if self._size() >= self.max_pending:
+            # Push back on writers by flushing in their thread
+            self.flush()
+        with self._condition:
+            size = len(self._pending) + len(self._inflight)
+            if size >= self.max_pending:
+                self.rejected += 1
+                raise BufferFull(f'{self.name}: {size} documents already queued')
+            self._pending.append(document)
+            size = len(self._pending)
+            # Wake the flusher to start the interval, or early for a full batch
+            if size == 1 or size >= self.batch_size:
+                self._condition.notify()
+
+    def pending(self, predicate):
+        """Queued or in-flight documents matching predicate, oldest first."""
+        with self._condition:
+            return [document for document in self._inflight + self._pending if predicate(document)]
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._pending and not self._stopping:
+                    self._condition.wait()
+                if self._stopping:
+                    return
+                if len(self._pending) < self.batch_size:
+                    self._condition.wait(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """Write every queued document now.
+
+        A batch that fails outright is put back at the head of the queue and
+        retried on the next flush; documents the database rejects one by one
+        are logged and dropped.
+        """
+        with self._flush_lock:
+            with self._condition:
+                batch, self._pending = self._pending, []
+                self._inflight = batch
+            if not batch:
+                return
+            try:
+                failed = self.insert_many(batch)
+            except Exception as e:
+                logger.error(f"{self.name} flush of {len(batch)} documents failed: {e}")
+                with self._condition:
+                    self._pending = batch + self._pending
+                    self._inflight = []
+                time.sleep(self.flush_interval)
+                return
+            with self._condition:
+                self._inflight = []
+                self.flushes += 1
+                self.written += len(batch) - len(failed)
+                self.dropped += len(failed)
+            for index, message in failed.items():
+                logger.error(f"{self.name} dropped a buffered document: {message}")
+
+    def close(self):
+        """Stop the flusher and write anything still queued."""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout=5)
+        self._pid = None
+        self.flush()
+
+    def stats(self):
+        """Return buffer counters for this worker."""
+        with self._condition:
+            return {
+                'mode': self.mode,
+                'pending': len(self._pending) + len(self._inflight),
+                'flushes': self.flushes,
+                'written': self.written,
+                'dropped': self.dropped,
+                'rejected': self.rejected
+            }
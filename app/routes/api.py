@@ -1,14 +1,100 @@
 """
 API routes for the project template.
 """
+import math
+import time
 import uuid
-from flask import Blueprint, request, jsonify, g, current_app
-from app.models.mongodb import Project, Document, Conversation, User
+from flask import Blueprint, request, jsonify, g, current_app, Response, url_for, stream_with_context
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.wsgi import wrap_file, get_input_stream
+from app.models.mongodb import Project, Document, Conversation, User, OAuth2Client, as_utc, conversation_feed
+from app.models.change_feed import FeedFull
+from app.models.write_buffer import BufferFull
 from app.utils.decorators import auth_required, admin_required
-from app.utils.response import success_response, error_response
+from app.utils.response import success_response, error_response, stream_response, sse_event
+from app.models.indexes import explain_queries
 
 api_bp = Blueprint('api', __name__, url_prefix='/api')
 
+def page_args():
+    """Read the keyset pagination parameters from the query string."""
+    limit = request.args.get('limit', current_app.config['PAGE_SIZE_DEFAULT'], type=int)
+    return {
+        'limit': max(1, min(limit, current_app.config['PAGE_SIZE_MAX'])),
+        'after': request.args.get('after'),
+        'before': request.args.get('before'),
+        'latest': request.args.get('latest', 'false').lower() == 'true'
+    }
+
+def limited_json(max_bytes):
+    """Parse the JSON request body, reading at most max_bytes of it.
+    
+    Unlike checking ``request.content_length``, this also bounds chunked
+    requests, which carry no Content-Length.
+    
+    Returns:
+        tuple: ``(data, None)``, with data None for a missing or malformed
+        body, or ``(None, error response)`` when the body is too large.
+    """
+    too_large = error_response(f'Request bodies are limited to {max_bytes} bytes', 413)
+    try:
+        # One byte over the limit tells a full body from an oversize one
+        body = get_input_stream(request.environ, max_content_length=max_bytes + 1).read()
+    except RequestEntityTooLarge:
+        return None, too_large
+    if len(body) > max_bytes:
+        return None, too_large
+    try:
+        return current_app.json.loads(body) if body else None, None
+    except ValueError:
+        return None, None
+
+def owned_project(project_id):
+    """Load a project the authenticated user may access.
+    
+    The project stays in the request's identity map, so handlers can read
+    it again, with any projection, without another query.
+    
+    Returns:
+        tuple: ``(project, None)``, or ``(None, error response)`` when the
+        project does not exist or belongs to another user.
+    """
+    project = Project.get_by_id(project_id)
+    if not project:
+        return None, error_response('Project not found', 404)
+    
+    user_id = g.get('user_id')
+    if user_id and project.get('user_id') and project.get('user_id') != user_id:
+        return None, error_response('Access denied', 403)
+    
+    return project, None
+
+def owned_document(document_id, projection=None):
+    """Load a document whose project the authenticated user may access.
+    
+    Args:
+        projection (dict): Fields to load; all public fields by default.
+    
+    Returns:
+        tuple: ``(document, None)``, or ``(None, error response)``.
+    """
+    document = Document.get_by_id(document_id, projection or Document.projection('*'))
+    if not document:
+        return None, error_response('Document not found', 404)
+    
+    _, error = owned_project(document['project_id'])
+    if error:
+        return None, error
+    
+    return document, None
+
+def stream_format():
+    """Streaming format asked for with ?stream= or an NDJSON Accept header."""
+    fmt = request.args.get('stream')
+    if fmt is None and request.accept_mimetypes.best == 'application/x-ndjson':
+        fmt = 'ndjson'
+    return fmt
+
 # Projects
 
 @api_bp.route('/projects', methods=['GET'])
@@ -19,10 +105,22 @@ def get_projects():
     if not user_id:
         return error_response('User not authenticated', 401)
     
-    projects = Project.get_by_user(user_id)
+    try:
+        projection = Project.projection(request.args.get('fields'))
+        fmt = stream_format()
+        if fmt:
+            return stream_response(
+                Project.iter_by_user(user_id, projection), 'projects', fmt=fmt
+            )
+        projects, cursors = Project.page_by_user(
+            user_id, projection=projection, **page_args()
+        )
+    except ValueError as e:
+        return error_response(str(e), 400)
+    
     return success_response({
         'projects': projects
-    })
+    }, meta=cursors)
 
 @api_bp.route('/projects', methods=['POST'])
 @auth_required('profile')
@@ -52,32 +150,17 @@ def create_project():
 @auth_required('profile')
 def get_project(project_id):
     """Get a project by ID."""
-    project = Project.get_by_id(project_id)
+    _, error = owned_project(project_id)
+    if error:
+        return error
     
-    if not project:
-        return error_response('Project not found', 404)
-    
-    # Check project ownership
-    user_id = g.get('user_id')
-    if user_id and project.get('user_id') and project.get('user_id') != user_id:
-        return error_response('Access denied', 403)
-    
-    return success_response(project)
+    return success_response(Project.get_by_id(project_id, Project.projection('*')))
 
 @api_bp.route('/projects/<project_id>', methods=['PUT'])
 @auth_required('profile')
 def update_project(project_id):
     """Update a project."""
-    data = request.get_json()
-    project = Project.get_by_id(project_id)
-    
-    if not project:
-        return error_response('Project not found', 404)
-    
-    # Check project ownership
-    user_id = g.get('user_id')
-    if user_id and project.get('user_id') and project.get('user_id') != user_id:
-        return error_response('Access denied', 403)
+    data = request.get_json() or {}
     
     # Update fields
     updates = {}
@@ -88,11 +171,18 @@ def update_project(project_id):
     if 'status' in data:
         updates['status'] = data['status']
     
-    if updates:
-        Project.update(project_id, **updates)
+    # Authorize, write and read back in one operation
+    updated_project = Project.update(
+        project_id,
+        accessible_by=g.get('user_id'),
+        projection=Project.projection('*'),
+        **updates
+    )
+    if updated_project is None:
+        # Tell a missing project from someone else's
+        _, error = owned_project(project_id)
+        return error or error_response('Project not found', 404)
     
-    # Get updated project
-    updated_project = Project.get_by_id(project_id)
     return success_response(updated_project)
 
 # Documents
@@ -100,37 +190,40 @@ def update_project(project_id):
 @api_bp.route('/projects/<project_id>/documents', methods=['GET'])
 @auth_required('profile')
 def get_documents(project_id):
-    """Get all documents for a project."""
-    project = Project.get_by_id(project_id)
-    
-    if not project:
-        return error_response('Project not found', 404)
-    
-    # Check project ownership
-    user_id = g.get('user_id')
-    if user_id and project.get('user_id') and project.get('user_id') != user_id:
-        return error_response('Access denied', 403)
-    
-    document_type = request.args.get('type')
-    documents = Document.get_by_project(project_id, document_type)
+    """Get document summaries for a project; ``fields`` selects other fields."""
+    project, error = owned_project(project_id)
+    if error:
+        return error
+    
+    try:
+        projection = Document.projection(request.args.get('fields'))
+        fmt = stream_format()
+        if fmt:
+            return stream_response(
+                Document.iter_by_project(project_id, request.args.get('type'), projection),
+                'documents',
+                fmt=fmt
+            )
+        documents, cursors = Document.page_by_project(
+            project_id,
+            document_type=request.args.get('type'),
+            projection=projection,
+            **page_args()
+        )
+    except ValueError as e:
+        return error_response(str(e), 400)
     
     return success_response({
         'documents': documents
-    })
+    }, meta=cursors)
 
 @api_bp.route('/projects/<project_id>/documents', methods=['POST'])
 @auth_required('profile')
 def create_document(project_id):
     """Create a new document."""
-    project = Project.get_by_id(project_id)
-    
-    if not project:
-        return error_response('Project not found', 404)
-    
-    # Check project ownership
-    user_id = g.get('user_id')
-    if user_id and project.get('user_id') and project.get('user_id') != user_id:
-        return error_response('Access denied', 403)
+    project, error = owned_project(project_id)
+    if error:
+        return error
     
     data = request.get_json()
     
@@ -142,7 +235,8 @@ def create_document(project_id):
     document_id = Document.create(
         project_id,
         data['document_type'],
-        data['content']
+        data['content'],
+        owner_id=project.get('user_id')
     )
     
     return success_response({
@@ -151,49 +245,155 @@ def create_document(project_id):
         'document_type': data['document_type']
     }, 201)
 
+@api_bp.route('/projects/<project_id>/documents/batch', methods=['POST'])
+@auth_required('profile')
+def create_documents(project_id):
+    """Create many documents with one ownership check and one bulk write."""
+    data, error = limited_json(current_app.config['DOCUMENT_BATCH_MAX_BYTES'])
+    if error:
+        return error
+    
+    project, error = owned_project(project_id)
+    if error:
+        return error
+    
+    items = data.get('documents') if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        return error_response('A non-empty documents list is required', 400)
+    
+    limit = current_app.config['DOCUMENT_BATCH_LIMIT']
+    if len(items) > limit:
+        return error_response(f'At most {limit} documents per request', 413)
+    
+    results = Document.create_many(project_id, items, owner_id=project.get('user_id'))
+    failed = sum(1 for result in results if 'error' in result)
+    return success_response(
+        {'project_id': project_id, 'documents': results},
+        {'created': len(results) - failed, 'failed': failed},
+        status_code=207 if failed else 201
+    )
+
+@api_bp.route('/projects/<project_id>/documents/upload', methods=['POST'])
+@auth_required('profile')
+def upload_document(project_id):
+    """Create a document from the raw request body, streamed into chunks."""
+    project, error = owned_project(project_id)
+    if error:
+        return error
+    
+    document_type = request.args.get('type')
+    if not document_type:
+        return error_response('Missing type parameter', 400)
+    
+    document_id = Document.create_from_stream(
+        project_id,
+        document_type,
+        request.stream,
+        request.content_type or 'application/octet-stream',
+        owner_id=project.get('user_id')
+    )
+    
+    return success_response({
+        'document_id': document_id,
+        'project_id': project_id,
+        'document_type': document_type
+    }, status_code=201)
+
 @api_bp.route('/documents/<document_id>', methods=['GET'])
 @auth_required('profile')
 def get_document(document_id):
-    """Get a document by ID."""
-    document = Document.get_by_id(document_id)
+    """Get a document by ID.
     
-    if not document:
-        return error_response('Document not found', 404)
+    Chunked bodies are not loaded; their ``content`` is null and
+    ``content_url`` points at the streaming download.
+    """
+    document, error = owned_document(
+        document_id, {**Document.projection('*'), 'content_file_id': 1}
+    )
+    if error:
+        return error
     
-    # Check document's project ownership
-    project = Project.get_by_id(document['project_id'])
-    user_id = g.get('user_id')
-    if user_id and project.get('user_id') and project.get('user_id') != user_id:
-        return error_response('Access denied', 403)
+    if document.pop('content_file_id', None):
+        document['content_url'] = url_for('api.get_document_content', document_id=document_id)
     
     return success_response(document)
 
-@api_bp.route('/documents/<document_id>', methods=['PUT'])
+@api_bp.route('/documents/<document_id>/content', methods=['GET'])
 @auth_required('profile')
-def update_document(document_id):
-    """Update a document."""
-    document = Document.get_by_id(document_id)
+def get_document_content(document_id):
+    """Stream a document's raw body, honouring Range requests."""
+    document, error = owned_document(
+        document_id, {**Document.projection('*'), 'content_file_id': 1}
+    )
+    if error:
+        return error
     
-    if not document:
-        return error_response('Document not found', 404)
+    reader, length, content_type = Document.open_content(document)
     
-    # Check document's project ownership
+    response = Response(
+        wrap_file(request.environ, reader, buffer_size=64 * 1024),
+        mimetype=content_type,
+        direct_passthrough=True
+    )
+    response.content_length = length
+    response.accept_ranges = 'bytes'
+    response.last_modified = document['updated_at']
+    response.set_etag(f"{document_id}-{as_utc(document['updated_at']).timestamp()}")
+    return response.make_conditional(request, accept_ranges=True, complete_length=length)
+
+@api_bp.route('/documents/<document_id>/content', methods=['PUT'])
+@auth_required('profile')
+def upload_document_content(document_id):
+    """Replace a document's body with the raw request body, streamed into chunks."""
+    # Check before storing the body, so a refused upload is never written
+    document, error = owned_document(document_id)
+    if error:
+        return error
+    
+    # The stream can only be read once, so a legacy document gets its owner
+    # first and the write itself checks ownership
     project = Project.get_by_id(document['project_id'])
-    user_id = g.get('user_id')
-    if user_id and project.get('user_id') and project.get('user_id') != user_id:
-        return error_response('Access denied', 403)
+    Document.record_owner(document_id, project.get('user_id'))
+    document = Document.replace_content_stream(
+        document_id,
+        request.stream,
+        request.content_type or 'application/octet-stream',
+        accessible_by=g.get('user_id'),
+        projection=Document.projection('*')
+    )
+    if document is None:
+        return error_response('Document not found', 404)
     
+    return success_response(document)
+
+@api_bp.route('/documents/<document_id>', methods=['PUT'])
+@auth_required('profile')
+def update_document(document_id):
+    """Update a document."""
     data = request.get_json()
     
     # Basic validation
     if not data or 'content' not in data:
         return error_response('Missing content field', 400)
     
-    # Update document
-    Document.update(document_id, data['content'])
+    # Check before storing the content, so a refused update writes no chunks
+    document, error = owned_document(document_id)
+    if error:
+        return error
+    
+    # A legacy document gets its owner first and the write itself checks
+    # ownership, so a project changing hands in between is not overwritten
+    project = Project.get_by_id(document['project_id'])
+    Document.record_owner(document_id, project.get('user_id'))
+    updated_document = Document.update(
+        document_id,
+        data['content'],
+        accessible_by=g.get('user_id'),
+        projection=Document.projection('*')
+    )
+    if updated_document is None:
+        return error_response('Document not found', 404)
     
-    # Get updated document
-    updated_document = Document.get_by_id(document_id)
     return success_response(updated_document)
 
 # Conversations
@@ -202,36 +402,101 @@ def update_document(document_id):
 @auth_required('profile')
 def get_conversations(project_id):
     """Get conversation history for a project."""
-    project = Project.get_by_id(project_id)
-    
-    if not project:
-        return error_response('Project not found', 404)
-    
-    # Check project ownership
-    user_id = g.get('user_id')
-    if user_id and project.get('user_id') and project.get('user_id') != user_id:
-        return error_response('Access denied', 403)
-    
-    limit = request.args.get('limit', 100, type=int)
-    conversations = Conversation.get_by_project(project_id, limit)
+    project, error = owned_project(project_id)
+    if error:
+        return error
+    
+    try:
+        projection = Conversation.projection(request.args.get('fields'))
+        fmt = stream_format()
+        if fmt:
+            return stream_response(
+                Conversation.iter_by_project(project_id, projection),
+                'conversations',
+                fmt=fmt
+            )
+        conversations, cursors = Conversation.page_by_project(
+            project_id, projection=projection, **page_args()
+        )
+    except ValueError as e:
+        return error_response(str(e), 400)
     
     return success_response({
         'conversations': conversations
-    })
+    }, meta=cursors)
+
+@api_bp.route('/projects/<project_id>/conversations/stream', methods=['GET'])
+@auth_required('profile')
+def stream_conversation(project_id):
+    """Push new conversation messages as Server-Sent Events.
+    
+    A reconnecting client's ``Last-Event-ID`` is replayed from the database
+    before live messages, so nothing posted in between is lost. Streams end
+    after ``CONVERSATION_STREAM_MAX_DURATION`` seconds, or when the client
+    falls too far behind, and clients reconnect from their last event.
+    
+    Each open stream holds a worker thread, so a worker serves at most
+    ``CONVERSATION_STREAM_MAX_PER_WORKER`` of them and answers further
+    requests with ``503`` and ``Retry-After``.
+    """
+    _, error = owned_project(project_id)
+    if error:
+        return error
+    
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    catch_up = ()
+    if last_event_id:
+        try:
+            catch_up = Conversation.iter_since(project_id, last_event_id)
+        except ValueError:
+            return error_response('Invalid Last-Event-ID', 400)
+    
+    config = current_app.config
+    heartbeat = config['CONVERSATION_STREAM_HEARTBEAT']
+    deadline = time.monotonic() + config['CONVERSATION_STREAM_MAX_DURATION']
+    # Subscribe before the catch-up query runs so no message falls in between
+    try:
+        subscription = conversation_feed.subscribe(project_id)
+    except FeedFull:
+        body, status = error_response('Too many open streams, retry shortly', 503)
+        retry_after = max(1, math.ceil(config['CONVERSATION_STREAM_RETRY_MS'] / 1000))
+        return body, status, {'Retry-After': str(retry_after)}
+    
+    def events():
+        try:
+            yield f"retry: {config['CONVERSATION_STREAM_RETRY_MS']}\n\n"
+            replayed = set()
+            for event_id, message in catch_up:
+                replayed.add(message['message_id'])
+                yield sse_event(message, event_id)
+            
+            while time.monotonic() < deadline and not subscription.closed:
+                item = subscription.get(timeout=heartbeat)
+                if item is None:
+                    yield ': keep-alive\n\n'
+                    continue
+                event_id, message = item
+                if message['message_id'] not in replayed:
+                    yield sse_event(message, event_id)
+        finally:
+            conversation_feed.unsubscribe(subscription)
+    
+    response = Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    # Frees the slot even if the client leaves before the first event
+    response.call_on_close(lambda: conversation_feed.unsubscribe(subscription))
+    return response
 
 @api_bp.route('/projects/<project_id>/conversations', methods=['POST'])
 @auth_required('profile')
 def create_conversation(project_id):
     """Create a new conversation message."""
-    project = Project.get_by_id(project_id)
-    
-    if not project:
-        return error_response('Project not found', 404)
-    
-    # Check project ownership
-    user_id = g.get('user_id')
-    if user_id and project.get('user_id') and project.get('user_id') != user_id:
-        return error_response('Access denied', 403)
+    project, error = owned_project(project_id)
+    if error:
+        return error
     
     data = request.get_json()
     
@@ -240,12 +505,16 @@ def create_conversation(project_id):
         return error_response('Missing required fields', 400)
     
     # Create conversation
-    message_id = Conversation.create(
-        project_id,
-        data['user'],
-        data['message'],
-        data.get('metadata', {})
-    )
+    try:
+        message_id = Conversation.create(
+            project_id,
+            data['user'],
+            data['message'],
+            data.get('metadata', {})
+        )
+    except BufferFull:
+        body, status = error_response('Conversation writes are backed up, retry shortly', 503)
+        return body, status, {'Retry-After': '1'}
     
     return success_response({
         'message_id': message_id,
@@ -265,4 +534,23 @@ def admin_stats():
         'total_conversations': 0
     }
     
-    return success_response(stats) 
\ No newline at end of file
+    return success_response(stats) 
+
+@api_bp.route('/admin/indexes', methods=['GET'])
+@admin_required
+def admin_index_report():
+    """Explain every model query shape and flag collection scans (admin only)."""
+    report = explain_queries()
+    return success_response(
+        {'queries': report},
+        meta={'collscans': sum(1 for entry in report if entry['collscan'])}
+    )
+
+@api_bp.route('/admin/clients/issuance', methods=['GET'])
+@admin_required
+def admin_client_issuance():
+    """Per-client token issuance counters, busiest first (admin only)."""
+    limit = request.args.get('limit', 50, type=int)
+    return success_response({
+        'clients': OAuth2Client.get_issuance_stats(limit)
+    })
@@ -1,15 +1,16 @@
 """
 Authentication routes for the API.
 """
-from datetime import datetime
-from flask import Blueprint, request, session, url_for, redirect, render_template, jsonify, g
+import time
+from flask import Blueprint, request, session, url_for, redirect, render_template, jsonify, g, current_app
 from werkzeug.security import gen_salt
 from app.models.mongodb import (
     User, OAuth2Client, OAuth2Token, 
-    authorization, generate_token
+    authorization, generate_token, as_utc, seconds_until
 )
 from app.utils.decorators import auth_required
 from app.utils.response import success_response, error_response
+from app.utils.passwords import PasswordHashingBusy
 from authlib.integrations.flask_oauth2 import current_token
 from werkzeug.security import generate_password_hash, check_password_hash
 import uuid
@@ -35,12 +36,15 @@ def register():
         return error_response('Username already exists', 409)
     
     # Create new user
-    user_id = User.create(
-        data['username'],
-        data['email'],
-        data['password'],
-        is_admin=data.get('is_admin', False)
-    )
+    try:
+        user_id = User.create(
+            data['username'],
+            data['email'],
+            data['password'],
+            is_admin=data.get('is_admin', False)
+        )
+    except PasswordHashingBusy:
+        return error_response('Too many concurrent registrations, retry shortly', 503)
     
     return success_response({
         'user_id': user_id,
@@ -58,7 +62,10 @@ def login():
         return error_response('Missing required fields', 400)
     
     # Validate credentials
-    user = User.validate_password(data['username'], data['password'])
+    try:
+        user = User.validate_password(data['username'], data['password'])
+    except PasswordHashingBusy:
+        return error_response('Too many concurrent logins, retry shortly', 503)
     if not user:
         return error_response('Invalid credentials', 401)
     
@@ -81,12 +88,6 @@ def logout():
         'message': 'Successfully logged out'
     })
 
-@auth_bp.route('/token', methods=['POST'])
-def issue_token():
-    """Legacy token issuance endpoint using API keys."""
-    # This endpoint is kept for backward compatibility
-    return error_response('Use OAuth 2.0 for token issuance', 400)
-
 @auth_bp.route('/me', methods=['GET'])
 @auth_required
 def current_user():
@@ -186,10 +187,12 @@ def revoke_token():
     """OAuth 2.0 token revocation endpoint."""
     return authorization.create_endpoint_response('revocation')
 
-@auth_bp.route('/introspect', methods=['POST'])
-def introspect_token():
-    """OAuth 2.0 token introspection endpoint."""
-    # Only authenticated clients can introspect tokens
+def authenticate_introspection_client():
+    """Authenticate the client calling an introspection endpoint.
+    
+    Returns:
+        An error response tuple, or None if the client is authenticated.
+    """
     auth = request.authorization
     if not auth:
         return error_response('Client authentication required', 401)
@@ -198,28 +201,75 @@ def introspect_token():
     if not client or not client.check_client_secret(auth.password):
         return error_response('Invalid client credentials', 401)
     
-    token = request.form.get('token')
-    if not token:
-        return error_response('Token is required', 400)
-    
-    token_data = OAuth2Token.get_by_access_token(token)
-    if not token_data:
-        return jsonify({'active': False})
-    
-    # Check if token is expired
-    if token_data['expires_at'] < datetime.utcnow():
-        return jsonify({'active': False})
+    return None
+
+def introspection_response(token_data):
+    """Build an RFC 7662 introspection response for a token document."""
+    if not token_data or seconds_until(token_data['expires_at']) <= 0:
+        return {'active': False}
     
     response = {
         'active': True,
         'client_id': token_data['client_id'],
         'token_type': token_data['token_type'],
         'scope': token_data.get('scope', ''),
-        'exp': int(token_data['expires_at'].timestamp()),
-        'iat': int(token_data['issued_at'].timestamp())
+        'exp': int(as_utc(token_data['expires_at']).timestamp()),
+        'iat': int(as_utc(token_data['issued_at']).timestamp())
     }
     
-    if 'user_id' in token_data:
+    if token_data.get('user_id'):
         response['sub'] = token_data['user_id']
     
-    return jsonify(response) 
\ No newline at end of file
+    return response
+
+def with_cache_hint(payload, responses):
+    """Attach a Cache-Control max-age no longer than any active token's lifetime."""
+    max_age = current_app.config.get('INTROSPECTION_CACHE_MAX_AGE', 0)
+    now = time.time()
+    for response in responses:
+        if response['active']:
+            max_age = min(max_age, int(response['exp'] - now))
+    
+    result = jsonify(payload)
+    if max_age > 0:
+        result.headers['Cache-Control'] = f'private, max-age={max_age}'
+    else:
+        result.headers['Cache-Control'] = 'no-store'
+    return result
+
+@auth_bp.route('/introspect', methods=['POST'])
+def introspect_token():
+    """OAuth 2.0 token introspection endpoint."""
+    # Only authenticated clients can introspect tokens
+    error = authenticate_introspection_client()
+    if error:
+        return error
+    
+    token = request.form.get('token')
+    if not token:
+        return error_response('Token is required', 400)
+    
+    response = introspection_response(OAuth2Token.lookup(token))
+    return with_cache_hint(response, [response])
+
+@auth_bp.route('/introspect/batch', methods=['POST'])
+def introspect_tokens():
+    """Introspect a list of tokens with one client check and one query."""
+    error = authenticate_introspection_client()
+    if error:
+        return error
+    
+    data = request.get_json(silent=True)
+    tokens = data.get('tokens') if data else None
+    if not isinstance(tokens, list) or not tokens:
+        return error_response('A non-empty tokens list is required', 400)
+    if not all(isinstance(token, str) for token in tokens):
+        return error_response('Tokens must be strings', 400)
+    
+    limit = current_app.config.get('INTROSPECTION_BATCH_LIMIT', 100)
+    if len(tokens) > limit:
+        return error_response(f'At most {limit} tokens per request', 413)
+    
+    found = OAuth2Token.lookup_many(tokens)
+    responses = [introspection_response(found[token]) for token in tokens]
+    return with_cache_hint({'tokens': responses}, responses)
@@ -2,9 +2,12 @@
 Health check routes for the API.
 """
 from flask import Blueprint, current_app, jsonify, g
-from app.models.mongodb import get_mongo_client, mongo
+from app.models.mongodb import get_mongo_client, mongo, conversation_buffer
 from pymongo.errors import ConnectionFailure
 from app.utils.response import success_response, error_response
+from app.utils.cache import cache_stats
+from app.utils.passwords import password_hasher
+import os
 import time
 
 health_bp = Blueprint('health', __name__, url_prefix='/health')
@@ -78,4 +81,28 @@ def db_health_check():
             message=f"Database connection failed",
             status_code=500,
             trace=str(e)
-        ) 
\ No newline at end of file
+        ) 
+
+@health_bp.route('/cache', methods=['GET'])
+def cache_health_check():
+    """In-process cache statistics for this worker."""
+    return success_response(
+        data=cache_stats(),
+        meta={"pid": os.getpid()}
+    )
+
+@health_bp.route('/passwords', methods=['GET'])
+def password_hashing_health_check():
+    """Password hashing latency and capacity for this worker."""
+    return success_response(
+        data=password_hasher.stats(),
+        meta={"pid": os.getpid()}
+    )
+
+@health_bp.route('/writes', methods=['GET'])
+def write_buffer_health_check():
+    """Write-behind buffer depth and flush counters for this worker."""
+    return success_response(
+        data={'conversations': conversation_buffer.stats()},
+        meta={"pid": os.getpid()}
+    )
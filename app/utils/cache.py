@@ -0,0 +1,354 @@
+"""
+Caching utilities.
+
+Caches live in each worker process. When a Redis client is configured on
+``shared_cache``, ``TTLCache`` instances read and write through to Redis as a
+second level, and invalidations are broadcast over pub/sub so every worker
+drops its local copy.
+"""
+import json
+import logging
+import math
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+import redis
+
+logger = logging.getLogger(__name__)
+
+# Returned by TTLCache.get when a key is absent or expired. A cached value of
+# None is a legitimate (negative) entry and is distinct from MISSING.
+MISSING = object()
+
+_registry = {}
+
+class SharedCacheTier:
+    """Redis-backed second cache level and invalidation channel.
+
+    Redis failures are logged and treated as misses so a Redis outage
+    degrades to per-worker caching instead of failing requests.
+    """
+
+    CHANNEL = 'cache:invalidate'
+
+    def __init__(self):
+        self.client = None
+        self.namespace = 'cache'
+        self.sender = uuid.uuid4().hex
+        self.received = 0
+        self._listener = None
+
+    @property
+    def enabled(self):
+        return self.client is not None
+
+    def configure(self, url=None, client=None, namespace=None):
+        """Attach a Redis client, or build one from url."""
+        if client is None and url:
+            client = redis.Redis.from_url(url)
+        self.client = client
+        if namespace:
+            self.namespace = namespace
+
+    def _key(self, cache_name, key):
+        return f'{self.namespace}:{cache_name}:{key}'
+
+    def get(self, cache_name, key):
+        """Return (value, remaining seconds) from Redis, or (MISSING, 0)."""
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            pipe.get(self._key(cache_name, key))
+            pipe.pttl(self._key(cache_name, key))
+            raw, pttl = pipe.execute()
+        except redis.RedisError as e:
+            logger.warning(f"Shared cache read failed: {e}")
+            return MISSING, 0
+        if raw is None or pttl <= 0:
+            return MISSING, 0
+        return pickle.loads(raw), pttl / 1000
+
+    def set(self, cache_name, key, value, ttl):
+        """Store value in Redis for ttl seconds."""
+        try:
+            self.client.set(
+                self._key(cache_name, key),
+                pickle.dumps(value),
+                px=max(1, math.ceil(ttl * 1000))
+            )
+        except redis.RedisError as e:
+            logger.warning(f"Shared cache write failed: {e}")
+
+    def delete(self, cache_name, keys):
+        """Remove keys from Redis."""
+        try:
+            self.client.delete(*(self._key(cache_name, key) for key in keys))
+        except redis.RedisError as e:
+            logger.warning(f"Shared cache delete failed: {e}")
+
+    def publish(self, cache_name, keys=None):
+        """Tell other workers to evict keys, or the whole cache if keys is None."""
+        message = json.dumps({
+            'sender': self.sender,
+            'cache': cache_name,
+            'keys': list(keys) if keys is not None else None
+        })
+        try:
+            self.client.publish(self.CHANNEL, message)
+        except redis.RedisError as e:
+            logger.warning(f"Cache invalidation broadcast failed: {e}")
+
+    def handle_message(self, message):
+        """Apply an invalidation published by another worker."""
+        payload = json.loads(message['data'])
+        if payload['sender'] == self.sender:
+            return
+        cache = _registry.get(payload['cache'])
+        if cache is None:
+            return
+        self.received += 1
+        if payload['keys'] is None:
+            cache.invalidate(broadcast=False)
+        else:
+            cache.evict(*payload['keys'])
+
+    def start_listener(self):
+        """Subscribe to invalidations on a daemon thread (once per process)."""
+        if self._listener is not None and self._listener.is_alive():
+            return
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{self.CHANNEL: self.handle_message})
+        self._listener = pubsub.run_in_thread(
+            sleep_time=1,
+            daemon=True,
+            exception_handler=self._listener_error
+        )
+
+    @staticmethod
+    def _listener_error(e, pubsub, thread):
+        logger.warning(f"Cache invalidation listener error: {e}")
+        time.sleep(1)
+
+    def stop_listener(self):
+        """Stop the subscriber thread, if running."""
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+
+shared_cache = SharedCacheTier()
+
+class TTLCache:
+    """Bounded, thread-safe LRU cache with per-entry expiry.
+
+    Entries are evicted least-recently-used first once ``maxsize`` is reached
+    and are dropped lazily when read after their expiry. Caching None records
+    a negative lookup and uses the shorter ``negative_ttl`` by default.
+    """
+
+    def __init__(self, name, maxsize=1024, ttl=60, negative_ttl=5):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        _registry[name] = self
+
+    def configure(self, maxsize=None, ttl=None, negative_ttl=None):
+        """Update cache limits, trimming entries that no longer fit."""
+        with self._lock:
+            if maxsize is not None:
+                self.maxsize = maxsize
+            if ttl is not None:
+                self.ttl = ttl
+            if negative_ttl is not None:
+                self.negative_ttl = negative_ttl
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get(self, key, default=MISSING):
+        """Return the cached value for key, or default if absent or expired."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires > now:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+
+        if shared_cache.enabled:
+            value, remaining = shared_cache.get(self.name, key)
+            if value is not MISSING:
+                self._store(key, value, remaining)
+                with self._lock:
+                    self.hits += 1
+                    self.shared_hits += 1
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return default
+
+    def set(self, key, value, ttl=None):
+        """Cache value under key for ttl seconds (defaults to the cache TTL)."""
+        if ttl is None:
+            ttl = self.negative_ttl if value is None else self.ttl
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        self._store(key, value, ttl)
+        if shared_cache.enabled:
+            shared_cache.set(self.name, key, value, ttl)
+
+    def _store(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, *keys):
+        """Remove keys from every tier and from other workers' local caches."""
+        if not keys:
+            return
+        self.evict(*keys)
+        if shared_cache.enabled:
+            shared_cache.delete(self.name, keys)
+            shared_cache.publish(self.name, keys)
+
+    def evict(self, *keys):
+        """Remove keys from this worker's local cache only."""
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def invalidate(self, broadcast=True):
+        """Drop every local entry, telling other workers to do the same."""
+        with self._lock:
+            self._data.clear()
+        if broadcast and shared_cache.enabled:
+            shared_cache.publish(self.name)
+
+    def clear(self):
+        """Drop all local entries and reset the counters."""
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.shared_hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Return a snapshot of the cache counters."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'negative_ttl': self.negative_ttl,
+                'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+class SnapshotCache:
+    """Periodically reloaded in-memory copy of a small collection.
+
+    ``loader`` returns a mapping that replaces the snapshot whenever it is
+    older than ``refresh_interval`` seconds, or on the next lookup after a
+    write to ``collection`` marks it stale (at most once per
+    ``min_reload_interval``). Individual lookups never fall through to the
+    loader, so keys absent from the snapshot are rejected from memory.
+    """
+
+    def __init__(self, name, loader, collection=None, refresh_interval=60,
+                 min_reload_interval=1):
+        self.name = name
+        self.loader = loader
+        self.collection = collection
+        self.refresh_interval = refresh_interval
+        self.min_reload_interval = min_reload_interval
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self._data = {}
+        self._loaded_at = None
+        self._stale = False
+        self._lock = threading.Lock()
+        _registry[name] = self
+
+    def configure(self, refresh_interval=None):
+        """Update the reload interval."""
+        if refresh_interval is not None:
+            self.refresh_interval = refresh_interval
+
+    def _needs_reload(self, now):
+        if self._loaded_at is None:
+            return True
+        age = now - self._loaded_at
+        if self._stale:
+            return age >= self.min_reload_interval
+        return age > self.refresh_interval
+
+    def _snapshot(self):
+        if self._needs_reload(time.monotonic()):
+            with self._lock:
+                if self._needs_reload(time.monotonic()):
+                    self._stale = False
+                    self._data = dict(self.loader())
+                    self._loaded_at = time.monotonic()
+                    self.reloads += 1
+        return self._data
+
+    def get(self, key, default=MISSING):
+        """Return the snapshot value for key, or default if absent."""
+        value = self._snapshot().get(key, MISSING)
+        if value is MISSING:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        """Add an entry written by this process ahead of the next reload."""
+        with self._lock:
+            self._data = {**self._data, key: value}
+
+    def evict(self, *keys):
+        """Snapshots are reloaded wholesale, so any eviction marks them stale."""
+        self.invalidate(broadcast=False)
+
+    def invalidate(self, broadcast=True):
+        """Reload on the next lookup, telling other workers to do the same."""
+        self._stale = True
+        if broadcast and shared_cache.enabled:
+            shared_cache.publish(self.name)
+
+    def stats(self):
+        """Return a snapshot of the cache counters."""
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'refresh_interval': self.refresh_interval,
+            'reloads': self.reloads,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+def notify_write(collection):
+    """Mark snapshots of collection stale in every worker after a write."""
+    for cache in list(_registry.values()):
+        if getattr(cache, 'collection', None) == collection:
+            cache.invalidate()
+
+def cache_stats():
+    """Return counters for every cache created in this process."""
+    return {name: cache.stats() for name, cache in _registry.items()}
@@ -5,6 +5,7 @@ import functools
 from flask import request, jsonify, current_app, g
 from app.models.mongodb import ApiKey, require_oauth
 from app.utils.response import error_response, APIResponse
+from app.utils.scopes import scope_registry
 
 def require_api_key(f):
     """Decorator to require a valid API key for route access."""
@@ -44,10 +45,16 @@ def api_key_required(func):
 def auth_required(scopes=None):
     """Decorator for requiring OAuth 2.0 authentication.
     
+    The required scopes are compiled to a bitmask once, when the route is
+    decorated; each request then checks them with a single AND against the
+    mask the token carries.
+    
     Args:
         scopes (str, optional): Space-separated list of required scopes.
     """
     def decorator(func):
+        required_mask = scope_registry.mask(scopes)
+        
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
             # Support legacy API key authentication during transition
@@ -58,20 +65,19 @@ def auth_required(scopes=None):
             
             # OAuth 2.0 authentication
             try:
-                # Use the require_oauth decorator from Authlib
-                if scopes:
-                    token = require_oauth.acquire_token(scopes)
-                else:
-                    token = require_oauth.acquire_token()
-                
-                # Store user info in Flask's g for use in the route
-                if token and 'user_id' in token:
-                    g.user_id = token['user_id']
-                
-                return func(*args, **kwargs)
+                token = require_oauth.acquire_token()
             except Exception as e:
                 current_app.logger.error(f"OAuth authentication error: {str(e)}")
                 return error_response('Authentication required', status_code=401)
+            
+            if not token.has_scopes(required_mask):
+                return error_response('Insufficient scope', status_code=403)
+            
+            # Store user info in Flask's g for use in the route
+            if 'user_id' in token:
+                g.user_id = token['user_id']
+            
+            return func(*args, **kwargs)
         
         return wrapper
     
@@ -0,0 +1,323 @@
+"""
+Password hashing.
+
+Hashing runs in a small process pool so a slow KDF does not hold the
+calling worker's GIL, and at most ``max_concurrency`` hashes are queued or
+running per worker. Callers that cannot get a slot within ``timeout``
+seconds get ``PasswordHashingBusy`` instead of piling up behind a login
+burst.
+"""
+import base64
+import binascii
+import hashlib
+import hmac
+import logging
+import multiprocessing
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+try:
+    import argon2
+except ImportError:  # pragma: no cover - optional dependency
+    argon2 = None
+
+logger = logging.getLogger(__name__)
+
+class PasswordHashingBusy(Exception):
+    """Raised when no hashing slot frees up within the configured timeout."""
+
+class Sha256Hasher:
+    """Unsalted SHA-256 digests written by earlier releases (verify only)."""
+
+    algorithm = 'sha256'
+
+    def identify(self, encoded):
+        return len(encoded) == 64 and all(c in '0123456789abcdef' for c in encoded)
+
+    def hash(self, password):
+        raise ValueError('SHA-256 is only supported for verifying legacy hashes')
+
+    def verify(self, password, encoded):
+        return hmac.compare_digest(
+            hashlib.sha256(password.encode()).hexdigest(), encoded
+        )
+
+    def needs_rehash(self, encoded):
+        return True
+
+class ScryptHasher:
+    """scrypt from the standard library, encoded as ``scrypt$n$r$p$salt$hash``.
+
+    Args:
+        work_factor (int): log2 of the CPU/memory cost ``n``.
+        block_size (int): scrypt ``r``.
+        parallelism (int): scrypt ``p``.
+    """
+
+    algorithm = 'scrypt'
+
+    def __init__(self, work_factor=15, block_size=8, parallelism=1):
+        self.n = 2 ** work_factor
+        self.r = block_size
+        self.p = parallelism
+
+    def identify(self, encoded):
+        return encoded.startswith('scrypt$')
+
+    @staticmethod
+    def _derive(password, salt, n, r, p):
+        return hashlib.scrypt(
+            password.encode(), salt=salt, n=n, r=r, p=p,
+            maxmem=256 * n * r, dklen=32
+        )
+
+    def hash(self, password):
+        salt = secrets.token_bytes(16)
+        digest = self._derive(password, salt, self.n, self.r, self.p)
+        return '$'.join([
+            self.algorithm, str(self.n), str(self.r), str(self.p),
+            base64.b64encode(salt).decode(), base64.b64encode(digest).decode()
+        ])
+
+    def verify(self, password, encoded):
+        try:
+            _, n, r, p, salt, digest = encoded.split('$')
+            derived = self._derive(password, base64.b64decode(salt), int(n), int(r), int(p))
+            return hmac.compare_digest(derived, base64.b64decode(digest))
+        except (ValueError, binascii.Error):
+            # A malformed stored hash matches nothing
+            return False
+
+    def needs_rehash(self, encoded):
+        try:
+            _, n, r, p, _, _ = encoded.split('$')
+            return (int(n), int(r), int(p)) != (self.n, self.r, self.p)
+        except ValueError:
+            return True
+
+class Argon2Hasher:
+    """argon2id via ``argon2-cffi``; ``work_factor`` is the time cost."""
+
+    algorithm = 'argon2'
+
+    def __init__(self, work_factor=3, memory_cost=65536, parallelism=4):
+        if argon2 is None:
+            raise ValueError('argon2 password hashing requires the argon2-cffi package')
+        self.time_cost = work_factor
+        self.memory_cost = memory_cost
+        self.parallelism = parallelism
+
+    @property
+    def _hasher(self):
+        return argon2.PasswordHasher(
+            time_cost=self.time_cost,
+            memory_cost=self.memory_cost,
+            parallelism=self.parallelism
+        )
+
+    def identify(self, encoded):
+        return encoded.startswith('$argon2')
+
+    def hash(self, password):
+        return self._hasher.hash(password)
+
+    def verify(self, password, encoded):
+        try:
+            return self._hasher.verify(encoded, password)
+        except (argon2.exceptions.VerificationError, argon2.exceptions.InvalidHashError):
+            return False
+
+    def needs_rehash(self, encoded):
+        return self._hasher.check_needs_rehash(encoded)
+
+HASHERS = {
+    'scrypt': ScryptHasher,
+    'argon2': Argon2Hasher,
+}
+
+def _hash(hasher, password):
+    return hasher.hash(password)
+
+def _verify(hasher, password, encoded):
+    return hasher.verify(password, encoded)
+
+class PasswordHasher:
+    """Hashes new passwords with the configured algorithm and verifies any known format.
+
+    ``pool_size`` of 0 hashes inline in the calling thread, which is what
+    the CLI and tests want; otherwise a per-process pool is started lazily
+    so it is created after gunicorn forks its workers. Pool processes come
+    from a forkserver rather than forking the worker itself, whose other
+    threads may be holding locks at the time.
+    """
+
+    def __init__(self):
+        self.hasher = ScryptHasher()
+        self.legacy = [Sha256Hasher()]
+        self.pool_size = 0
+        self.max_concurrency = 4
+        self.timeout = 5
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self._dummy = None
+        self._pool = None
+        self._pool_pid = None
+        self._pool_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._reset_stats()
+
+    def configure(self, algorithm='scrypt', work_factor=None, pool_size=0,
+                  max_concurrency=4, timeout=5):
+        """Select the hashing algorithm and size the worker pool.
+
+        Args:
+            algorithm (str): ``scrypt`` or ``argon2``.
+            work_factor (int): Algorithm cost; log2(n) for scrypt, time cost
+                for argon2. None keeps the algorithm default.
+            pool_size (int): Hashing processes per worker, 0 to hash inline.
+            max_concurrency (int): Hashes allowed in flight per worker.
+            timeout (float): Seconds to wait for a free slot.
+        """
+        if algorithm not in HASHERS:
+            raise ValueError(f'Unknown password hashing algorithm: {algorithm}')
+        kwargs = {'work_factor': work_factor} if work_factor is not None else {}
+        self.hasher = HASHERS[algorithm](**kwargs)
+        self._dummy = None
+        self.legacy = [Sha256Hasher()] + [
+            cls() for name, cls in HASHERS.items()
+            if name != algorithm and (name != 'argon2' or argon2 is not None)
+        ]
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self.shutdown()
+        self.pool_size = pool_size
+
+    def _executor(self):
+        if self._pool is None or self._pool_pid != os.getpid():
+            with self._pool_lock:
+                if self._pool is None or self._pool_pid != os.getpid():
+                    self._pool = ProcessPoolExecutor(
+                        max_workers=self.pool_size,
+                        mp_context=multiprocessing.get_context('forkserver')
+                    )
+                    self._pool_pid = os.getpid()
+        return self._pool
+
+    def _discard(self, pool):
+        """Drop a broken pool so the next call starts a fresh one."""
+        with self._pool_lock:
+            if self._pool is pool:
+                self._pool = None
+                self._pool_pid = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def _submit(self, func, *args):
+        # A hashing process that died (e.g. OOM-killed) breaks the whole
+        # pool; replace it and retry once rather than failing every call
+        for attempt in range(2):
+            pool = self._executor()
+            try:
+                return pool.submit(func, *args).result()
+            except BrokenProcessPool:
+                logger.warning("Password hashing pool broke; starting a new one")
+                self._discard(pool)
+                if attempt:
+                    raise
+
+    def shutdown(self):
+        """Stop the hashing pool, if one was started in this process."""
+        if self._pool is not None and self._pool_pid == os.getpid():
+            self._pool.shutdown(wait=False, cancel_futures=True)
+        self._pool = None
+        self._pool_pid = None
+
+    def _run(self, operation, func, *args):
+        queued = time.perf_counter()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._stats_lock:
+                self._rejected += 1
+            raise PasswordHashingBusy('Password hashing is at capacity')
+        try:
+            started = time.perf_counter()
+            if self.pool_size:
+                result = self._submit(func, *args)
+            else:
+                result = func(*args)
+            finished = time.perf_counter()
+        finally:
+            self._slots.release()
+        self._record(operation, started - queued, finished - started)
+        return result
+
+    def _record(self, operation, waited, elapsed):
+        with self._stats_lock:
+            stats = self._stats[operation]
+            stats['count'] += 1
+            stats['total'] += elapsed
+            stats['max'] = max(stats['max'], elapsed)
+            stats['wait_total'] += waited
+
+    def _reset_stats(self):
+        self._rejected = 0
+        self._stats = {
+            operation: {'count': 0, 'total': 0.0, 'max': 0.0, 'wait_total': 0.0}
+            for operation in ('hash', 'verify')
+        }
+
+    def hash(self, password):
+        """Return an encoded hash of password using the configured algorithm."""
+        return self._run('hash', _hash, self.hasher, password)
+
+    def verify(self, password, encoded):
+        """Check password against a stored hash of any supported format.
+
+        Returns:
+            tuple: ``(valid, needs_rehash)``; ``needs_rehash`` is True when
+            the hash uses a legacy algorithm or outdated cost parameters.
+        """
+        for hasher in [self.hasher] + self.legacy:
+            if hasher.identify(encoded):
+                break
+        else:
+            return False, False
+        if not self._run('verify', _verify, hasher, password, encoded):
+            return False, False
+        return True, hasher is not self.hasher or hasher.needs_rehash(encoded)
+
+    def verify_dummy(self, password):
+        """Spend as long as verifying password against a real hash, and fail.
+
+        Called when the user does not exist, so a login for an unknown
+        username takes as long as one with a wrong password and response
+        times do not reveal which usernames exist.
+        """
+        if self._dummy is None:
+            self._dummy = self.hasher.hash(secrets.token_urlsafe(16))
+        self._run('verify', _verify, self.hasher, password, self._dummy)
+        return False, False
+
+    def stats(self):
+        """Return hashing latency counters for this worker."""
+        with self._stats_lock:
+            operations = {
+                operation: {
+                    'count': stats['count'],
+                    'avg_ms': round(stats['total'] / stats['count'] * 1000, 2) if stats['count'] else 0.0,
+                    'max_ms': round(stats['max'] * 1000, 2),
+                    'avg_wait_ms': round(stats['wait_total'] / stats['count'] * 1000, 2) if stats['count'] else 0.0
+                }
+                for operation, stats in self._stats.items()
+            }
+            return {
+                'algorithm': self.hasher.algorithm,
+                'pool_size': self.pool_size,
+                'max_concurrency': self.max_concurrency,
+                'rejected': self._rejected,
+                **operations
+            }
+
+password_hasher = PasswordHasher()
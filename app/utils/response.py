@@ -4,7 +4,13 @@ Response utilities for standardized API responses.
 import functools
 import time
 from datetime import datetime
-from flask import jsonify, request, g
+from flask import jsonify, request, g, current_app, Response, stream_with_context
+
+# Streaming formats accepted by stream_response, with their content types
+STREAM_FORMATS = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson'
+}
 
 # Helper function to track request duration
 def start_timer():
@@ -135,4 +141,82 @@ def error_response(message, status_code=400, error_code=None, trace=None):
         }
     }
     
-    return jsonify(response), status_code 
\ No newline at end of file
+    return jsonify(response), status_code 
+
+def stream_response(items, key, meta=None, fmt='json'):
+    """
+    Build a standard response streamed from an iterable such as a cursor.
+    
+    Items are serialized one at a time, so memory use does not grow with
+    the number of items. ``json`` streams the usual envelope with the items
+    under ``data[key]``; ``ndjson`` writes one item per line followed by a
+    final envelope line with empty ``data``. ``meta`` gains a ``count`` and,
+    because the status line is already sent, a failure while iterating is
+    reported in the trailing ``error``.
+    
+    Args:
+        items: Iterable of JSON-serializable documents.
+        key: Name of the list in ``data`` (``json`` format).
+        meta: Additional metadata to include in the response.
+        fmt: ``json`` or ``ndjson``.
+        
+    Returns:
+        A streaming response.
+        
+    Raises:
+        ValueError: If fmt is not a supported streaming format.
+    """
+    if fmt not in STREAM_FORMATS:
+        raise ValueError(f"Unsupported stream format: {fmt}")
+    
+    start_time = getattr(g, 'start_time', time.time())
+    dumps = current_app.json.dumps
+    
+    def generate():
+        count = 0
+        error = None
+        if fmt == 'json':
+            yield '{"data": {' + dumps(key) + ': ['
+        try:
+            for item in items:
+                if fmt == 'json':
+                    yield (', ' if count else '') + dumps(item)
+                else:
+                    yield dumps(item) + '\n'
+                count += 1
+        except Exception as e:
+            current_app.logger.error(f"Streaming response interrupted: {str(e)}")
+            error = {
+                'code': 500,
+                'message': 'Response stream interrupted',
+                'trace': str(e) if current_app.debug else None
+            }
+        
+        trailer = {
+            'meta': {**(meta or {}), 'count': count},
+            'duration': f"{(time.time() - start_time) * 1000:.2f}ms",
+            'error': error
+        }
+        if fmt == 'json':
+            yield ']}, ' + dumps(trailer)[1:]
+        else:
+            yield dumps({'data': {}, **trailer}) + '\n'
+    
+    return Response(stream_with_context(generate()), mimetype=STREAM_FORMATS[fmt])
+
+def sse_event(data, event_id=None):
+    """
+    Format one Server-Sent Event carrying data as JSON.
+    
+    Args:
+        data: JSON-serializable event payload.
+        event_id: Optional id, sent back by clients as ``Last-Event-ID``.
+        
+    Returns:
+        str: The event, terminated by a blank line.
+    """
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'data: {current_app.json.dumps(data)}')
+    return '\n'.join(lines) + '\n\n'
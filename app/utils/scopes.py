@@ -0,0 +1,41 @@
+"""
+Scope interning for constant-time scope checks.
+"""
+import threading
+
+class ScopeRegistry:
+    """Interns scope names into bit positions of an integer mask.
+
+    Bits are assigned in first-seen order and are only meaningful inside
+    the current process, so masks must never be persisted or shared; store
+    scope strings and compute masks on load.
+    """
+
+    def __init__(self):
+        self._bits = {}
+        self._lock = threading.Lock()
+
+    def bit(self, name):
+        """Return the bit for a scope name, interning it on first use."""
+        bit = self._bits.get(name)
+        if bit is None:
+            with self._lock:
+                bit = self._bits.setdefault(name, 1 << len(self._bits))
+        return bit
+
+    def mask(self, scopes):
+        """Compile a space-separated string or iterable of scopes to a mask."""
+        if not scopes:
+            return 0
+        if isinstance(scopes, str):
+            scopes = scopes.split()
+        mask = 0
+        for name in scopes:
+            mask |= self.bit(name)
+        return mask
+
+    def names(self, mask):
+        """Return the scope names set in mask."""
+        return [name for name, bit in self._bits.items() if mask & bit]
+
+scope_registry = ScopeRegistry()
@@ -53,8 +53,13 @@ cd /app
 PYTHONPATH=/app python -c "from app.init_db import init_db; init_db()"
 
 echo "Starting application..."
+# Each open conversation stream (SSE) holds one of a worker's threads until it
+# closes. CONVERSATION_STREAM_MAX_PER_WORKER (default 4) caps them below
+# --threads so the remaining threads keep serving ordinary requests; raise
+# both together, or add workers, to serve more concurrent listeners
 exec gunicorn --bind 0.0.0.0:5000 \
     --workers 4 \
+    --threads 8 \
     --timeout 120 \
     --access-logfile - \
     --error-logfile - \
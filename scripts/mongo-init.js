@@ -33,25 +33,38 @@ createCollectionIfNotExists('api_keys');
 createCollectionIfNotExists('projects');
 createCollectionIfNotExists('documents');
 createCollectionIfNotExists('conversations');
+createCollectionIfNotExists('conversation_buckets');
+createCollectionIfNotExists('conversation_archive');
 
 // OAuth 2.0 related collections
 createCollectionIfNotExists('oauth_clients');
 createCollectionIfNotExists('oauth_tokens');
 createCollectionIfNotExists('users');
+createCollectionIfNotExists('revoked_tokens');
 
 // Create indexes
+// The application models declare the full index set (see INDEXES in
+// app/models/mongodb.py); init_db syncs them on every start.
 createIndexIfNotExists('api_keys', { "key": 1 }, { unique: true });
 createIndexIfNotExists('projects', { "project_id": 1 }, { unique: true });
-createIndexIfNotExists('documents', { "project_id": 1 });
-createIndexIfNotExists('documents', { "project_id": 1, "document_type": 1 });
-createIndexIfNotExists('conversations', { "project_id": 1, "timestamp": 1 });
+createIndexIfNotExists('projects', { "user_id": 1, "created_at": 1, "_id": 1 });
+createIndexIfNotExists('documents', { "project_id": 1, "created_at": 1, "_id": 1 });
+createIndexIfNotExists('documents', { "project_id": 1, "document_type": 1, "created_at": 1, "_id": 1 });
+createIndexIfNotExists('conversations', { "project_id": 1, "timestamp": 1, "_id": 1 });
+createIndexIfNotExists('conversation_buckets', { "project_id": 1, "window": 1 });
+createIndexIfNotExists('conversation_buckets', { "project_id": 1, "start": 1, "end": 1, "_id": 1 });
+createIndexIfNotExists('conversation_buckets', { "project_id": 1, "end": 1, "start": 1, "_id": 1 });
+createIndexIfNotExists('conversation_archive', { "project_id": 1, "start": 1, "end": 1, "_id": 1 });
+createIndexIfNotExists('conversation_archive', { "project_id": 1, "end": 1, "start": 1, "_id": 1 });
 
 // OAuth 2.0 related indexes
 createIndexIfNotExists('oauth_clients', { "client_id": 1 }, { unique: true });
 createIndexIfNotExists('oauth_tokens', { "access_token": 1 }, { unique: true });
 createIndexIfNotExists('oauth_tokens', { "refresh_token": 1 }, { unique: true, sparse: true });
+createIndexIfNotExists('oauth_tokens', { "client_id": 1, "user_id": 1 }, { unique: true });
 createIndexIfNotExists('users', { "username": 1 }, { unique: true });
 createIndexIfNotExists('users', { "email": 1 }, { unique: true });
+createIndexIfNotExists('revoked_tokens', { "jti": 1 }, { unique: true });
 
 // Insert default OAuth client if specified in environment and doesn't exist
 const apiKey = process.env.API_KEY;